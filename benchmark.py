@@ -0,0 +1,285 @@
+"""
+Benchmarks of the Data4 pipeline on synthetic data.
+
+synthetic_raw() builds a dictionary with the schema of
+Data4/transcription_areas.pkl (object string tables with a 'MISSING' marker,
+word names, area/slice labels and coordinates) for any number of dialects.
+Dialects of one area share a prototype transcription with per-dialect
+variation, and symbol frequencies are Zipf-distributed, so the filtering,
+clustering and embedding steps see realistic structure.
+
+run_benchmark() times every stage (load, filter, distance, cluster, embed,
+render) with wall time, CPU time, the peak of traced allocations and the
+process's peak RSS, and writes the results as JSON. compare_results() reports
+the stages that became slower than in a baseline file.
+
+Usage:
+    python benchmark.py --sizes 1000 10000 50000 --output benchmark_results/current.json
+    python benchmark.py --sizes 1000 --compare benchmark_results/baseline.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import pickle
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from load import load_feats, LoadStats, DatasetRegistry, DATASET_CONFIG
+from storage import save_encoded_raw
+from preprocess import MissingValueFilter, FIELDS
+from distance import cal_distance_codes, DISTANCE_KEYS
+
+BENCHMARK_DIR = 'benchmark_results'
+STAGES = ['load', 'filter', 'distance', 'cluster', 'embed', 'render']
+# 每个字段的符号数 (约为 Data4 中的数量) 和原始数据的规模 (用于按比例缩放频次下限)
+VOCAB_SIZES = {'initial': 120, 'final': 900, 'tone': 80}
+DATA4_CELLS, DATA4_FREQ_CUTOFF = 1289 * 999, 1000
+BENCH_NAME = '_Benchmark' # 基准测试期间临时注册到 DATASET_CONFIG 的数据集名称
+
+
+def synthetic_raw(n_dialects, n_words=999, n_areas=17, missing_rate=0.05, variation=0.3, seed=0):
+    """
+    Synthetic Data4 raw dictionary.
+
+    Args:
+        n_dialects (int): Number of dialects (rows).
+        n_words (int): Number of words (columns).
+        n_areas (int): Number of dialect areas; each has its own prototype transcription.
+        missing_rate (float): Share of cells set to 'MISSING'.
+        variation (float): Share of cells that deviate from the area prototype.
+        seed (int): Random seed.
+
+    Returns:
+        dict: 'word_name', 'area', 'slice', 'slices', 'coords', 'initial', 'final', 'tone'
+              as in load_feats(name='Data4', type='raw').
+    """
+    rng = np.random.default_rng(seed)
+    area_ids = rng.integers(0, n_areas, n_dialects)
+    areas = np.array([f'区{a}' for a in range(n_areas)], dtype=object)
+    slices = np.array([f'片{a}-{s}' for a in range(n_areas) for s in range(4)], dtype=object).reshape(n_areas, 4)
+    slice_ids = rng.integers(0, 4, n_dialects)
+    centers = np.column_stack([rng.uniform(98, 122, n_areas), rng.uniform(20, 42, n_areas)])
+    data = {
+        'word_name': [f'{i + 1:04d}字' for i in range(n_words)],
+        'area': list(areas[area_ids]),
+        'slice': list(slices[area_ids, slice_ids]),
+        'slices': list(slices[area_ids, slice_ids]),
+        'coords': (centers[area_ids] + rng.normal(0, 1.0, (n_dialects, 2))).tolist(),
+    }
+    for field in FIELDS:
+        n_vocab = VOCAB_SIZES[field]
+        # Zipf 分布的符号频率，少数符号占大多数，低频符号会被频次下限过滤
+        weights = 1.0 / np.arange(1, n_vocab + 1) ** 1.5
+        weights /= weights.sum()
+        prototypes = rng.choice(n_vocab, size=(n_areas, n_words), p=weights)
+        codes = prototypes[area_ids]
+        deviate = rng.random(codes.shape) < variation
+        codes[deviate] = rng.choice(n_vocab, size=int(deviate.sum()), p=weights)
+        vocab = np.array(['MISSING'] + [f'{field[0]}{k}' for k in range(n_vocab)], dtype=object)
+        codes = codes + 1
+        codes[rng.random(codes.shape) < missing_rate] = 0
+        data[field] = vocab[codes]
+    return data
+
+
+@contextlib.contextmanager
+def _stage(results, name, trace_memory=True):
+    """Record wall time, CPU time, traced peak and peak RSS of the enclosed block under results[name]."""
+    if trace_memory:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    record = {}
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - wall
+        record['cpu_seconds'] = time.process_time() - cpu
+        if trace_memory:
+            record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+        # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+        scale = 1 if sys.platform == 'darwin' else 1024
+        record['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024 ** 2
+        results[name] = record
+        print(f"  {name}: {record['seconds']:.3f} s")
+
+
+def _register_raw(raw, directory, encoded):
+    """Write the raw dictionary to `directory` and register it as a temporary dataset."""
+    pickle_path = os.path.join(directory, 'transcription_areas.pkl')
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(raw, f)
+    config = dict(DATASET_CONFIG['Data4']['raw'], file=pickle_path,
+                  encoded_dir=os.path.join(directory, 'transcription_codes'))
+    if encoded:
+        save_encoded_raw(raw, output_dir=config['encoded_dir'])
+    DATASET_CONFIG[BENCH_NAME] = {'raw': config}
+
+
+def _run_one(n_dialects, n_words, stages, matrix_limit, encoded, trace_memory, workdir, seed):
+    print(f"\n=== {n_dialects} 个方言, {n_words} 个字 ===")
+    result = {'n_dialects': n_dialects, 'n_words': n_words, 'encoded': encoded, 'stages': {}}
+    timings = result['stages']
+    raw = synthetic_raw(n_dialects, n_words, seed=seed)
+    directory = tempfile.mkdtemp(dir=workdir)
+    _register_raw(raw, directory, encoded)
+    del raw
+    registry = DatasetRegistry() # 每次运行独立的缓存，不影响调用方的全局 REGISTRY
+    try:
+        stats = LoadStats()
+        with _stage(timings, 'load', trace_memory):
+            raw = load_feats(name=BENCH_NAME, type='raw', stats=stats, encoded=encoded, registry=registry)
+        # 第二次读取应全部命中缓存
+        load_feats(name=BENCH_NAME, type='raw', stats=stats, encoded=encoded, registry=registry)
+        result['load_stats'] = {key: value for key, value in stats.as_dict().items() if key != 'records'}
+
+        selection = None
+        if 'filter' in stages or 'distance' in stages:
+            freq_cutoff = max(1, round(DATA4_FREQ_CUTOFF * n_dialects * n_words / DATA4_CELLS))
+            with _stage(timings, 'filter', trace_memory) as record:
+                missing_filter = MissingValueFilter(raw)
+                selection = missing_filter.select(missing_ratio=30, freq_cutoff=freq_cutoff)
+                processed = missing_filter.processed_codes(selection)
+                record.update(rows=len(selection['rows']), cols=len(selection['cols']))
+            areas = np.asarray(missing_filter.meta['area'])[selection['rows']]
+        else:
+            processed = None
+
+        # 完整的 n x n 矩阵只在前 matrix_limit 个方言上计算
+        n_matrix = min(len(selection['rows']) if selection else n_dialects, matrix_limit)
+        result['n_matrix'] = n_matrix
+        overall = embedding = None
+        if 'distance' in stages and processed is not None:
+            with _stage(timings, 'distance', trace_memory):
+                matrices = {key: cal_distance_codes(processed[field][:n_matrix])
+                            for field, key in zip(FIELDS, DISTANCE_KEYS)}
+                overall = (matrices['initials'] + matrices['finals'] + matrices['tones']) / 3
+            del matrices
+
+        if 'cluster' in stages and overall is not None:
+            from cluster import classify
+            with _stage(timings, 'cluster', trace_memory) as record:
+                record['cophenetic'] = float(classify(overall, ks=range(2, 11))['cophenetic'])
+
+        if 'embed' in stages and overall is not None:
+            from embedding import embed
+            with _stage(timings, 'embed', trace_memory):
+                embedding = embed(overall, method='mds', cache=False)
+
+        if 'render' in stages and embedding is not None:
+            from utils import plot_2d_embedding_improved
+            with _stage(timings, 'render', trace_memory):
+                plot_2d_embedding_improved(embedding, areas[:n_matrix], f'MDS ({n_matrix})',
+                                           os.path.join(directory, 'mds.png'), dpi=100)
+    finally:
+        DATASET_CONFIG.pop(BENCH_NAME, None)
+        registry.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def run_benchmark(sizes=(1000, 10000, 50000), n_words=999, stages=STAGES, matrix_limit=10000, encoded=False,
+                  trace_memory=True, output_path=None, workdir=None, seed=0):
+    """
+    Run the pipeline stages on synthetic data of each size.
+
+    Args:
+        sizes (iterable): Numbers of dialects.
+        n_words (int): Number of words.
+        stages (iterable): Subset of STAGES to run ('load' always runs).
+        matrix_limit (int): Stages that need the full [n, n] matrix (distance, cluster, embed, render)
+                            use at most this many dialects; the JSON records it as 'n_matrix'.
+        encoded (bool): Load from the dictionary-encoded format (storage.save_encoded_raw) instead of the pickle.
+        trace_memory (bool): Record the traced allocation peak per stage (tracemalloc slows pure-Python code).
+        output_path (str, optional): JSON file to write. Defaults to benchmark_results/<timestamp>.json.
+        workdir (str, optional): Directory for the temporary files.
+        seed (int): Seed of the synthetic data.
+
+    Returns:
+        dict: 'environment' and 'runs' (one entry per size).
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, available: {STAGES}.")
+    results = {'environment': _environment(), 'runs': []}
+    for n_dialects in sizes:
+        results['runs'].append(_run_one(n_dialects, n_words, set(stages), matrix_limit, encoded, trace_memory,
+                                        workdir, seed))
+
+    if output_path is None:
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        output_path = os.path.join(BENCHMARK_DIR, f'{stamp}.json')
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"成功将基准测试结果保存到: {output_path}")
+    return results
+
+
+def compare_results(baseline, current, threshold=1.2):
+    """
+    Stages that are slower in `current` than in `baseline` by more than `threshold` (ratio of wall times).
+
+    Args:
+        baseline, current: Results dicts or paths of JSON files written by run_benchmark.
+
+    Returns:
+        list: (n_dialects, stage, baseline seconds, current seconds) for each regression.
+    """
+    loaded = []
+    for results in (baseline, current):
+        if isinstance(results, str):
+            with open(results, encoding='utf-8') as f:
+                results = json.load(f)
+        loaded.append({run['n_dialects']: run['stages'] for run in results['runs']})
+    baseline, current = loaded
+
+    regressions = []
+    for n_dialects in sorted(set(baseline) & set(current)):
+        for stage in STAGES:
+            old, new = baseline[n_dialects].get(stage), current[n_dialects].get(stage)
+            if old and new and new['seconds'] > threshold * old['seconds']:
+                regressions.append((n_dialects, stage, old['seconds'], new['seconds']))
+                print(f"变慢: {n_dialects} 个方言, '{stage}': {old['seconds']:.3f} s -> {new['seconds']:.3f} s")
+    if not regressions:
+        print(f"没有耗时超过基准 {threshold:.2f} 倍的阶段。")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--words', type=int, default=999)
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--matrix-limit', type=int, default=10000)
+    parser.add_argument('--encoded', action='store_true', help='load from the dictionary-encoded format')
+    parser.add_argument('--no-trace-memory', action='store_true')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help='baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    current = run_benchmark(args.sizes, n_words=args.words, stages=args.stages, matrix_limit=args.matrix_limit,
+                            encoded=args.encoded, trace_memory=not args.no_trace_memory, output_path=args.output)
+    if args.compare:
+        compare_results(args.compare, current, threshold=args.threshold)
@@ -0,0 +1,189 @@
+"""
+Hierarchical classification of dialects at every level k from one tree.
+
+A distance matrix is clustered once; the merge sequence of the linkage is then
+replayed a single time and the partition is recorded whenever the number of
+clusters reaches one of the requested k, so all levels cost one pass.
+
+The output table follows Data3/cn_tax.csv: location columns, the first three
+classical MDS dimensions d1..d3, and per k a hard assignment 'sharp<k>'
+('Cluster i') next to a graded one 'heat<k>'. For 'heat', every dialect's
+silhouette value within its cluster decides between a core member
+('Cluster i_a'), a peripheral member ('Cluster i_b') and a transitional
+dialect ('Z').
+"""
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.cluster.hierarchy import linkage, cophenet
+from scipy.spatial.distance import squareform
+
+from distance import prepare_distances
+from embedding import classical_mds
+
+DEFAULT_KS = range(2, 11)
+
+
+def cut_levels(Z, ks=DEFAULT_KS):
+    """
+    Flat clusters of a linkage for every k in one pass over its merges.
+
+    Cluster numbers 1..k follow the first appearance of each cluster in leaf order,
+    so labels are stable for the same tree.
+
+    Returns:
+        dict: k -> int array [n] of labels in 1..k.
+    """
+    n = len(Z) + 1
+    wanted = {k for k in ks if 1 <= k <= n}
+    members = {i: [i] for i in range(n)}
+    root = np.arange(n) # 每个叶子当前所属的簇编号 (linkage 中的节点号)
+    levels = {}
+    if n in wanted:
+        levels[n] = root.copy()
+    for step, (left, right) in enumerate(Z[:, :2].astype(np.int64)):
+        merged = members.pop(left) + members.pop(right)
+        members[n + step] = merged
+        root[merged] = n + step
+        if n - step - 1 in wanted:
+            levels[n - step - 1] = root.copy()
+
+    labels = {}
+    for k, nodes in levels.items():
+        _, first, inverse = np.unique(nodes, return_index=True, return_inverse=True)
+        rank = np.argsort(np.argsort(first))
+        labels[k] = rank[inverse.ravel()] + 1
+    return {k: labels[k] for k in sorted(labels)}
+
+
+def silhouettes(dist, labels):
+    """
+    Silhouette value of every dialect for one partition of k >= 2 clusters.
+
+    Dialects in singleton clusters and dialects with a == b == 0 (e.g. duplicates
+    at zero distance from everything around them) get 0.
+    """
+    n_clusters = labels.max()
+    if len(np.unique(labels)) < 2:
+        raise ValueError("Silhouettes need at least 2 clusters.")
+    onehot = np.zeros((len(labels), n_clusters))
+    onehot[np.arange(len(labels)), labels - 1] = 1
+    sizes = onehot.sum(axis=0)
+    sums = dist @ onehot # 到每个簇的距离之和，[n, k]
+    own = labels - 1
+    own_size = sizes[own] - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = sums[np.arange(len(labels)), own] / own_size
+        means = sums / sizes
+    means[:, sizes == 0] = np.inf # 跳过的标签编号不算作邻近簇
+    means[np.arange(len(labels)), own] = np.inf
+    b = means.min(axis=1)
+    scale = np.maximum(a, b)
+    s = np.zeros(len(labels))
+    defined = (own_size > 0) & (scale > 0)
+    s[defined] = (b[defined] - a[defined]) / scale[defined]
+    return s
+
+
+def heat_labels(dist, labels, thresholds=(0.05, 0.2)):
+    """
+    Graded cluster membership: 'Cluster i_a' (silhouette >= thresholds[1]),
+    'Cluster i_b' (>= thresholds[0]) or 'Z' (transitional, also for undefined silhouettes).
+    """
+    s = silhouettes(dist, labels)
+    heat = np.array([f'Cluster {label}_a' for label in labels], dtype=object)
+    peripheral = s < thresholds[1]
+    heat[peripheral] = [f'Cluster {label}_b' for label in labels[peripheral]]
+    heat[~(s >= thresholds[0])] = 'Z' # NaN 也归为过渡区
+    return heat
+
+
+def classify(matrix, ks=DEFAULT_KS, method='average', nan_policy='max', heat_thresholds=(0.05, 0.2)):
+    """
+    Cluster one distance matrix and cut the tree at every k.
+
+    Args:
+        matrix: Any matrix from load_feats(type='distance_matrices') or a CondensedDistanceMatrix.
+        ks (iterable): Numbers of clusters to report, each >= 2 (k larger than the number of dialects is skipped).
+        method (str): scipy linkage method ('average', 'complete', 'ward', ...).
+        nan_policy (str): See distance.prepare_distances.
+        heat_thresholds (tuple): Silhouette limits (transitional, core) for the heat labels.
+
+    Returns:
+        dict: 'linkage', 'kept' (row indices used), 'sharp' and 'heat' (k -> labels over the kept rows),
+              'cophenetic' (correlation between tree and input distances).
+    """
+    dist, kept = prepare_distances(matrix, nan_policy=nan_policy)
+    return _classify_prepared(dist, kept, ks, method, heat_thresholds)
+
+
+def _classify_prepared(dist, kept, ks, method, heat_thresholds):
+    ks = list(ks)
+    if any(k < 2 for k in ks):
+        raise ValueError(f"Every k must be >= 2 (silhouettes are undefined for one cluster), got {ks}.")
+    condensed = squareform(dist, checks=False)
+    Z = linkage(condensed, method=method)
+    sharp = cut_levels(Z, ks)
+    return {
+        'linkage': Z,
+        'kept': kept,
+        'sharp': sharp,
+        'heat': {k: heat_labels(dist, labels, heat_thresholds) for k, labels in sharp.items()},
+        'cophenetic': cophenet(Z, condensed)[0],
+    }
+
+
+def _classify_task(args):
+    matrix, kwargs = args
+    return classify(matrix, **kwargs)
+
+
+def classify_many(matrices, n_workers=None, **kwargs):
+    """
+    classify() for many matrices (e.g. bootstrap replicates) on a process pool.
+
+    Returns:
+        list: classify() results in input order.
+    """
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_classify_task, [(matrix, kwargs) for matrix in matrices]))
+
+
+def cn_tax_table(matrix, coords, names=None, ks=DEFAULT_KS, method='average', nan_policy='max',
+                 heat_thresholds=(0.05, 0.2), output_path=None):
+    """
+    Classification table with the columns of Data3/cn_tax.csv.
+
+    Args:
+        matrix: Distance matrix over the dialects.
+        coords (array_like): [n, 2] (longitude, latitude), e.g. load_feats(type='info')['coords'].
+        names (sequence, optional): Location names for the 'cities' column. Defaults to row numbers.
+        output_path (str, optional): Also write the table as CSV.
+
+    Returns:
+        pandas.DataFrame: cities, lat, long, d1, d2, d3, sharp<k>, heat<k> for each k.
+                          Dialects dropped by nan_policy='drop' have empty labels and NaN d1..d3.
+    """
+    dist, kept = prepare_distances(matrix, nan_policy=nan_policy)
+    result = _classify_prepared(dist, kept, ks, method, heat_thresholds)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    n = len(coords)
+    table = pd.DataFrame({'cities': list(names) if names is not None else [str(i) for i in range(n)],
+                          'lat': coords[:, 1], 'long': coords[:, 0]})
+
+    embedding = np.full((n, 3), np.nan)
+    embedding[kept] = classical_mds(dist, n_components=3)
+    for d in range(3):
+        table[f'd{d + 1}'] = embedding[:, d]
+    for k in result['sharp']:
+        for column, values in ((f'sharp{k}', [f'Cluster {label}' for label in result['sharp'][k]]),
+                               (f'heat{k}', result['heat'][k])):
+            full = np.full(n, '', dtype=object)
+            full[kept] = values
+            table[column] = full
+
+    print(f"共 {len(result['sharp'])} 个层级，共表型相关系数: {result['cophenetic']:.4f}")
+    if output_path:
+        table.to_csv(output_path, encoding='utf-8-sig')
+        print(f"成功将分类结果保存到: {output_path}")
+    return table
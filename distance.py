@@ -0,0 +1,729 @@
+"""
+Vectorized dialect distance engine for the Data4 transcriptions.
+
+The distance between two dialects is the share of jointly valid features on
+which they differ (the same masked mismatch ratio as ``cal_distance`` in
+``code.ipynb``), but every pair is computed at once from integer-encoded
+transcriptions with BLAS-backed matrix products.
+"""
+import hashlib
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from load import (data4_distance_matrix_path, data4_distance_matrix_dir, data4_processed_info_path, TILE_PROGRESS_FILE,
+                  EncodedTranscription, CondensedDistanceMatrix)
+
+# 每个字段的编码中，0 固定保留给缺失值
+MISSING_CODE = 0
+DISTANCE_KEYS = ['initials', 'finals', 'tones']
+# processed_info.pkl 中与方言（行）对齐的字段
+INFO_ROW_KEYS = ['areas', 'slice', 'slices', 'coords']
+
+
+def encode_transcriptions(features, missing_value='MISSING', vocab=None):
+    """
+    Dictionary-encode a 2D transcription table to small integers.
+
+    Args:
+        features (np.ndarray): 2D array [n_dialects, n_features], dtype=object.
+        missing_value (str): Indicator of missing values. Always mapped to MISSING_CODE.
+        vocab (array_like, optional): Existing vocabulary (vocab[0] is the missing marker).
+                                      Known symbols keep their codes, unseen symbols are appended.
+
+    Returns:
+        tuple: (codes, vocab)
+            codes (np.ndarray): uint16 (uint32 for very large vocabularies) code matrix.
+            vocab (np.ndarray): dtype=object, vocab[code] is the original symbol.
+    """
+    features = np.asarray(features)
+    if features.ndim != 2:
+        raise ValueError("Input 'features' must be a 2D NumPy array.")
+
+    # np.unique 对 unicode 数组排序比逐个比较 Python 对象快得多
+    uniques, inverse = np.unique(features.astype(str), return_inverse=True)
+
+    vocab = [missing_value] if vocab is None else list(vocab)
+    index = {str(symbol): code for code, symbol in enumerate(vocab)}
+    index[str(missing_value)] = MISSING_CODE
+
+    lookup = np.empty(len(uniques), dtype=np.int64)
+    for i, symbol in enumerate(uniques.tolist()):
+        code = index.get(symbol)
+        if code is None:
+            code = len(vocab)
+            vocab.append(symbol)
+            index[symbol] = code
+        lookup[i] = code
+
+    dtype = np.uint16 if len(vocab) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    codes = lookup[inverse.reshape(features.shape)].astype(dtype)
+    return codes, np.array(vocab, dtype=object)
+
+
+def as_codes(features, missing_value='MISSING'):
+    """
+    Code matrix for a transcription table.
+
+    EncodedTranscription objects (load_feats on the encoded raw format) and integer
+    arrays are used as they are; string tables are encoded first.
+    """
+    if isinstance(features, EncodedTranscription):
+        if features.missing_value != missing_value:
+            raise ValueError(f"Encoded table uses '{features.missing_value}' as missing value, not '{missing_value}'.")
+        return np.asarray(features.codes)
+    features = np.asarray(features)
+    if np.issubdtype(features.dtype, np.integer):
+        return features
+    return encode_transcriptions(features, missing_value=missing_value)[0]
+
+
+def _onehot_block(codes, start, stop, n_vocab, keys, dtype):
+    """One-hot encode the columns [start, stop) of a code matrix over the given (column, code) keys."""
+    block = codes[:, start:stop].astype(np.int64)
+    block_keys = block + np.arange(stop - start, dtype=np.int64) * n_vocab
+    valid = block != MISSING_CODE
+
+    onehot = np.zeros((codes.shape[0], len(keys)), dtype=dtype)
+    rows = np.nonzero(valid)[0]
+    onehot[rows, np.searchsorted(keys, block_keys[valid])] = 1
+    return onehot
+
+
+def _block_keys(codes, start, stop, n_vocab):
+    block = codes[:, start:stop].astype(np.int64)
+    block_keys = block + np.arange(stop - start, dtype=np.int64) * n_vocab
+    return block_keys[block != MISSING_CODE]
+
+
+def _equal_counts(codes_a, codes_b, blocks, n_vocab, dtype):
+    """Sum over column blocks of the number of jointly valid, equal features."""
+    same = codes_b is codes_a
+    equal = np.zeros((codes_a.shape[0], codes_b.shape[0]), dtype=dtype)
+    for start, stop in blocks:
+        keys = _block_keys(codes_a, start, stop, n_vocab)
+        if not same:
+            keys = np.concatenate([keys, _block_keys(codes_b, start, stop, n_vocab)])
+        keys = np.unique(keys)
+        onehot_a = _onehot_block(codes_a, start, stop, n_vocab, keys, dtype)
+        onehot_b = onehot_a if same else _onehot_block(codes_b, start, stop, n_vocab, keys, dtype)
+        equal += onehot_a @ onehot_b.T
+    return equal
+
+
+def pair_counts(codes_a, codes_b=None, block_size=64, n_jobs=None):
+    """
+    Count differing and jointly valid features for every pair of rows.
+
+    Args:
+        codes_a (np.ndarray): Code matrix [n_a, n_features] from encode_transcriptions.
+        codes_b (np.ndarray, optional): Code matrix [n_b, n_features] sharing the same vocabulary.
+                                        Defaults to codes_a (all pairs within one table).
+        block_size (int): Number of feature columns one-hot encoded per matrix product.
+        n_jobs (int, optional): Number of threads working on column blocks. Defaults to 1.
+
+    Returns:
+        tuple: (n_diff, n_valid), both int64 arrays of shape [n_a, n_b].
+    """
+    codes_a = np.asarray(codes_a)
+    codes_b = codes_a if codes_b is None else np.asarray(codes_b)
+    if codes_a.ndim != 2 or codes_b.ndim != 2 or codes_a.shape[1] != codes_b.shape[1]:
+        raise ValueError("Code matrices must be 2D with the same number of features.")
+
+    n_features = codes_a.shape[1]
+    # 计数都是不超过 n_features 的整数，float32 在 2**24 以内可以精确表示
+    dtype = np.float32 if n_features < 2 ** 24 else np.float64
+    n_vocab = int(max(codes_a.max(initial=0), codes_b.max(initial=0))) + 1
+
+    valid_a = (codes_a != MISSING_CODE).astype(dtype)
+    valid_b = valid_a if codes_b is codes_a else (codes_b != MISSING_CODE).astype(dtype)
+    n_valid = valid_a @ valid_b.T
+
+    blocks = [(start, min(start + block_size, n_features)) for start in range(0, n_features, block_size)]
+    n_jobs = max(1, min(n_jobs or 1, len(blocks)))
+    if n_jobs == 1:
+        equal = _equal_counts(codes_a, codes_b, blocks, n_vocab, dtype)
+    else:
+        # NumPy 的矩阵乘法会释放 GIL，线程之间按列块分工，最后把部分和相加
+        groups = [blocks[i::n_jobs] for i in range(n_jobs)]
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            partials = list(executor.map(lambda group: _equal_counts(codes_a, codes_b, group, n_vocab, dtype), groups))
+        equal = np.sum(partials, axis=0)
+
+    n_valid = np.rint(n_valid).astype(np.int64)
+    n_diff = n_valid - np.rint(equal).astype(np.int64)
+    return n_diff, n_valid
+
+
+def counts_to_distance(n_diff, n_valid):
+    """Masked mismatch ratio n_diff / n_valid, NaN where nothing is comparable."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist_matrix = n_diff / n_valid
+    dist_matrix[n_valid == 0] = np.nan
+    return dist_matrix
+
+
+def cal_distance_codes(codes, block_size=64, n_jobs=None):
+    """
+    Distance matrix for an already encoded transcription table.
+
+    Args:
+        codes (np.ndarray): Code matrix [n_dialects, n_features], MISSING_CODE marks missing values.
+        block_size (int): Number of feature columns per matrix product.
+        n_jobs (int, optional): Number of threads. Defaults to 1.
+
+    Returns:
+        np.ndarray: Distance matrix [n_dialects, n_dialects], dtype=float64, zero diagonal.
+    """
+    n_diff, n_valid = pair_counts(codes, block_size=block_size, n_jobs=n_jobs)
+    dist_matrix = counts_to_distance(n_diff, n_valid)
+    np.fill_diagonal(dist_matrix, 0.0)
+    return dist_matrix
+
+
+def cal_distance(features, missing_value='MISSING', block_size=64, n_jobs=None):
+    """
+    Calculate the distance matrix between dialects based on feature differences.
+
+    Drop-in replacement for the loop version in code.ipynb: d(i, j) is the number
+    of features where dialects i and j differ, divided by the number of features
+    where neither has a missing value, and the result matches it bit for bit.
+
+    Args:
+        features (np.ndarray or EncodedTranscription): 2D array [n_dialects, n_features], dtype=object.
+        missing_value (str): Indicator of missing values (e.g., 'MISSING', 'Ǿ').
+        block_size (int): Number of feature columns per matrix product.
+        n_jobs (int, optional): Number of threads. Defaults to 1.
+
+    Returns:
+        np.ndarray: Distance matrix [n_dialects, n_dialects], dtype=float.
+                    np.nan where a pair of dialects has no comparable features.
+    """
+    if not isinstance(features, (np.ndarray, EncodedTranscription)) or features.ndim != 2:
+        raise ValueError("Input 'features' must be a 2D NumPy array.")
+
+    codes = as_codes(features, missing_value=missing_value)
+    return cal_distance_codes(codes, block_size=block_size, n_jobs=n_jobs)
+
+
+def cal_distance_matrices(initials, finals, tones, missing_value='MISSING', block_size=64, n_jobs=None):
+    """
+    Compute the initials/finals/tones matrices and their average.
+
+    Returns:
+        dict: {'initials', 'finals', 'tones', 'overall'}, the keys used in Data4/distance_matrices.npz.
+    """
+    matrices = {}
+    for key, features in zip(DISTANCE_KEYS, (initials, finals, tones)):
+        print(f"Calculating '{key}' distance matrix...")
+        matrices[key] = cal_distance(features, missing_value=missing_value, block_size=block_size, n_jobs=n_jobs)
+    matrices['overall'] = (matrices['initials'] + matrices['finals'] + matrices['tones']) / 3
+    return matrices
+
+
+def save_distance_matrices(matrices, output_filename=data4_distance_matrix_path, update=False):
+    """
+    Save the matrices returned by cal_distance_matrices in the layout read by
+    load_feats(name='Data4', type='distance_matrices').
+
+    With update=True the matrices already stored in the file are kept and only
+    the given keys are added or replaced (e.g. the graded matrices next to the binary ones).
+    """
+    if update and os.path.exists(output_filename):
+        with np.load(output_filename) as existing:
+            matrices = {**{key: existing[key] for key in existing.files}, **matrices}
+    np.savez_compressed(output_filename, **matrices)
+    print(f"成功将距离矩阵保存到: {output_filename}")
+
+
+# --- 分级 (graded) 距离 ---
+# 二值距离中两个符号只有相同/不同两种情况。分级距离为每个字段的词表预先计算
+# 一张符号对代价表 (归一化编辑距离，0 表示相同，1 表示完全不同)，方言距离是
+# 共同有效特征上代价的平均值。代价全为 0/1 时与 cal_distance 的结果一致。
+GRADED_SUFFIX = '_graded'
+
+
+def feature_substitution_cost(segment_features):
+    """
+    Character substitution cost from phonetic feature vectors.
+
+    Args:
+        segment_features (dict): IPA character -> sequence of feature values (e.g. place, manner,
+                                 voicing, height, backness, rounding). Every vector has the same length.
+
+    Returns:
+        callable: cost(a, b) = share of differing features, 1 for characters without features.
+    """
+    vectors = {char: np.asarray(values) for char, values in segment_features.items()}
+
+    def cost(a, b):
+        if a == b:
+            return 0.0
+        if a not in vectors or b not in vectors:
+            return 1.0
+        return float(np.mean(vectors[a] != vectors[b]))
+    return cost
+
+
+def _edit_distances(encoded_a, lengths_a, encoded_b, lengths_b, char_costs):
+    """Edit distances [n_a, n_b] between padded character-index arrays, all pairs at once."""
+    n_a, n_b, max_len = len(encoded_a), len(encoded_b), encoded_b.shape[1]
+    # prev[:, :, j] 是 a 的前 i 个字符与 b 的前 j 个字符之间的编辑距离
+    prev = np.broadcast_to(np.arange(max_len + 1, dtype=float), (n_a, n_b, max_len + 1)).copy()
+    distances = np.where(lengths_a[:, None] == 0, lengths_b[None, :], 0).astype(float)
+    b_index = np.broadcast_to(lengths_b[None, :, None], (n_a, n_b, 1))
+    for i in range(1, int(lengths_a.max(initial=0)) + 1):
+        current = np.empty_like(prev)
+        current[:, :, 0] = i
+        substitute = char_costs[encoded_a[:, i - 1][:, None, None], encoded_b[None, :, :]]
+        for j in range(1, max_len + 1):
+            current[:, :, j] = np.minimum(np.minimum(prev[:, :, j] + 1, current[:, :, j - 1] + 1),
+                                          prev[:, :, j - 1] + substitute[:, :, j - 1])
+        done = lengths_a == i
+        distances[done] = np.take_along_axis(current, b_index, axis=2)[done, :, 0]
+        prev = current
+    return distances
+
+
+def symbol_costs(vocab, substitution_cost=None, dtype=np.float64, chunk_size=256):
+    """
+    Normalized edit distance between every pair of symbols of a field's vocabulary.
+
+    The edit distance (insertions and deletions cost 1, substitutions cost
+    substitution_cost(a, b) or 1) is divided by the length of the longer symbol.
+    The dynamic program advances all symbol pairs of a chunk together, so the
+    table costs a few array operations per character position.
+
+    Args:
+        vocab (sequence): Vocabulary from encode_transcriptions; vocab[MISSING_CODE] is the missing marker.
+        substitution_cost (callable, optional): Character pair -> cost in [0, 1], e.g. feature_substitution_cost(...).
+        chunk_size (int): Symbols per step of the dynamic program (bounds its memory).
+
+    Returns:
+        np.ndarray: Cost table [n_vocab, n_vocab], zero diagonal, zero row/column for MISSING_CODE.
+    """
+    symbols = [str(symbol) for symbol in vocab]
+    chars = sorted(set(''.join(symbols)))
+    char_index = {char: i for i, char in enumerate(chars)}
+    n_vocab, max_len = len(symbols), max(1, max(len(symbol) for symbol in symbols))
+
+    encoded = np.zeros((n_vocab, max_len), dtype=np.int64)
+    lengths = np.array([len(symbol) for symbol in symbols])
+    for i, symbol in enumerate(symbols):
+        encoded[i, :len(symbol)] = [char_index[char] for char in symbol]
+    char_costs = 1.0 - np.eye(len(chars))
+    if substitution_cost is not None:
+        char_costs = np.array([[substitution_cost(a, b) for b in chars] for a in chars], dtype=float)
+
+    distances = np.vstack([_edit_distances(encoded[a0:a0 + chunk_size], lengths[a0:a0 + chunk_size],
+                                           encoded, lengths, char_costs)
+                           for a0 in range(0, n_vocab, chunk_size)])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        costs = distances / np.maximum(lengths[:, None], lengths[None, :])
+    costs[np.isnan(costs)] = 0.0 # 两个空符号
+    np.fill_diagonal(costs, 0.0)
+    costs[MISSING_CODE, :] = costs[:, MISSING_CODE] = 0.0
+    return costs.astype(dtype)
+
+
+def _cost_sums(codes_a, codes_b, blocks, n_vocab, costs):
+    """Sum over column blocks of the symbol-pair costs of jointly valid features."""
+    sums = np.zeros((codes_a.shape[0], codes_b.shape[0]), dtype=costs.dtype)
+    for start, stop in blocks:
+        keys = np.unique(_block_keys(codes_b, start, stop, n_vocab))
+        columns, symbols = keys // n_vocab + start, keys % n_vocab
+        # 查表: 每个方言在该列的符号与该列每个出现过的符号之间的代价，缺失行为 0
+        gathered = costs[codes_a[:, columns].astype(np.int64), symbols]
+        onehot_b = _onehot_block(codes_b, start, stop, n_vocab, keys, costs.dtype)
+        sums += gathered @ onehot_b.T
+    return sums
+
+
+def graded_pair_sums(codes_a, costs, codes_b=None, block_size=64, n_jobs=None):
+    """
+    Summed symbol-pair costs and jointly valid feature counts for every pair of rows.
+
+    Args:
+        codes_a (np.ndarray): Code matrix [n_a, n_features].
+        costs (np.ndarray): Cost table [n_vocab, n_vocab] from symbol_costs.
+        codes_b (np.ndarray, optional): Code matrix [n_b, n_features]. Defaults to codes_a.
+        block_size (int): Number of feature columns per matrix product.
+        n_jobs (int, optional): Number of threads working on column blocks. Defaults to 1.
+
+    Returns:
+        tuple: (cost_sums float [n_a, n_b], n_valid int64 [n_a, n_b])
+    """
+    codes_a = np.asarray(codes_a)
+    codes_b = codes_a if codes_b is None else np.asarray(codes_b)
+    if codes_a.ndim != 2 or codes_b.ndim != 2 or codes_a.shape[1] != codes_b.shape[1]:
+        raise ValueError("Code matrices must be 2D with the same number of features.")
+    n_vocab = len(costs)
+    if max(codes_a.max(initial=0), codes_b.max(initial=0)) >= n_vocab:
+        raise ValueError("Code matrix contains codes outside the cost table; build it from the same vocabulary.")
+
+    n_features = codes_a.shape[1]
+    valid_a = (codes_a != MISSING_CODE).astype(np.float32)
+    valid_b = valid_a if codes_b is codes_a else (codes_b != MISSING_CODE).astype(np.float32)
+    n_valid = np.rint(valid_a @ valid_b.T).astype(np.int64)
+
+    blocks = [(start, min(start + block_size, n_features)) for start in range(0, n_features, block_size)]
+    n_jobs = max(1, min(n_jobs or 1, len(blocks)))
+    if n_jobs == 1:
+        sums = _cost_sums(codes_a, codes_b, blocks, n_vocab, costs)
+    else:
+        groups = [blocks[i::n_jobs] for i in range(n_jobs)]
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            partials = list(executor.map(lambda group: _cost_sums(codes_a, codes_b, group, n_vocab, costs), groups))
+        sums = np.sum(partials, axis=0)
+    return sums, n_valid
+
+
+def cal_graded_distance(features, costs=None, missing_value='MISSING', substitution_cost=None,
+                        block_size=64, n_jobs=None):
+    """
+    Graded distance matrix: mean symbol-pair cost over the jointly valid features.
+
+    Args:
+        features (np.ndarray or EncodedTranscription): 2D transcription table [n_dialects, n_features].
+        costs (np.ndarray, optional): Cost table matching the table's vocabulary. Built with
+                                      symbol_costs(vocab, substitution_cost) when omitted.
+        missing_value (str): Indicator of missing values.
+        substitution_cost (callable, optional): Passed to symbol_costs when costs is None.
+
+    Returns:
+        np.ndarray: Distance matrix [n_dialects, n_dialects] in [0, 1], NaN where nothing is comparable.
+    """
+    if isinstance(features, EncodedTranscription):
+        codes, vocab = as_codes(features, missing_value=missing_value), features.vocab
+    elif np.issubdtype(np.asarray(features).dtype, np.integer):
+        if costs is None:
+            raise ValueError("A cost table is required for integer code matrices.")
+        codes, vocab = np.asarray(features), None
+    else:
+        codes, vocab = encode_transcriptions(np.asarray(features), missing_value=missing_value)
+    if costs is None:
+        costs = symbol_costs(vocab, substitution_cost=substitution_cost)
+
+    sums, n_valid = graded_pair_sums(codes, costs, block_size=block_size, n_jobs=n_jobs)
+    dist_matrix = counts_to_distance(sums, n_valid)
+    np.fill_diagonal(dist_matrix, 0.0)
+    return dist_matrix
+
+
+def cal_graded_distance_matrices(initials, finals, tones, missing_value='MISSING', substitution_costs=None,
+                                 block_size=64, n_jobs=None):
+    """
+    Graded counterpart of cal_distance_matrices.
+
+    Args:
+        substitution_costs (dict, optional): Key in DISTANCE_KEYS -> substitution cost callable for that field.
+
+    Returns:
+        dict: {'initials_graded', 'finals_graded', 'tones_graded', 'overall_graded'}, stored next to the
+              binary matrices with save_distance_matrices(matrices, update=True).
+    """
+    substitution_costs = substitution_costs or {}
+    matrices = {}
+    for key, features in zip(DISTANCE_KEYS, (initials, finals, tones)):
+        print(f"Calculating graded '{key}' distance matrix...")
+        matrices[key + GRADED_SUFFIX] = cal_graded_distance(features, missing_value=missing_value,
+                                                            substitution_cost=substitution_costs.get(key),
+                                                            block_size=block_size, n_jobs=n_jobs)
+    matrices['overall' + GRADED_SUFFIX] = sum(matrices[key + GRADED_SUFFIX] for key in DISTANCE_KEYS) / 3
+    return matrices
+
+
+# --- 聚类、嵌入前的 NaN 处理 ---
+def prepare_distances(matrix, nan_policy='max'):
+    """
+    Dense float64 distances without NaN, ready for clustering or embedding.
+
+    cal_distance leaves NaN for dialect pairs without jointly valid features.
+
+    Args:
+        matrix: [n, n] matrix or CondensedDistanceMatrix.
+        nan_policy (str): 'max' replaces NaN by the largest finite distance (the pair is put far apart),
+                          'drop' removes dialects until no NaN is left (most NaN first),
+                          'raise' raises ValueError.
+
+    Returns:
+        tuple: (distances [m, m], kept [m] row indices into the input)
+    """
+    if isinstance(matrix, CondensedDistanceMatrix):
+        matrix = matrix.to_dense()
+    dist = np.array(matrix, dtype=np.float64)
+    kept = np.arange(len(dist))
+    nan = np.isnan(dist)
+    np.fill_diagonal(nan, False)
+    if nan.any():
+        if nan_policy == 'raise':
+            raise ValueError(f"Distance matrix has {nan.sum() // 2} NaN pairs.")
+        if nan_policy == 'max':
+            dist[nan] = np.nanmax(dist)
+            print(f"将 {nan.sum() // 2} 个 NaN 距离替换为最大距离。")
+        elif nan_policy == 'drop':
+            keep = np.ones(len(dist), dtype=bool)
+            counts = nan.sum(axis=1)
+            while counts.max() > 0:
+                worst = counts.argmax()
+                keep[worst] = False
+                counts -= nan[:, worst]
+                counts[worst] = 0
+            kept = np.flatnonzero(keep)
+            dist = dist[np.ix_(kept, kept)]
+            print(f"因 NaN 距离删除了 {len(keep) - len(kept)} 个方言点。")
+        else:
+            raise ValueError(f"Unknown nan_policy '{nan_policy}', use 'max', 'drop' or 'raise'.")
+    np.fill_diagonal(dist, 0.0)
+    return dist, kept
+
+
+# --- 分块 (out-of-core) 计算 ---
+# 每个字段的编码矩阵先写成 .npy，工作进程以内存映射方式读取；结果矩阵同样是
+# 内存映射的 .npy，每个进程直接写入自己负责的块。已完成的块逐行记录在
+# progress 文件中，任务被中断后重新调用即可从断点继续。progress 文件的第一行记录
+# 任务参数和每个编码矩阵的内容哈希，输入数据变化时从头重新计算。
+
+
+def _tile_worker(output_dir, keys, n_dialects, tile_size, bi, bj, block_size):
+    rows = slice(bi * tile_size, min((bi + 1) * tile_size, n_dialects))
+    cols = slice(bj * tile_size, min((bj + 1) * tile_size, n_dialects))
+
+    tiles = {}
+    for key in keys:
+        codes = np.load(os.path.join(output_dir, f'codes_{key}.npy'), mmap_mode='r')
+        n_diff, n_valid = pair_counts(np.asarray(codes[rows]), np.asarray(codes[cols]), block_size=block_size)
+        tile = counts_to_distance(n_diff, n_valid)
+        if bi == bj:
+            np.fill_diagonal(tile, 0.0)
+        tiles[key] = tile
+    if all(key in tiles for key in DISTANCE_KEYS):
+        tiles['overall'] = (tiles['initials'] + tiles['finals'] + tiles['tones']) / 3
+
+    for key, tile in tiles.items():
+        out = np.load(os.path.join(output_dir, f'{key}.npy'), mmap_mode='r+')
+        out[rows, cols] = tile
+        out[cols, rows] = tile.T
+        out.flush()
+        del out
+    return bi, bj
+
+
+def _codes_digest(codes):
+    """SHA-1 of a code matrix's dtype, shape and contents."""
+    digest = hashlib.sha1(f"{codes.dtype.str}{codes.shape}".encode())
+    digest.update(np.ascontiguousarray(codes).tobytes())
+    return digest.hexdigest()
+
+
+def _read_progress(progress_path, header):
+    """Return the finished tiles recorded for this exact job (same shape, tile size and input data)."""
+    if not os.path.exists(progress_path):
+        return None
+    with open(progress_path) as f:
+        lines = f.read().splitlines()
+    if not lines or lines[0] != header:
+        return None
+    done = set()
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) == 2:  # 忽略中断时写了一半的行
+            done.add((int(parts[0]), int(parts[1])))
+    return done
+
+
+def cal_distance_tiled(fields, output_dir=data4_distance_matrix_dir, tile_size=1024,
+                       n_workers=None, missing_value='MISSING', block_size=64):
+    """
+    Out-of-core pairwise distances written tile by tile into memory-mapped .npy files.
+
+    Only tiles on or above the diagonal are computed; each one is written together
+    with its mirror. Finished tiles are recorded in output_dir/progress.txt, so
+    calling this again with the same arguments and data resumes an interrupted job;
+    different data (checked by a hash of every code matrix) starts over. Once every
+    tile is done, the result loads through load_feats(name='Data4', type='distance_matrices').
+
+    Args:
+        fields (dict): Field name -> 2D transcription table (dtype=object), EncodedTranscription
+                       or code matrix (integer dtype, MISSING_CODE for missing). Use the keys
+                       'initials', 'finals', 'tones' to also get 'overall'.
+        output_dir (str): Directory receiving <field>.npy (plus the cached code matrices).
+        tile_size (int): Number of dialects per tile side.
+        n_workers (int, optional): Number of worker processes. Defaults to os.cpu_count().
+        missing_value (str): Indicator of missing values for object tables.
+        block_size (int): Number of feature columns per matrix product inside a tile.
+
+    Returns:
+        dict: Field name -> read-only memory-mapped distance matrix.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    keys = list(fields)
+    n_dialects = None
+    for key, features in fields.items():
+        if n_dialects is not None and len(features) != n_dialects:
+            raise ValueError("All fields must have the same number of dialects.")
+        n_dialects = len(features)
+
+    out_keys = keys + (['overall'] if all(key in keys for key in DISTANCE_KEYS) else [])
+    n_tiles = -(-n_dialects // tile_size)
+    codes = {key: as_codes(features, missing_value=missing_value) for key, features in fields.items()}
+    digests = ",".join(f'{key}:{_codes_digest(codes[key])}' for key in keys)
+    header = f'n_dialects={n_dialects} tile_size={tile_size} keys={",".join(keys)} sha1={digests}'
+    progress_path = os.path.join(output_dir, TILE_PROGRESS_FILE)
+    done = _read_progress(progress_path, header)
+
+    if done is None:
+        # 新任务 (或输入已变化)：先删除旧的进度文件，写入编码矩阵并创建结果文件
+        if os.path.exists(progress_path):
+            print("输入数据或参数与断点不一致，从头重新计算。")
+            os.remove(progress_path)
+        for key in keys:
+            np.save(os.path.join(output_dir, f'codes_{key}.npy'), codes[key])
+        for key in out_keys:
+            out = np.lib.format.open_memmap(os.path.join(output_dir, f'{key}.npy'), mode='w+',
+                                            dtype=np.float64, shape=(n_dialects, n_dialects))
+            del out
+        with open(progress_path, 'w') as f:
+            f.write(header + '\n')
+        done = set()
+    else:
+        print(f"从断点继续: 已完成 {len(done)} 个块。")
+    del codes
+
+    todo = [(bi, bj) for bi in range(n_tiles) for bj in range(bi, n_tiles) if (bi, bj) not in done]
+    print(f"共 {n_tiles * (n_tiles + 1) // 2} 个块，待计算 {len(todo)} 个。")
+
+    with open(progress_path, 'a') as progress, ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(_tile_worker, output_dir, keys, n_dialects, tile_size, bi, bj, block_size)
+                   for bi, bj in todo]
+        for i, future in enumerate(as_completed(futures), 1):
+            bi, bj = future.result()
+            progress.write(f'{bi} {bj}\n')
+            progress.flush()
+            os.fsync(progress.fileno())
+            if i % 100 == 0:
+                print(f"  Processed {i}/{len(todo)} tiles...")
+
+    print("Distance matrix calculation finished.")
+    return {key: np.load(os.path.join(output_dir, f'{key}.npy'), mmap_mode='r') for key in out_keys}
+
+
+# --- 增量更新 ---
+def update_distance_matrices(matrices, codes, rows=(), info=None, row_info=None, block_size=64, n_jobs=None):
+    """
+    Update distance matrices after correcting or appending dialects, in O(k*n).
+
+    Only the rows and columns of the affected dialects are recomputed; 'overall'
+    is then rebuilt from the updated component matrices.
+
+    Args:
+        matrices (dict): Existing matrices keyed like distance_matrices.npz
+                         ('initials', 'finals', 'tones', 'overall'), each [n, n].
+        codes (dict): Field name -> updated code matrix [n + k, n_features]. Corrected rows are
+                      edited in place, new dialects appended at the end. Encode new transcriptions
+                      with encode_transcriptions(..., vocab=existing_vocab) so codes stay consistent.
+        rows (array_like): Indices (< n) of existing dialects whose transcriptions changed.
+        info (dict, optional): Contents of processed_info.pkl, updated to the new rows.
+        row_info (dict, optional): Key in INFO_ROW_KEYS -> {row index: value}. Required for every
+                                   appended row when info is given; may also correct existing rows.
+        block_size (int): Number of feature columns per matrix product.
+        n_jobs (int, optional): Number of threads.
+
+    Returns:
+        tuple: (updated_matrices, updated_info). updated_info is None when info is None.
+    """
+    keys = list(codes)
+    n_old = matrices[keys[0]].shape[0]
+    n_new = codes[keys[0]].shape[0]
+    if any(codes[key].shape[0] != n_new for key in keys):
+        raise ValueError("All code matrices must have the same number of dialects.")
+    if n_new < n_old:
+        raise ValueError("Removing dialects is not supported; rebuild the matrices instead.")
+
+    rows = np.asarray(rows, dtype=np.int64)
+    if rows.size and (rows.min() < 0 or rows.max() >= n_old):
+        raise ValueError(f"Changed rows must be existing dialect indices in [0, {n_old}).")
+    affected = np.union1d(rows, np.arange(n_old, n_new))
+    print(f"Updating {len(rows)} changed and {n_new - n_old} new dialects ({n_new} in total)...")
+
+    updated = {}
+    for key in keys:
+        dist_matrix = np.full((n_new, n_new), np.nan, dtype=float)
+        dist_matrix[:n_old, :n_old] = matrices[key]
+        if len(affected):
+            n_diff, n_valid = pair_counts(codes[key][affected], codes[key], block_size=block_size, n_jobs=n_jobs)
+            block = counts_to_distance(n_diff, n_valid)
+            block[np.arange(len(affected)), affected] = 0.0
+            dist_matrix[affected, :] = block
+            dist_matrix[:, affected] = block.T
+        updated[key] = dist_matrix
+    if all(key in updated for key in DISTANCE_KEYS):
+        updated['overall'] = (updated['initials'] + updated['finals'] + updated['tones']) / 3
+
+    if info is None:
+        return updated, None
+
+    row_info = row_info or {}
+    updated_info = dict(info)
+    for key in INFO_ROW_KEYS:
+        values = list(info[key]) + [None] * (n_new - n_old)
+        for row, value in row_info.get(key, {}).items():
+            if not 0 <= row < n_new:
+                raise ValueError(f"row_info['{key}'] refers to row {row}, outside [0, {n_new}).")
+            values[row] = value
+        missing = [row for row in range(n_old, n_new) if values[row] is None]
+        if missing:
+            raise ValueError(f"row_info['{key}'] has no value for new rows {missing}.")
+        updated_info[key] = values
+    return updated, updated_info
+
+
+def update_distance_files(codes, rows=(), row_info=None, matrix_path=data4_distance_matrix_path,
+                          info_path=data4_processed_info_path, block_size=64, n_jobs=None):
+    """
+    Apply update_distance_matrices to distance_matrices.npz and processed_info.pkl together.
+
+    Both files are written to temporary names first and then swapped in, so they
+    are never left out of sync by a failed update. Matrices in the archive that
+    `codes` does not cover are kept as they are ('overall' is rebuilt from the
+    components); graded matrices (*_graded) cannot be updated from codes alone and
+    are dropped with a warning, rerun cal_graded_distance_matrices afterwards.
+
+    Returns:
+        tuple: (updated_matrices, updated_info), updated_matrices holding every matrix written to the npz.
+    """
+    with np.load(matrix_path) as loaded_npz:
+        matrices = {key: loaded_npz[key] for key in loaded_npz.files}
+    with open(info_path, 'rb') as f:
+        info = pickle.load(f)
+
+    stale = [key for key in matrices if key.endswith(GRADED_SUFFIX)]
+    kept = [key for key in matrices if key not in codes and key != 'overall' and key not in stale]
+    n_new = len(next(iter(codes.values())))
+    if kept and n_new != len(matrices[kept[0]]):
+        raise ValueError(f"Appending dialects requires codes for every matrix in '{matrix_path}'; "
+                         f"missing: {kept}.")
+
+    updated, updated_info = update_distance_matrices(matrices, codes, rows=rows, info=info, row_info=row_info,
+                                                     block_size=block_size, n_jobs=n_jobs)
+    # 从已有的完整归档出发，只覆盖重新计算的矩阵
+    merged = {key: value for key, value in matrices.items() if key not in stale}
+    merged.update(updated)
+    if 'overall' not in codes and all(key in merged for key in DISTANCE_KEYS):
+        merged['overall'] = (merged['initials'] + merged['finals'] + merged['tones']) / 3
+    if stale:
+        print(f"警告: 分级距离矩阵 {stale} 无法增量更新，已从 '{matrix_path}' 中删除，"
+              f"请重新运行 cal_graded_distance_matrices。")
+    updated = merged
+
+    tmp_matrix_path = matrix_path[:-len('.npz')] + '.tmp.npz'
+    tmp_info_path = info_path + '.tmp'
+    np.savez_compressed(tmp_matrix_path, **updated)
+    with open(tmp_info_path, 'wb') as f:
+        pickle.dump(updated_info, f)
+    os.replace(tmp_matrix_path, matrix_path)
+    os.replace(tmp_info_path, info_path)
+    print(f"成功更新 '{matrix_path}' 和 '{info_path}'")
+    return updated, updated_info
@@ -0,0 +1,161 @@
+"""
+Low-dimensional embeddings computed directly from distance matrices.
+
+- 'mds': classical (Torgerson) MDS. Only the leading eigenvectors of the
+  double-centred squared distances are computed (ARPACK through
+  scipy.sparse.linalg.eigsh), with the centring applied implicitly in the
+  matrix-vector product.
+- 'tsne': scikit-learn t-SNE with metric='precomputed', initialized from
+  classical MDS.
+- 'umap': umap-learn with metric='precomputed' (optional dependency).
+
+embed() caches every result on disk under a key built from a hash of the
+matrix, the selected row subset and the parameters, so re-plotting a known
+subset only reads a small .npz file.
+"""
+import hashlib
+import os
+import weakref
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+from distance import prepare_distances
+from load import BASE_DATA4_DIR, CondensedDistanceMatrix
+
+EMBEDDING_CACHE_DIR = os.path.join(BASE_DATA4_DIR, 'embedding_cache')
+_DIGESTS = {} # id(只读矩阵) -> (弱引用, 哈希)，避免同一个缓存矩阵被反复哈希
+
+
+def classical_mds(dist, n_components=2, seed=0):
+    """
+    Classical MDS coordinates [n, n_components] of a NaN-free distance matrix.
+
+    Axes are ordered by eigenvalue and their signs fixed so that the largest
+    absolute coordinate of every axis is positive, which keeps repeated runs identical.
+    """
+    dist = np.asarray(dist, dtype=np.float64)
+    n = len(dist)
+    squared = dist ** 2
+    if n_components >= n - 1:
+        # 维数接近 n 时直接做完整分解
+        centred = squared - squared.mean(axis=0) - squared.mean(axis=1)[:, None] + squared.mean()
+        values, vectors = np.linalg.eigh(-0.5 * centred)
+        values, vectors = values[::-1][:n_components], vectors[:, ::-1][:, :n_components]
+    else:
+        def matvec(x):
+            # B x = -1/2 J D^2 J x，J 为中心化矩阵，不需要显式构造 B
+            x = np.ravel(x)
+            y = squared @ (x - x.mean())
+            return -0.5 * (y - y.mean())
+        operator = LinearOperator((n, n), matvec=matvec, dtype=np.float64)
+        v0 = np.random.default_rng(seed).uniform(-1, 1, n)
+        values, vectors = eigsh(operator, k=n_components, which='LA', v0=v0)
+        order = np.argsort(values)[::-1]
+        values, vectors = values[order], vectors[:, order]
+    signs = np.sign(vectors[np.abs(vectors).argmax(axis=0), np.arange(vectors.shape[1])])
+    return vectors * signs * np.sqrt(np.maximum(values, 0))
+
+
+def tsne(dist, n_components=2, perplexity=30.0, seed=0, **kwargs):
+    """t-SNE on a precomputed distance matrix, initialized from classical MDS."""
+    from sklearn.manifold import TSNE
+
+    dist = np.asarray(dist, dtype=np.float64)
+    init = classical_mds(dist, n_components=n_components, seed=seed)
+    # 与 scikit-learn 的 'pca' 初始化一样缩放到很小的方差
+    init = init / np.std(init[:, 0]) * 1e-4
+    perplexity = min(perplexity, (len(dist) - 1) / 3)
+    model = TSNE(n_components=n_components, metric='precomputed', init=init, perplexity=perplexity,
+                 random_state=seed, **kwargs)
+    return model.fit_transform(dist)
+
+
+def umap(dist, n_components=2, n_neighbors=15, min_dist=0.1, seed=0, **kwargs):
+    """UMAP on a precomputed distance matrix (requires umap-learn)."""
+    try:
+        import umap as umap_learn
+    except ImportError as e:
+        raise ImportError("method='umap' requires the umap-learn package (pip install umap-learn).") from e
+    model = umap_learn.UMAP(n_components=n_components, n_neighbors=n_neighbors, min_dist=min_dist,
+                            metric='precomputed', random_state=seed, **kwargs)
+    return model.fit_transform(np.asarray(dist, dtype=np.float64))
+
+
+METHODS = {'mds': classical_mds, 'tsne': tsne, 'umap': umap}
+
+
+def matrix_digest(matrix):
+    """SHA-1 of a matrix's contents (CondensedDistanceMatrix: of its condensed values)."""
+    values = matrix.values if isinstance(matrix, CondensedDistanceMatrix) else matrix
+    values = np.asarray(values)
+    memo = _DIGESTS.get(id(matrix))
+    if memo is not None and memo[0]() is matrix:
+        return memo[1]
+    digest = hashlib.sha1()
+    digest.update(f"{values.dtype.str}{values.shape}".encode())
+    flat = values.reshape(-1)
+    for start in range(0, len(flat), 1 << 24):
+        digest.update(np.ascontiguousarray(flat[start:start + (1 << 24)]).tobytes())
+    digest = digest.hexdigest()
+    # 只记住只读数组 (如 load_feats 的缓存结果) 的哈希，可写数组的内容可能被修改
+    if not values.flags.writeable:
+        try:
+            _DIGESTS[id(matrix)] = (weakref.ref(matrix), digest)
+        except TypeError:
+            pass
+    return digest
+
+
+def _cache_key(digest, indices, method, n_components, nan_policy, params):
+    key = hashlib.sha1()
+    key.update(digest.encode())
+    key.update(b'all' if indices is None else np.asarray(indices, dtype=np.int64).tobytes())
+    key.update(repr((method, n_components, nan_policy, sorted(params.items()))).encode())
+    return key.hexdigest()
+
+
+def embed(matrix, method='mds', n_components=2, indices=None, nan_policy='max', cache=True,
+          cache_dir=EMBEDDING_CACHE_DIR, **params):
+    """
+    Embed (a subset of) a distance matrix, with an on-disk cache.
+
+    Args:
+        matrix: [n, n] distance matrix (e.g. load_feats(...)['overall_distance']) or CondensedDistanceMatrix.
+        method (str): 'mds', 'tsne' or 'umap'.
+        n_components (int): Output dimension.
+        indices (array_like, optional): Rows/columns to embed, e.g.
+                                        np.flatnonzero(np.isin(info['areas'], categories)).
+        nan_policy (str): See distance.prepare_distances; with 'drop' the dropped rows get NaN coordinates.
+        cache (bool): Read and write the cache.
+        cache_dir (str): Cache directory.
+        **params: Passed to the method (e.g. perplexity, seed).
+
+    Returns:
+        np.ndarray: [len(indices) or n, n_components] coordinates, rows in the order of indices.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', available: {list(METHODS)}.")
+    path = None
+    if cache:
+        key = _cache_key(matrix_digest(matrix), indices, method, n_components, nan_policy, params)
+        path = os.path.join(cache_dir, f'{method}_{key}.npz')
+        if os.path.exists(path):
+            with np.load(path) as cached:
+                print(f"从缓存读取嵌入: {path}")
+                return cached['embedding']
+
+    if indices is not None:
+        indices = np.asarray(indices, dtype=np.int64)
+        if isinstance(matrix, CondensedDistanceMatrix):
+            matrix = matrix.submatrix(indices, dtype=np.float64)
+        else:
+            matrix = np.asarray(matrix)[np.ix_(indices, indices)]
+    dist, kept = prepare_distances(matrix, nan_policy=nan_policy)
+    print(f"Computing {method.upper()} embedding of {len(dist)} dialects to {n_components} components...")
+    embedding = np.full((len(matrix), n_components), np.nan)
+    embedding[kept] = METHODS[method](dist, n_components=n_components, **params)
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(path, embedding=embedding)
+    return embedding
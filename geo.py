@@ -0,0 +1,149 @@
+"""
+Offline coordinate -> nearest surveyed dialect / area / slice lookup.
+
+The surveyed locations (the `coords` of load_feats(type='info'), stored as
+[longitude, latitude]) are indexed once in a KD-tree over unit-sphere vectors.
+Chord distances from the tree are converted to great-circle (haversine)
+distances, so nearest neighbours are exact on the sphere.
+"""
+import os
+import pickle
+import numpy as np
+from scipy.spatial import cKDTree
+
+from load import load_feats, DATASET_CONFIG, BASE_DATA3_DIR, BASE_DATA4_DIR
+
+EARTH_RADIUS_KM = 6371.0088
+# 各数据集 info 中与坐标对齐的标签字段
+LABEL_KEYS = {'Data4': ['areas', 'slice', 'slices'], 'Data3': []}
+GEO_INDEX_PATHS = {'Data4': os.path.join(BASE_DATA4_DIR, 'geo_index.pkl'),
+                   'Data3': os.path.join(BASE_DATA3_DIR, 'geo_index.pkl')}
+
+
+def to_unit_vectors(coords):
+    """[n, 2] array of (longitude, latitude) in degrees -> [n, 3] unit vectors."""
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    """Straight-line distance between unit vectors -> great-circle distance in km."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """Vectorized haversine distance in km between points given in degrees (broadcasts)."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _majority_vote(label_codes, n_labels):
+    """Most frequent label per row of a [m, k] code array; ties go to the nearer neighbour."""
+    m, k = label_codes.shape
+    # 同票时，排名靠前 (更近) 的邻居权重略大
+    weights = 1 + (k - np.arange(k)) / (k * (k + 1))
+    votes = np.zeros((m, n_labels))
+    np.add.at(votes, (np.repeat(np.arange(m), k), label_codes.ravel()), np.tile(weights, m))
+    return votes.argmax(axis=1)
+
+
+class GeoIndex:
+    """
+    KD-tree over surveyed dialect locations.
+
+    Args:
+        coords (array_like): [n, 2] (longitude, latitude) in degrees.
+        labels (dict, optional): Label name -> sequence of length n (e.g. 'areas', 'slice', 'slices').
+    """
+
+    def __init__(self, coords, labels=None, source=None):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.tree = cKDTree(to_unit_vectors(self.coords))
+        self.labels = {}
+        for key, values in (labels or {}).items():
+            values = np.asarray(values, dtype=object)
+            if len(values) != len(self.coords):
+                raise ValueError(f"Label '{key}' has {len(values)} entries for {len(self.coords)} coordinates.")
+            # 标签以整数码存储，投票时可以向量化计数
+            names, codes = np.unique(values.astype(str), return_inverse=True)
+            self.labels[key] = (names, codes.ravel())
+        self.source = source # 构建索引时 info 文件的签名，用于判断持久化的索引是否过期
+
+    @classmethod
+    def from_dataset(cls, name='Data4'):
+        """Build the index from load_feats(name, type='info')."""
+        info = load_feats(name=name, type='info')
+        if not info:
+            raise ValueError(f"Could not load the info of dataset '{name}'.")
+        labels = {key: info[key] for key in LABEL_KEYS.get(name, []) if key in info}
+        return cls(info['coords'], labels=labels, source=_info_signature(name))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def query(self, points, k=1, vote=False, workers=-1):
+        """
+        Nearest surveyed dialects for a batch of points.
+
+        Args:
+            points (array_like): [m, 2] (longitude, latitude) in degrees, or a single pair.
+            k (int): Number of neighbours per point, at most len(self) (larger values are clamped).
+            vote (bool): Also return the majority label among the k neighbours as '<label>_vote'.
+            workers (int): Threads used by the KD-tree query (-1 = all cores).
+
+        Returns:
+            dict: 'indices' [m, k] rows of the info arrays, 'distances_km' [m, k] haversine
+                  distances, one [m, k] array per label, and '<label>_vote' [m] if vote=True.
+        """
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}.")
+        # k 超过地点数时 cKDTree 会用索引 n 填充结果
+        k = min(k, len(self))
+        chord, indices = self.tree.query(to_unit_vectors(points), k=k, workers=workers)
+        indices = np.asarray(indices).reshape(-1, k)
+        result = {'indices': indices, 'distances_km': chord_to_km(chord).reshape(-1, k)}
+        for key, (names, codes) in self.labels.items():
+            neighbour_codes = codes[indices]
+            result[key] = names[neighbour_codes]
+            if vote:
+                result[f'{key}_vote'] = names[_majority_vote(neighbour_codes, len(names))]
+        return result
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+        print(f"成功将空间索引保存到: {path}")
+
+
+def _info_signature(name):
+    info_path = DATASET_CONFIG[name]['info']['file']
+    stat = os.stat(info_path)
+    return (info_path, stat.st_mtime_ns, stat.st_size)
+
+
+def load_geo_index(name='Data4', path=None, rebuild=False):
+    """
+    Load the persisted index of a dataset, building and saving it when it is
+    missing or older than the dataset's info file.
+
+    Args:
+        name (str): 'Data4' (with areas/slice/slices labels) or 'Data3' (coordinates only).
+        path (str, optional): Where the index is stored. Defaults to <DataX>/geo_index.pkl.
+        rebuild (bool): Force a rebuild.
+
+    Returns:
+        GeoIndex
+    """
+    path = path or GEO_INDEX_PATHS[name]
+    if not rebuild and os.path.exists(path):
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        if index.source == _info_signature(name):
+            return index
+        print(f"'{path}' 已过期，重新构建。")
+    index = GeoIndex.from_dataset(name)
+    index.save(path)
+    return index
@@ -0,0 +1,238 @@
+"""
+GMM-UBM / i-vector extraction for the Data2 MFCC features.
+
+Pipeline:
+    1. fit a diagonal-covariance UBM on a random frame subsample;
+    2. compute zeroth/first-order Baum-Welch statistics per recording in
+       vectorized frame blocks (log-sum-exp over all components at once),
+       one recording per worker process;
+    3. train the total-variability matrix T by EM on the recording statistics;
+    4. extract one i-vector per group (dialect area, slice, ...) from the
+       pooled statistics of its recordings.
+
+The output keeps the features / dialect_names schema of
+Data2/mfcc_gmm_ivectordialect.npz read by load_feats(type='mfcc_dialect_gmm_ivector').
+"""
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import logsumexp
+from sklearn.mixture import GaussianMixture
+
+from load import data2_mfcc_dialect_gmm_ivector_path
+from mfcc import iter_mfcc_chunks, read_manifest
+
+
+class UBM:
+    """Diagonal-covariance GMM: weights [C], means [C, D], variances [C, D]."""
+
+    def __init__(self, weights, means, variances):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.means = np.asarray(means, dtype=np.float64)
+        self.variances = np.asarray(variances, dtype=np.float64)
+        # 对数似然中与帧无关的部分只算一次
+        self._precisions = 1.0 / self.variances
+        self._const = (np.log(self.weights)
+                       - 0.5 * (self.means.shape[1] * np.log(2 * np.pi) + np.log(self.variances).sum(axis=1)
+                                + (self.means ** 2 * self._precisions).sum(axis=1)))
+
+    @property
+    def n_components(self):
+        return len(self.weights)
+
+    @property
+    def dim(self):
+        return self.means.shape[1]
+
+    def log_likelihoods(self, frames):
+        """Per-component weighted log-likelihoods [n, C] for frames [n, D]."""
+        return (self._const
+                - 0.5 * (frames ** 2) @ self._precisions.T
+                + frames @ (self.means * self._precisions).T)
+
+    def posteriors(self, frames):
+        log_lik = self.log_likelihoods(frames)
+        return np.exp(log_lik - logsumexp(log_lik, axis=1, keepdims=True))
+
+
+def fit_ubm(frames, n_components=256, max_iter=100, seed=0):
+    """Fit a diagonal UBM on a frame subsample [n, D]."""
+    print(f"Fitting a {n_components}-component UBM on {len(frames)} frames...")
+    gmm = GaussianMixture(n_components=n_components, covariance_type='diag', max_iter=max_iter,
+                          reg_covar=1e-4, random_state=seed)
+    gmm.fit(frames)
+    return UBM(gmm.weights_, gmm.means_, gmm.covariances_)
+
+
+def baum_welch_stats(frames, ubm, block_size=10000):
+    """
+    Zeroth- and first-order statistics of a frame array.
+
+    Returns:
+        tuple: (N [C], F [C, D]) with F the raw (uncentered) first-order statistics.
+    """
+    n_stats = np.zeros(ubm.n_components)
+    f_stats = np.zeros((ubm.n_components, ubm.dim))
+    for start in range(0, len(frames), block_size):
+        block = np.asarray(frames[start:start + block_size], dtype=np.float64)
+        gamma = ubm.posteriors(block)
+        n_stats += gamma.sum(axis=0)
+        f_stats += gamma.T @ block
+    return n_stats, f_stats
+
+
+def _file_stats(path, ubm, chunk_seconds):
+    n_stats = np.zeros(ubm.n_components)
+    f_stats = np.zeros((ubm.n_components, ubm.dim))
+    for frames in iter_mfcc_chunks(path, chunk_seconds=chunk_seconds):
+        n_chunk, f_chunk = baum_welch_stats(frames, ubm)
+        n_stats += n_chunk
+        f_stats += f_chunk
+    return n_stats, f_stats
+
+
+def _sample_file_frames(path, fraction, max_frames, seed, chunk_seconds):
+    rng = np.random.default_rng(seed)
+    sampled = []
+    for frames in iter_mfcc_chunks(path, chunk_seconds=chunk_seconds):
+        sampled.append(frames[rng.random(len(frames)) < fraction])
+    sampled = np.vstack(sampled) if sampled else np.zeros((0, 0))
+    if len(sampled) > max_frames:
+        sampled = sampled[rng.choice(len(sampled), max_frames, replace=False)]
+    return sampled
+
+
+def collect_stats(paths, ubm, n_workers=None, chunk_seconds=60.0):
+    """
+    Baum-Welch statistics of every recording, one recording per worker task.
+
+    Returns:
+        tuple: (N [U, C], F [U, C, D])
+    """
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(_file_stats, paths, [ubm] * len(paths), [chunk_seconds] * len(paths)))
+    return np.array([n for n, _ in results]), np.array([f for _, f in results])
+
+
+class IVectorExtractor:
+    """
+    Total-variability model working in the UBM-normalized supervector space.
+
+    Args:
+        ubm (UBM): Universal background model.
+        rank (int): i-vector dimension (400 for the Data2 features).
+        seed (int): Seed for the random initialization of T.
+    """
+
+    def __init__(self, ubm, rank=400, seed=0):
+        self.ubm = ubm
+        self.rank = rank
+        rng = np.random.default_rng(seed)
+        # T 以 Sigma^{-1/2} T 的形式保存，形状 [C, D, R]
+        self.T = rng.normal(scale=0.1, size=(ubm.n_components, ubm.dim, rank))
+
+    def _normalized_first_order(self, n_stats, f_stats):
+        centered = f_stats - n_stats[..., None] * self.ubm.means
+        return centered / np.sqrt(self.ubm.variances)
+
+    def _posterior_batches(self, n_stats, f_tilde, batch_size=64):
+        """Yield (rows, posterior means [B, R], covariances [B, R, R]) of the latent factors batch by batch."""
+        C, D, R = self.T.shape
+        tt = np.matmul(self.T.transpose(0, 2, 1), self.T).reshape(C, R * R)
+        t_flat = self.T.reshape(C * D, R)
+        for start in range(0, len(n_stats), batch_size):
+            rows = slice(start, start + batch_size)
+            n_batch = n_stats[rows]
+            precision = np.eye(R) + (n_batch @ tt).reshape(-1, R, R)
+            linear = f_tilde[rows].reshape(len(n_batch), C * D) @ t_flat
+            cov = np.linalg.inv(precision)
+            yield rows, np.einsum('urs,us->ur', cov, linear), cov
+
+    def _posterior(self, n_stats, f_tilde, batch_size=64):
+        """Posterior means [U, R] of the latent factors."""
+        return np.vstack([mean for _, mean, _ in self._posterior_batches(n_stats, f_tilde, batch_size)])
+
+    def train(self, n_stats, f_stats, n_iter=10, batch_size=64):
+        """
+        EM training of T on recording statistics N [U, C], F [U, C, D].
+
+        The accumulators A_c = sum_u N_uc E[w w^T] and C_c = sum_u F_uc E[w]^T are
+        updated batch by batch, so the per-recording posterior covariances [R, R]
+        are never held for more than batch_size recordings at a time.
+        """
+        f_tilde = self._normalized_first_order(n_stats, f_stats)
+        C, D, R = self.T.shape
+        for iteration in range(n_iter):
+            acc_a = np.zeros((C, R, R))
+            acc_c = np.zeros((C, D, R))
+            for rows, w_mean, w_cov in self._posterior_batches(n_stats, f_tilde, batch_size):
+                w_cov += w_mean[:, :, None] * w_mean[:, None, :] # 就地得到二阶矩 E[w w^T]
+                acc_a += (n_stats[rows].T @ w_cov.reshape(len(w_mean), R * R)).reshape(C, R, R)
+                acc_c += np.einsum('ucd,ur->cdr', f_tilde[rows], w_mean)
+            # 每个分量独立更新: T_c = C_c A_c^{-1}
+            self.T = np.linalg.solve(acc_a, acc_c.transpose(0, 2, 1)).transpose(0, 2, 1)
+            print(f"  T-matrix EM iteration {iteration + 1}/{n_iter} finished.")
+        return self
+
+    def extract(self, n_stats, f_stats):
+        """i-vectors [U, R] for statistics N [U, C], F [U, C, D]."""
+        n_stats, f_stats = np.atleast_2d(n_stats), np.asarray(f_stats).reshape(-1, *self.ubm.means.shape)
+        return self._posterior(n_stats, self._normalized_first_order(n_stats, f_stats))
+
+    def save(self, path):
+        np.savez(path, weights=self.ubm.weights, means=self.ubm.means, variances=self.ubm.variances, T=self.T)
+        print(f"成功将 i-vector 模型保存到: {path}")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as model:
+            extractor = cls(UBM(model['weights'], model['means'], model['variances']), rank=model['T'].shape[2])
+            extractor.T = model['T']
+        return extractor
+
+
+def train_ivector_model(wav_dir, manifest_path, n_components=256, rank=400, n_iter=10,
+                        ubm_frames=500000, frame_fraction=0.1, n_workers=None, chunk_seconds=60.0, seed=0):
+    """
+    Fit the UBM and the T matrix on the recordings of a manifest (see mfcc.read_manifest).
+
+    Returns:
+        tuple: (extractor, N [U, C], F [U, C, D]), the recording statistics can be reused for extraction.
+    """
+    manifest = read_manifest(manifest_path)
+    paths = [os.path.join(wav_dir, path) for path, _, _ in manifest]
+    per_file = max(1, ubm_frames // len(paths))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        samples = list(executor.map(_sample_file_frames, paths, [frame_fraction] * len(paths),
+                                    [per_file] * len(paths), range(seed, seed + len(paths)),
+                                    [chunk_seconds] * len(paths)))
+    ubm = fit_ubm(np.vstack([s for s in samples if len(s)]), n_components=n_components, seed=seed)
+
+    print(f"Collecting Baum-Welch statistics for {len(paths)} recordings...")
+    n_stats, f_stats = collect_stats(paths, ubm, n_workers=n_workers, chunk_seconds=chunk_seconds)
+    extractor = IVectorExtractor(ubm, rank=rank, seed=seed).train(n_stats, f_stats, n_iter=n_iter)
+    return extractor, n_stats, f_stats
+
+
+def extract_group_ivectors(extractor, n_stats, f_stats, groups, output_path=data2_mfcc_dialect_gmm_ivector_path,
+                           names_key='dialect_names'):
+    """
+    Pool recording statistics per group and extract one i-vector per group.
+
+    Args:
+        extractor (IVectorExtractor): Trained model.
+        n_stats, f_stats: Recording statistics from collect_stats / train_ivector_model.
+        groups (sequence): Group name of each recording (e.g. the manifest areas), first-appearance order is kept.
+        output_path (str): npz written with 'features' and names_key.
+
+    Returns:
+        tuple: (features [G, R], names [G])
+    """
+    groups = np.asarray(groups)
+    names = list(dict.fromkeys(groups.tolist()))
+    pooled_n = np.array([n_stats[groups == name].sum(axis=0) for name in names])
+    pooled_f = np.array([f_stats[groups == name].sum(axis=0) for name in names])
+    features = extractor.extract(pooled_n, pooled_f)
+    np.savez_compressed(output_path, features=features, **{names_key: np.array(names)})
+    print(f"成功将 {len(names)} 个 i-vector 保存到: {output_path}")
+    return features, np.array(names)
@@ -1,25 +1,558 @@
 """
 Code to load the features
 """
+import copy
 import numpy as np
 import pickle
 import os # 导入 os 库用于路径拼接
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 数据文件路径定义 (请根据你的实际文件位置修改这些路径) ---
 # 假设你的数据文件存放在项目根目录下的 data/Data4 文件夹内
 # 你可能需要根据实际情况调整这些路径
-BASE_DATA3_DIR, BASE_DATA4_DIR = 'Data3', 'Data4' # 数据文件所在的基准目录
+BASE_DATA3_DIR, BASE_DATA4_DIR, BASE_DATA2_DIR, BASE_DATA1_DIR = 'Data3', 'Data4', 'Data2', 'Data1' # 数据文件所在的基准目录
 
 # Data4 的原始转写和元数据 pkl 文件
 data4_raw_data_path = os.path.join(BASE_DATA4_DIR, 'transcription_areas.pkl') 
+data4_raw_codes_dir = os.path.join(BASE_DATA4_DIR, 'transcription_codes') # 字典编码后的转写 (storage.convert_raw_pickle 生成)
 data4_distance_matrix_path = os.path.join(BASE_DATA4_DIR, 'distance_matrices.npz')
+data4_distance_matrix_dir = os.path.join(BASE_DATA4_DIR, 'distance_matrices') # 分块计算的结果，每个矩阵一个 .npy 文件
+TILE_PROGRESS_FILE = 'progress.txt' # 分块计算目录中的断点文件 (distance.cal_distance_tiled)
+data4_condensed_distance_dir = os.path.join(BASE_DATA4_DIR, 'distance_matrices_condensed') # 上三角 float32 格式 (storage.save_condensed_matrices 生成)
 data4_processed_info_path = os.path.join(BASE_DATA4_DIR, 'processed_info.pkl')
 # -------------------------------------------------------------
 data3_distance_matrix_path = os.path.join(BASE_DATA3_DIR, 'distance_matrices.npz')
+data3_condensed_distance_dir = os.path.join(BASE_DATA3_DIR, 'distance_matrices_condensed')
 data3_processed_info_path = os.path.join(BASE_DATA3_DIR, 'info.npz')
+# -------------------------------------------------------------
+data1_processed_info_path = os.path.join(BASE_DATA1_DIR, 'data.pkl')
+# -------------------------------------------------------------
+data2_mfcc_dialect_mean_path = os.path.join(BASE_DATA2_DIR, 'dialect_mean_features.npz')
+data2_mfcc_dialect_slice_path = os.path.join(BASE_DATA2_DIR, 'dialect_slice_mean_features.npz')
+data2_mfcc_dialect_gmm_ivector_path = os.path.join(BASE_DATA2_DIR, 'mfcc_gmm_ivectordialect.npz')
+
+# 编码目录中的文件名: <key>.npy 为码矩阵, 另有词表和其余元数据
+ENCODED_VOCAB_FILE, ENCODED_META_FILE = 'vocab.npz', 'meta.pkl'
+
+
+class EncodedTranscription:
+    """
+    字典编码的转写矩阵：整数码矩阵 (通常是内存映射的 uint16) 加一个小词表。
+
+    码 0 保留给缺失值 (vocab[0] 即 'MISSING')。索引时只解码取出的部分，
+    np.asarray(obj) 或 obj.decode() 才会解码整个矩阵；与字符串的 == / != 比较
+    直接在码矩阵上完成，不需要解码。
+    """
+
+    def __init__(self, codes, vocab):
+        self.codes = codes
+        self.vocab = np.asarray(vocab, dtype=object)
+        self._index = {symbol: code for code, symbol in enumerate(self.vocab.tolist())}
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self):
+        return self.codes.ndim
+
+    @property
+    def missing_value(self):
+        return self.vocab[0]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.vocab[self.codes[index]]
+
+    def decode(self):
+        """解码为完整的 dtype=object 字符串数组。"""
+        return self.vocab[np.asarray(self.codes)]
+
+    def __array__(self, dtype=None, copy=None):
+        decoded = self.decode()
+        return decoded if dtype is None else decoded.astype(dtype)
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            code = self._index.get(other)
+            if code is None:
+                return np.zeros(self.shape, dtype=bool)
+            return np.asarray(self.codes) == code
+        return self.decode() == other
+
+    def __ne__(self, other):
+        return ~self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"EncodedTranscription(shape={self.shape}, vocab_size={len(self.vocab)})"
+
+
+class CondensedDistanceMatrix:
+    """
+    只存储上三角 (不含对角线) 的对称距离矩阵，数据通常是内存映射的 float32 一维数组，
+    元素顺序与 scipy.spatial.distance.squareform 相同。
+
+    distance(i, j) 为 O(1) 查询；submatrix(indices) 只读取所需元素构造子矩阵，
+    不需要先构造完整矩阵；to_dense() 按需构造完整矩阵。
+    """
+
+    def __init__(self, values):
+        self.values = values
+        n = int(round((1 + np.sqrt(1 + 8 * len(values))) / 2))
+        if n * (n - 1) // 2 != len(values):
+            raise ValueError(f"长度 {len(values)} 不是合法的上三角元素个数。")
+        self.n = n
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    def __len__(self):
+        return self.n
+
+    def condensed_index(self, i, j):
+        """(i, j) (i != j) 在一维数组中的位置，支持数组输入。"""
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        return self.n * i - i * (i + 1) // 2 + (j - i - 1)
+
+    def distance(self, i, j):
+        if i == j:
+            return 0.0
+        return float(self.values[self.condensed_index(i, j)])
+
+    def submatrix(self, indices, dtype=np.float32):
+        """indices 对应的方阵 (len(indices) x len(indices))，对角线为 0。"""
+        indices = np.asarray(indices, dtype=np.int64)
+        k = len(indices)
+        sub = np.zeros((k, k), dtype=dtype)
+        rows, cols = np.triu_indices(k, 1)
+        i, j = indices[rows], indices[cols]
+        same = i == j
+        positions = self.condensed_index(i[~same], j[~same])
+        # 排序后读取，内存映射按顺序访问页面
+        order = np.argsort(positions)
+        gathered = np.empty(len(positions), dtype=self.values.dtype)
+        gathered[order] = self.values[positions[order]]
+        upper = np.zeros(len(i), dtype=dtype)
+        upper[~same] = gathered
+        sub[rows, cols] = upper
+        sub[cols, rows] = upper
+        return sub
+
+    def row(self, i, dtype=np.float32):
+        """第 i 个样本到所有样本的距离。"""
+        others = np.arange(self.n)
+        out = np.zeros(self.n, dtype=dtype)
+        mask = others != i
+        out[mask] = self.values[self.condensed_index(np.full(self.n - 1, i), others[mask])]
+        return out
+
+    def to_dense(self, dtype=np.float64):
+        """完整的 n x n 矩阵 (默认 float64)。"""
+        return self.submatrix(np.arange(self.n), dtype=dtype)
+
+    def __repr__(self):
+        return f"CondensedDistanceMatrix(n={self.n}, dtype={self.values.dtype})"
+
+
+# --- 定义不同数据集和类型下的特征列表和文件路径 ---
+# 这个字典定义了每个数据集名称下，不同类型对应哪些预定义特征以及从哪个文件加载
+DATASET_CONFIG = {
+    'Data4': {
+        'raw': {
+            'file': data4_raw_data_path,
+            'pkl_keys': ['word_name', 'area', 'slice', 'slices', 'coords', 'initial', 'final', 'tone'],
+            'encoded_dir': data4_raw_codes_dir, # load_feats(..., encoded=True) 时从其中的 uint16 码矩阵内存映射读取
+            'encoded_keys': ['initial', 'final', 'tone'],
+            'loader': 'pickle' # 指定加载方式
+        },
+        'distance_matrices': {
+            'file': data4_distance_matrix_path,
+            'npz_keys': ['initials', 'finals', 'tones', 'overall'], # npz 文件中的键名
+            'output_keys': ['initials_distance', 'finals_distance', 'tones_distance', 'overall_distance'], # 输出字典中的键名
+            'npy_dir': data4_distance_matrix_dir, # 若该目录存在，优先以内存映射方式读取其中的 <npz_key>.npy
+            'loader': 'numpy_npz' # 指定加载方式
+        },
+        'graded_distance_matrices': {
+            'file': data4_distance_matrix_path, # 与二值距离矩阵保存在同一个 npz 中 (distance.cal_graded_distance_matrices 生成)
+            'npz_keys': ['initials_graded', 'finals_graded', 'tones_graded', 'overall_graded'],
+            'output_keys': ['initials_distance', 'finals_distance', 'tones_distance', 'overall_distance'],
+            'loader': 'numpy_npz'
+        },
+        'condensed_distance_matrices': {
+            'file': data4_condensed_distance_dir, # 目录，其中每个矩阵一个 <npz_key>.npy
+            'npz_keys': ['initials', 'finals', 'tones', 'overall'],
+            'output_keys': ['initials_distance', 'finals_distance', 'tones_distance', 'overall_distance'],
+            'loader': 'condensed'
+        },
+        'info': {
+            'file': data4_processed_info_path,
+            # 处理后信息文件的键名和输出键名一致
+            'pkl_keys': ['areas', 'slice', 'slices', 'coords', 'word_names'], # 注意这里的键名与保存时字典的键名对应
+            'loader': 'pickle'}
+        # 可以继续添加其他 type...
+        # 'another_type': {...}
+    },
+    'Data3': {
+        'distance_matrices': {
+            'file': data3_distance_matrix_path,
+            'npz_keys': ['lexicon', 'phonology', 'syntax', 'overall'], # npz 文件中的键名
+            'output_keys': ['lexicon_distance', 'phonology_distance', 'syntax_distance', 'overall_distance'], # 输出字典中的键名
+            'loader': 'numpy_npz' # 指定加载方式
+        },
+        'condensed_distance_matrices': {
+            'file': data3_condensed_distance_dir,
+            'npz_keys': ['lexicon', 'phonology', 'syntax', 'overall'],
+            'output_keys': ['lexicon_distance', 'phonology_distance', 'syntax_distance', 'overall_distance'],
+            'loader': 'condensed'
+        },
+        'info': {
+            'file': data3_processed_info_path,
+            # 处理后信息文件的键名和输出键名一致
+            'npz_keys': ['coords'], # 注意这里的键名与保存时字典的键名对应
+            'output_keys': ['coords'],
+            'loader': 'numpy_npz'}
+    },
+    'Data1': {
+        'info': {
+            'file': data1_processed_info_path,
+            'pkl_keys': ['word', 'initial', 'final_1', 'final_2', 'final_3', 'tone'],
+            'loader': 'pickle'}
+    },
+    'Data2': {
+        'mfcc_dialect_mean': {
+            'file': data2_mfcc_dialect_mean_path,
+            'npz_keys': ['features', 'dialect_names'], # npz 文件中的键名
+            'output_keys': ['features', 'names'], # 输出字典中的键名
+            'loader': 'numpy_npz'
+        },
+        'mfcc_slice_mean': {
+            'file': data2_mfcc_dialect_slice_path,
+            'npz_keys': ['features', 'slice_names'],
+            'output_keys': ['features', 'names'],
+            'loader': 'numpy_npz'
+        },
+        'mfcc_dialect_gmm_ivector': {
+            'file': data2_mfcc_dialect_gmm_ivector_path,
+            'npz_keys': ['features', 'dialect_names'],
+            'output_keys': ['features', 'names'],
+            'loader': 'numpy_npz'
+        },
+    }
+    # 可以继续添加其他 name...
+    # 'AnotherDataset': {...}
+}
+
+
+def _directory_signature(directory):
+    stats = tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                         for entry in os.scandir(directory) if entry.is_file())) # 目录不存在时抛出 FileNotFoundError
+    return (directory, stats)
+
+
+def _tiles_complete(directory):
+    """分块计算的结果目录中，progress 文件是否记录了全部的块。"""
+    progress_path = os.path.join(directory, TILE_PROGRESS_FILE)
+    if not os.path.exists(progress_path):
+        return False
+    with open(progress_path) as f:
+        lines = f.read().splitlines()
+    if not lines:
+        return False
+    params = dict(part.split('=', 1) for part in lines[0].split() if '=' in part)
+    if 'n_dialects' not in params or 'tile_size' not in params:
+        return False
+    n_tiles = -(-int(params['n_dialects']) // int(params['tile_size']))
+    done = {tuple(line.split()) for line in lines[1:] if len(line.split()) == 2}
+    return len(done) >= n_tiles * (n_tiles + 1) // 2
+
+
+def _use_npy_dir(type_config):
+    """
+    npy_dir 只有在分块计算全部完成、且不比 npz 文件旧时才使用；
+    未完成的目录中是尚未填充的内存映射，之后对 npz 的更新也不能被旧目录遮盖。
+    """
+    directory = type_config.get('npy_dir')
+    if not directory or not os.path.isdir(directory) or not _tiles_complete(directory):
+        return False
+    file_path = type_config['file']
+    if not os.path.exists(file_path):
+        return True
+    progress_mtime = os.stat(os.path.join(directory, TILE_PROGRESS_FILE)).st_mtime_ns
+    return progress_mtime >= os.stat(file_path).st_mtime_ns
+
+
+def _source_signature(type_config, encoded=False):
+    """
+    确定某个 type 实际从哪里读取，并返回 (读取方式, 文件签名)。
+    文件签名由路径、修改时间和大小组成，任一变化都会使缓存失效。
+
+    编码目录只在 encoded=True 时使用 (返回 EncodedTranscription)；否则仅当原始 pickle
+    不存在时才从编码目录读取并解码 ('decoded')，返回类型与 pickle 相同。
+    """
+    if _use_npy_dir(type_config):
+        return 'npy_dir', _directory_signature(type_config['npy_dir'])
+    directory = type_config.get('encoded_dir')
+    if directory and os.path.isdir(directory) and (encoded or not os.path.exists(type_config['file'])):
+        return 'encoded' if encoded else 'decoded', _directory_signature(directory)
+    file_path = type_config['file']
+    if type_config['loader'] == 'condensed':
+        # condensed 类型的 file 本身就是目录
+        return 'condensed', _directory_signature(file_path)
+    stat = os.stat(file_path) # 文件不存在时抛出 FileNotFoundError
+    return type_config['loader'], (file_path, stat.st_mtime_ns, stat.st_size)
+
 
+def source_signature(name, type, encoded=False):
+    """
+    数据集某个类型当前的 (读取方式, 文件签名)，与缓存失效使用的签名相同。
+    可用于判断由该数据派生并持久化的结果 (例如近邻索引) 是否过期；数据文件不存在时抛出 FileNotFoundError。
+    """
+    return _source_signature(DATASET_CONFIG[name][type], encoded=encoded)
+
+
+def _freeze(value):
+    """缓存中的 numpy 数组 (以及编码转写的词表) 设为只读，内存映射本身已是只读。"""
+    if isinstance(value, EncodedTranscription):
+        value.vocab.setflags(write=False)
+    elif isinstance(value, np.ndarray) and value.flags.writeable:
+        value.setflags(write=False)
+    return value
+
+
+def _hand_out(value):
+    """只读的数组和对象直接共享；列表、字典等可变对象返回深拷贝，调用者的修改不会写回缓存。"""
+    if isinstance(value, (np.ndarray, EncodedTranscription, CondensedDistanceMatrix, str, bytes, int, float)):
+        return value
+    return copy.deepcopy(value)
+
+
+class _CacheEntry:
+    """
+    一个 (数据集, 类型) 的缓存：文件在首次访问某个特征时才读取对应部分。
+
+    npz 和 .npy 目录按特征读取；pickle 文件 (Data4 'raw' / 'info', Data1 'info') 只能整体反序列化，
+    首次请求其中任一特征时会读入整个文件，之后的特征直接从内存中取出。需要按特征读取 Data4 转写时，
+    使用编码格式 (storage.convert_raw_pickle, load_feats(..., encoded=True))。
+    """
+
+    def __init__(self, type_config, mode, signature):
+        self.type_config = type_config
+        self.mode = mode
+        self.signature = signature
+        self.values = {} # 源键 -> 已读取的数据
+        self.nbytes = 0
+        self.bytes_read = 0 # 从文件读取 (或映射) 的字节数，供 LoadStats 统计
+        self.lock = threading.Lock()
+        self._handle = None # 打开的 npz 文件、反序列化后的 pickle 字典或编码词表
+
+    def _materialize(self, source_key):
+        config = self.type_config
+        if self.mode in ('npy_dir', 'condensed'):
+            # 内存映射由操作系统管理页面，不计入缓存大小
+            npy_dir = config['npy_dir'] if self.mode == 'npy_dir' else config['file']
+            npy_path = os.path.join(npy_dir, f"{source_key}.npy")
+            if not os.path.exists(npy_path):
+                raise KeyError(source_key)
+            values = np.load(npy_path, mmap_mode='r')
+            self.bytes_read += os.path.getsize(npy_path)
+            return values if self.mode == 'npy_dir' else CondensedDistanceMatrix(values)
+
+        if self.mode in ('encoded', 'decoded'):
+            encoded_dir = config['encoded_dir']
+            if source_key in config.get('encoded_keys', []):
+                if self._handle is None:
+                    with np.load(os.path.join(encoded_dir, ENCODED_VOCAB_FILE)) as vocab_npz:
+                        self._handle = {key: vocab_npz[key] for key in vocab_npz.files}
+                    self.bytes_read += os.path.getsize(os.path.join(encoded_dir, ENCODED_VOCAB_FILE))
+                codes = np.load(os.path.join(encoded_dir, f"{source_key}.npy"), mmap_mode='r')
+                self.bytes_read += codes.nbytes
+                transcription = EncodedTranscription(codes, self._handle[source_key])
+                if self.mode == 'encoded':
+                    return transcription
+                decoded = transcription.decode()
+                self.nbytes += decoded.nbytes
+                return decoded
+            if 'meta' not in self.values:
+                with open(os.path.join(encoded_dir, ENCODED_META_FILE), 'rb') as f:
+                    self.values['meta'] = pickle.load(f)
+                self.nbytes += os.path.getsize(os.path.join(encoded_dir, ENCODED_META_FILE))
+                self.bytes_read += os.path.getsize(os.path.join(encoded_dir, ENCODED_META_FILE))
+            return self.values['meta'][source_key]
+
+        if self.mode == 'numpy_npz':
+            if self._handle is None:
+                self._handle = np.load(config['file'])
+            value = self._handle[source_key]
+            value.setflags(write=False) # 缓存中的数组被多次返回，禁止就地修改
+            self.nbytes += value.nbytes
+            self.bytes_read += value.nbytes
+            return value
+
+        # pickle 只能整体反序列化，首次访问时读入整个字典，以文件大小估计内存占用
+        if self._handle is None:
+            with open(config['file'], 'rb') as f:
+                self._handle = pickle.load(f)
+            self.nbytes += os.path.getsize(config['file'])
+            self.bytes_read += os.path.getsize(config['file'])
+        return self._handle[source_key]
+
+    def get(self, source_key):
+        """返回 (数据, 是否命中缓存, 读取的字节数)。文件中缺少该键时抛出 KeyError。"""
+        with self.lock:
+            if source_key in self.values and source_key != 'meta':
+                return _hand_out(self.values[source_key]), True, 0
+            before = self.bytes_read
+            value = _freeze(self._materialize(source_key))
+            self.values[source_key] = value
+            return _hand_out(value), False, self.bytes_read - before
+
+    def close(self):
+        with self.lock:
+            if hasattr(self._handle, 'close'):
+                self._handle.close()
+            self._handle = None
+            self.values = {}
+
+
+class DatasetRegistry:
+    """
+    数据集注册表：按 (数据集, 类型) 缓存已加载的数据。
+
+    - 每个特征在首次被请求时才从文件中读取 (npz 按键读取, pickle 整体读取一次)；
+    - 文件的修改时间或大小变化后，对应缓存自动失效并重新读取；
+    - 缓存总大小超过 max_bytes 时，按最近最少使用 (LRU) 的顺序淘汰。
+
+    缓存中的 numpy 数组被设为只读，多次调用返回的是同一份数据；pickle 中的列表等
+    可变对象每次返回一份拷贝，修改返回值不会影响之后的调用。
+    """
+
+    def __init__(self, config=None, max_bytes=2 * 1024 ** 3):
+        self.config = DATASET_CONFIG if config is None else config
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def _entry(self, name, type, encoded=False):
+        type_config = self.config[name][type]
+        mode, signature = _source_signature(type_config, encoded=encoded)
+        key = (name, type, encoded)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.signature != signature:
+                if entry is not None:
+                    print(f"文件已变化，重新加载 '{name}' / '{type}'。")
+                    entry.close()
+                entry = _CacheEntry(type_config, mode, signature)
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            return entry
+
+    def _evict(self):
+        with self._lock:
+            # 至少保留最近使用的一项
+            while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                entry.close()
+
+    def get(self, name, type, source_keys, stats=None, encoded=False):
+        """
+        读取 (name, type) 下的特征。
+
+        Args:
+            name (str): 数据集名称。
+            type (str): 数据类型。
+            source_keys (dict): 输出键 -> 文件中的源键。
+            stats (LoadStats, optional): 记录每个特征的读取字节数、耗时和是否命中缓存。
+            encoded (bool): 转写以 EncodedTranscription 返回 (见 load_feats)。
 
-def load_feats(name, type=None, features=None):
+        Returns:
+            dict: 输出键 -> 数据。文件中缺少的特征会打印警告并被跳过。
+        """
+        entry = self._entry(name, type, encoded=encoded)
+        loaded_data = {}
+        for output_key, source_key in source_keys.items():
+            start = time.perf_counter()
+            try:
+                value, hit, bytes_read = entry.get(source_key)
+            except KeyError:
+                print(f"警告: 在 '{entry.signature[0]}' 中未找到特征 '{output_key}' (查找键 '{source_key}')。")
+                continue
+            with self._lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if stats is not None:
+                stats.record(name, type, output_key, bytes_read, time.perf_counter() - start, hit)
+            loaded_data[output_key] = value
+        self._evict()
+        return loaded_data
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.close()
+            self._entries.clear()
+
+
+class LoadStats:
+    """
+    load_feats(stats=...) 的统计结果，传入后不再打印加载进度。
+
+    - bytes_read: 从文件读取的字节数 (内存映射按映射的字节数计，pickle 按文件大小计)；
+    - decode_seconds: 未命中缓存时读取和反序列化所用的时间；
+    - cache_hits / cache_misses: 按特征计数；
+    - records: 每个特征一条记录 (name, type, key, bytes, seconds, hit)。
+    """
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.decode_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, name, type, key, bytes_read, seconds, hit):
+        with self._lock:
+            self.records.append({'name': name, 'type': type, 'key': key, 'bytes': bytes_read,
+                                 'seconds': seconds, 'hit': hit})
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+                self.bytes_read += bytes_read
+                self.decode_seconds += seconds
+
+    def as_dict(self):
+        return {'bytes_read': self.bytes_read, 'decode_seconds': self.decode_seconds,
+                'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses, 'records': list(self.records)}
+
+    def __repr__(self):
+        return (f"LoadStats(bytes_read={self.bytes_read}, decode_seconds={self.decode_seconds:.4f}, "
+                f"cache_hits={self.cache_hits}, cache_misses={self.cache_misses})")
+
+
+# load_feats 默认使用的全局注册表
+REGISTRY = DatasetRegistry()
+
+
+def load_feats(name, type=None, features=None, cache=True, stats=None, encoded=False, registry=None):
     """
     加载指定数据集的指定类型或指定特征的数据。
 
@@ -32,56 +565,20 @@ def load_feats(name, type=None, features=None):
                                      如果 type 已指定，features 可用于过滤该类型下的特征。
                                      如果 type 为 None，则加载此列表中指定的特征。
                                      Defaults to None.
+        cache (bool, optional): 是否通过全局注册表 REGISTRY 缓存读取结果。
+                                为 False 时每次都从文件重新读取，返回的数组可写。Defaults to True.
+        stats (LoadStats, optional): 传入时把读取字节数、解码时间和缓存命中记录到该对象中，
+                                     并且不打印加载进度 (错误和警告仍会打印)。Defaults to None.
+        encoded (bool, optional): 仅对配置了 encoded_dir 的类型 (Data4 'raw') 有效。为 True 且编码目录存在时，
+                                  转写以 EncodedTranscription (内存映射的码矩阵 + 词表) 返回；
+                                  默认返回与原始 pickle 相同的 np.ndarray。Defaults to False.
+        registry (DatasetRegistry, optional): 代替全局 REGISTRY 使用的注册表 (例如基准测试中每次运行独立的缓存)。
+                                              cache=False 时忽略。Defaults to None.
 
     Returns:
         dict: 包含请求特征的字典，键为特征名，值为对应的数据。
               如果加载失败或未找到数据集/类型，返回空字典或 None。
     """
-    loaded_data = {}
-
-    # --- 定义不同数据集和类型下的特征列表和文件路径 ---
-    # 这个字典定义了每个数据集名称下，不同类型对应哪些预定义特征以及从哪个文件加载
-    DATASET_CONFIG = {
-        'Data4': {
-            'raw': {
-                'file': data4_raw_data_path,
-                'pkl_keys': ['word_name', 'area', 'slice', 'slices', 'coords', 'initial', 'final', 'tone'],
-                'loader': 'pickle' # 指定加载方式
-            },
-            'distance_matrices': {
-                'file': data4_distance_matrix_path,
-                'npz_keys': ['initials', 'finals', 'tones', 'overall'], # npz 文件中的键名
-                'output_keys': ['initials_distance', 'finals_distance', 'tones_distance', 'overall_distance'], # 输出字典中的键名
-                'loader': 'numpy_npz' # 指定加载方式
-            },
-            'info': {
-                'file': data4_processed_info_path,
-                # 处理后信息文件的键名和输出键名一致
-                'pkl_keys': ['areas', 'slice', 'slices', 'coords', 'word_names'], # 注意这里的键名与保存时字典的键名对应
-                'loader': 'pickle'}
-            # 可以继续添加其他 type...
-            # 'another_type': {...}
-        },
-        'Data3': {
-            'distance_matrices': {
-                'file': data3_distance_matrix_path,
-                'npz_keys': ['lexicon', 'phonology', 'syntax', 'overall'], # npz 文件中的键名
-                'output_keys': ['lexicon_distance', 'phonology_distance', 'syntax_distance', 'overall_distance'], # 输出字典中的键名
-                'loader': 'numpy_npz' # 指定加载方式
-            },
-            'info': {
-                'file': data3_processed_info_path,
-                # 处理后信息文件的键名和输出键名一致
-                'npz_keys': ['coords'], # 注意这里的键名与保存时字典的键名对应
-                'output_keys': ['coords'],
-                'loader': 'numpy_npz'}
-            # 可以继续添加其他 type...
-            # 'another_type': {...}
-        }
-        # 可以继续添加其他 name...
-        # 'AnotherDataset': {...}
-    }
-
     # --- 检查数据集名称是否存在 ---
     if name not in DATASET_CONFIG:
         print(f"错误: 数据集 '{name}' 的配置不存在。")
@@ -108,7 +605,7 @@ def load_feats(name, type=None, features=None):
             all_type_features = type_config.get('pkl_keys', [])
             # pickle 加载是直接从字典取，源键和输出键一致
             source_keys = {k: k for k in all_type_features}
-        elif loader_type == 'numpy_npz':
+        elif loader_type in ('numpy_npz', 'condensed'):
             all_type_features = type_config.get('output_keys', [])
             # npz 加载需要处理源键到输出键的映射
             npz_keys = type_config.get('npz_keys', [])
@@ -135,15 +632,10 @@ def load_feats(name, type=None, features=None):
                 print(f"警告: 请求的特征 {not_available} 不属于数据集 '{name}' 的类型 '{type}'，将被忽略。")
 
     elif features is not None:
-         # 如果 type 为 None 但指定了 features (旧的使用方式，可以保留兼容性或弃用)
-         # 为了新设计清晰，建议要求必须指定 type
+         # 如果 type 为 None 但指定了 features (旧的使用方式，已不支持)
+         # 为了新设计清晰，要求必须指定 type
          print("错误: 未指定数据加载类型 (type)，请指定如 type='raw'。")
          return {}
-         # 以下是保留旧 features 用法的代码，如果需要兼容可以启用：
-         # print("警告: 未指定数据类型 (type)，尝试按特征列表加载 (旧模式)。")
-         # # 需要遍历所有 type 才能找到哪些特征在哪里，比较复杂，不推荐。
-         # # 更好的方式是：要求用户必须指定 type。
-         # pass # 在新设计中不推荐无 type 加载
 
     else:
         # type 和 features 都为 None
@@ -160,32 +652,22 @@ def load_feats(name, type=None, features=None):
         print(f"未找到需要加载的特征列表，请检查 type 或 features 参数。")
         return {}
 
-    print(f"正在从文件 '{file_to_load}' 加载数据...")
-    print(f"计划加载的特征: {features_to_load_final}")
+    if stats is None:
+        print(f"正在从文件 '{file_to_load}' 加载数据...")
+        print(f"计划加载的特征: {features_to_load_final}")
 
+    # 不使用缓存时用一个临时注册表，读取逻辑保持一致
+    if not cache:
+        registry = DatasetRegistry(max_bytes=0)
+    elif registry is None:
+        registry = REGISTRY
     try:
-        if loader_type == 'pickle':
-            with open(file_to_load, 'rb') as f:
-                data_dict = pickle.load(f)
-
-            for feature_name in features_to_load_final:
-                # 从加载的字典中按特征名获取数据
-                # 使用 .get() 避免 KeyError 如果文件中的确缺少该特征
-                if feature_name in data_dict:
-                     loaded_data[feature_name] = data_dict[feature_name]
-                else:
-                     print(f"警告: 在文件 '{file_to_load}' 中未找到特征 '{feature_name}'。")
-
-        elif loader_type == 'numpy_npz':
-            loaded_npz = np.load(file_to_load)
-            for output_key in features_to_load_final:
-                 source_key = source_keys.get(output_key) # 获取 npz 文件中的对应键
-                 if source_key and source_key in loaded_npz:
-                     loaded_data[output_key] = loaded_npz[source_key]
-                 else:
-                     print(f"警告: 在文件 '{file_to_load}' 中未找到特征 '{output_key}' (查找键 '{source_key}')。")
-            loaded_npz.close() # 关闭 npz 文件句柄
-
+        loaded_data = registry.get(name, type, {k: source_keys[k] for k in features_to_load_final}, stats=stats,
+                                   encoded=encoded)
+        if not cache:
+            for value in loaded_data.values():
+                if isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+                    value.setflags(write=True)
     except FileNotFoundError:
         print(f"错误: 数据文件 '{file_to_load}' 未找到。请检查路径设置。")
         return {} # 返回空字典表示失败
@@ -193,5 +675,24 @@ def load_feats(name, type=None, features=None):
         print(f"错误加载文件 '{file_to_load}': {e}")
         return {} # 返回空字典表示失败
 
-    print(f"成功加载 {len(loaded_data)} 个特征。")
-    return loaded_data
\ No newline at end of file
+    if stats is None:
+        print(f"成功加载 {len(loaded_data)} 个特征。")
+    return loaded_data
+
+
+def load_many(requests, max_workers=None):
+    """
+    在线程池中同时加载多个 数据集/类型 组合。
+
+    Args:
+        requests (list): 每项为 (name, type) 或 (name, type, features) 元组，
+                         e.g. [('Data3', 'distance_matrices'), ('Data4', 'distance_matrices'), ('Data4', 'info')]。
+        max_workers (int, optional): 线程数，默认为请求数。
+
+    Returns:
+        list: 与 requests 顺序对应的 load_feats 结果字典。
+    """
+    if not requests:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers or len(requests)) as executor:
+        return list(executor.map(lambda request: load_feats(*request), requests))
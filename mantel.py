@@ -0,0 +1,224 @@
+"""
+Mantel and partial Mantel tests between dialect distance matrices.
+
+Matrices are reduced to condensed (upper-triangle) vectors and standardized
+once, so the statistic of a permutation is a single dot product: permuting
+the dialects of X gives r = sum_{i<j} Xs[p_i, p_j] * Ys[i, j] / n_pairs.
+The permuted condensed vector is gathered directly into a preallocated
+buffer, a block of condensed rows (X[p_i, p_{i+1..n-1}]) at a time through
+a precomputed triangular mask, and dotted with the condensed Y (and Z); no
+permuted n x n matrix is built per permutation. Spearman correlation is the same
+computation on ranks. Permutations are drawn in batches from
+per-batch child seeds of one SeedSequence, so results only depend on
+`seed` and not on the number of workers.
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial.distance import squareform
+from scipy.stats import rankdata
+
+from geo import GeoIndex, haversine
+from load import CondensedDistanceMatrix
+
+_WORKER = {} # 工作进程中标准化后的 X (完整矩阵)、其它矩阵的上三角向量和行块，由 initializer 设置一次
+GATHER_BLOCK = 1 << 15 # 每个行块读取的元素数 (约)，保持在缓存之内
+
+
+def geo_distance_matrix(coords, condensed=False):
+    """
+    Great-circle distances (km) between all pairs of coordinates.
+
+    Args:
+        coords (array_like): [n, 2] (longitude, latitude) in degrees, as in load_feats(type='info')['coords'].
+        condensed (bool): Return the condensed vector of length n * (n - 1) / 2 instead of the [n, n] matrix.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if condensed:
+        i, j = np.triu_indices(len(coords), k=1)
+        return haversine(coords[i, 0], coords[i, 1], coords[j, 0], coords[j, 1])
+    lon, lat = coords[:, 0], coords[:, 1]
+    matrix = haversine(lon[:, None], lat[:, None], lon[None, :], lat[None, :])
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def as_condensed(matrix):
+    """Condensed float64 vector of a square matrix, CondensedDistanceMatrix or condensed vector."""
+    if isinstance(matrix, CondensedDistanceMatrix):
+        return np.asarray(matrix.values, dtype=np.float64)
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim == 1:
+        return matrix
+    if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(f"Expected a square matrix or a condensed vector, got shape {matrix.shape}.")
+    return squareform(matrix, checks=False)
+
+
+def _standardize(vector, method):
+    if np.isnan(vector).any():
+        raise ValueError("Distance matrix contains NaN; drop or impute the affected dialects first.")
+    if method == 'spearman':
+        vector = rankdata(vector)
+    elif method != 'pearson':
+        raise ValueError(f"Unknown method '{method}', use 'pearson' or 'spearman'.")
+    std = vector.std()
+    if std == 0:
+        raise ValueError("Distance matrix is constant; correlation is undefined.")
+    return (vector - vector.mean()) / std
+
+
+def _partial(r_xy, r_xz, r_yz):
+    return (r_xy - r_xz * r_yz) / np.sqrt((1 - r_xz ** 2) * (1 - r_yz ** 2))
+
+
+def condensed_row_blocks(n, block=GATHER_BLOCK):
+    """
+    Split the condensed rows of an n x n matrix into blocks for gathering.
+
+    Returns:
+        list: (i0, i1, start, stop, mask) per block; rows i0..i1-1 occupy condensed[start:stop]
+              and mask [i1 - i0, n - i0 - 1] selects their entries (j > i) from columns i0+1..n-1.
+    """
+    starts = np.concatenate([[0], np.cumsum(np.arange(n - 1, 0, -1))])
+    blocks, i0 = [], 0
+    while i0 < n - 1:
+        i1 = min(n - 1, i0 + max(1, block // (n - i0)))
+        mask = np.arange(n - i0 - 1)[None, :] >= np.arange(i1 - i0)[:, None]
+        blocks.append((i0, i1, starts[i0], starts[i1], mask))
+        i0 = i1
+    return blocks
+
+
+def _init_worker(xs, others):
+    _WORKER['x'] = squareform(xs)
+    _WORKER['others'] = np.vstack(others)
+    _WORKER['blocks'] = condensed_row_blocks(len(_WORKER['x']))
+
+
+def _permutation_batch(seed_seq, batch_size):
+    """Correlations of permuted X with every other matrix: [len(others), batch_size]."""
+    x_full, others, blocks = _WORKER['x'], _WORKER['others'], _WORKER['blocks']
+    rng = np.random.default_rng(seed_seq)
+    permuted = np.empty(others.shape[1])
+    stats = np.empty((len(others), batch_size))
+    for b in range(batch_size):
+        p = rng.permutation(len(x_full))
+        for i0, i1, start, stop, mask in blocks:
+            # 置换后上三角第 i 行为 X[p_i, p_{i+1:}]；整块行先取矩形，再用三角掩码取出
+            permuted[start:stop] = x_full.take(p[i0:i1], axis=0).take(p[i0 + 1:], axis=1)[mask]
+        stats[:, b] = others @ permuted / len(permuted)
+    return stats
+
+
+def _p_value(statistic, null, alternative):
+    if alternative == 'greater':
+        extreme = null >= statistic
+    elif alternative == 'less':
+        extreme = null <= statistic
+    elif alternative == 'two-sided':
+        extreme = np.abs(null) >= abs(statistic)
+    else:
+        raise ValueError(f"Unknown alternative '{alternative}', use 'greater', 'less' or 'two-sided'.")
+    return (extreme.sum() + 1) / (len(null) + 1)
+
+
+def mantel(x, y, z=None, method='pearson', permutations=9999, alternative='greater', seed=0,
+           n_workers=None, batch_size=250):
+    """
+    Mantel test of x against y, or partial Mantel test controlling for z.
+
+    The dialects of x are permuted; y and z stay fixed.
+
+    Args:
+        x, y, z: [n, n] distance matrices, CondensedDistanceMatrix or condensed vectors over the same dialects.
+        method (str): 'pearson' or 'spearman'.
+        permutations (int): Number of permutations (0 skips the test).
+        alternative (str): 'greater', 'less' or 'two-sided'.
+        seed (int): Seed of the permutations.
+        n_workers (int, optional): Number of worker processes.
+        batch_size (int): Permutations per worker task.
+
+    Returns:
+        dict: 'r' (statistic), 'p_value', 'permutations' and 'null' (permuted statistics).
+    """
+    vectors = [as_condensed(m) for m in (x, y) + ((z,) if z is not None else ())]
+    if len({len(v) for v in vectors}) != 1:
+        raise ValueError(f"Matrices cover different numbers of dialect pairs: {[len(v) for v in vectors]}.")
+    xs, *others = [_standardize(v, method) for v in vectors]
+    n_pairs = len(xs)
+
+    correlations = [xs @ other / n_pairs for other in others]
+    if z is None:
+        statistic = correlations[0]
+    else:
+        r_yz = others[0] @ others[1] / n_pairs
+        statistic = _partial(correlations[0], correlations[1], r_yz)
+    result = {'r': statistic, 'p_value': np.nan, 'permutations': permutations, 'null': np.zeros(0)}
+    if permutations <= 0:
+        return result
+
+    sizes = [min(batch_size, permutations - start) for start in range(0, permutations, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(xs, others)) as executor:
+        null = np.hstack(list(executor.map(_permutation_batch, seeds, sizes)))
+    null = null[0] if z is None else _partial(null[0], null[1], r_yz)
+
+    result['null'] = null
+    result['p_value'] = _p_value(statistic, null, alternative)
+    return result
+
+
+def align_by_coords(coords_a, coords_b, max_km=1.0):
+    """
+    Match dialects of two datasets by location.
+
+    A pair is kept when both points are each other's nearest neighbour and
+    lie within `max_km`, so the matching is one-to-one.
+
+    Args:
+        coords_a, coords_b (array_like): [n, 2] (longitude, latitude) in degrees.
+        max_km (float): Largest accepted distance between matched points.
+
+    Returns:
+        tuple: (indices_a, indices_b) int arrays, ordered by indices_a.
+    """
+    index_a, index_b = GeoIndex(coords_a), GeoIndex(coords_b)
+    to_a = index_a.query(coords_b, k=1)
+    to_b = index_b.query(coords_a, k=1)['indices'][:, 0]
+    nearest_a, distances = to_a['indices'][:, 0], to_a['distances_km'][:, 0]
+    keep = (to_b[nearest_a] == np.arange(len(nearest_a))) & (distances <= max_km)
+    indices_b = np.flatnonzero(keep)
+    indices_a = nearest_a[indices_b]
+    order = np.argsort(indices_a)
+    print(f"按坐标匹配到 {len(order)} 个方言点 (距离阈值 {max_km} km)。")
+    return indices_a[order], indices_b[order]
+
+
+def submatrix(matrix, indices):
+    """Rows/columns `indices` of a square matrix or CondensedDistanceMatrix."""
+    if isinstance(matrix, CondensedDistanceMatrix):
+        return matrix.submatrix(indices, dtype=np.float64)
+    return np.asarray(matrix)[np.ix_(indices, indices)]
+
+
+def pairwise_mantel(matrices, control=None, **kwargs):
+    """
+    Mantel (or partial Mantel, given `control`) test for every pair of named matrices.
+
+    Args:
+        matrices (dict): Name -> matrix, all over the same dialects (see align_by_coords / submatrix).
+        control: Optional matrix (e.g. geo_distance_matrix(coords)) partialled out of every test.
+        **kwargs: Passed to mantel().
+
+    Returns:
+        dict: (name_a, name_b) -> mantel() result.
+    """
+    names = list(matrices)
+    results = {}
+    for i, name_a in enumerate(names):
+        for name_b in names[i + 1:]:
+            results[(name_a, name_b)] = mantel(matrices[name_a], matrices[name_b], z=control, **kwargs)
+            print(f"{name_a} ~ {name_b}: r = {results[(name_a, name_b)]['r']:.4f}, "
+                  f"p = {results[(name_a, name_b)]['p_value']:.4g}")
+    return results
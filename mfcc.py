@@ -0,0 +1,227 @@
+"""
+Streaming MFCC aggregation that regenerates the Data2 mean-feature files.
+
+Each wav file is read in bounded chunks and turned into 39-dim MFCC frames
+(13 static coefficients c0..c12 plus deltas and delta-deltas, 25 ms window,
+10 ms hop). Frames are never collected: every file is reduced to running
+per-dimension statistics (count, mean, sum of squared deviations) on a
+process pool, and the parent merges them per dialect area and slice with
+Chan's parallel update.
+"""
+import csv
+import os
+import wave
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.fft import dct
+
+from load import data2_mfcc_dialect_mean_path, data2_mfcc_dialect_slice_path
+
+N_CEPS = 13
+DELTA_WIDTH = 2 # 差分回归窗口 ±2 帧；二阶差分因此需要 ±4 帧的上下文
+CONTEXT_FRAMES = 2 * DELTA_WIDTH
+
+
+class RunningStats:
+    """Numerically stable running count / mean / M2 over feature frames."""
+
+    def __init__(self, dim):
+        self.count = 0
+        self.mean = np.zeros(dim)
+        self.m2 = np.zeros(dim)
+
+    def update(self, frames):
+        """Add a batch of frames [n, dim]."""
+        frames = np.asarray(frames, dtype=np.float64)
+        if len(frames) == 0:
+            return
+        batch = RunningStats(frames.shape[1])
+        batch.count = len(frames)
+        batch.mean = frames.mean(axis=0)
+        batch.m2 = ((frames - batch.mean) ** 2).sum(axis=0)
+        self.merge(batch)
+
+    def merge(self, other):
+        """Chan et al. parallel combination of two sets of statistics."""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / total)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / total)
+        self.count = total
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else np.full_like(self.mean, np.nan)
+
+
+def mel_filterbank(sample_rate, n_fft, n_mels=26, fmin=0.0, fmax=None):
+    """Triangular mel filters [n_mels, n_fft // 2 + 1] (HTK mel scale)."""
+    fmax = fmax or sample_rate / 2
+    mel = lambda f: 2595.0 * np.log10(1 + f / 700.0)
+    inv_mel = lambda m: 700.0 * (10 ** (m / 2595.0) - 1)
+    hz_points = inv_mel(np.linspace(mel(fmin), mel(fmax), n_mels + 2))
+    fft_freqs = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+
+    lower, center, upper = hz_points[:-2, None], hz_points[1:-1, None], hz_points[2:, None]
+    rising = (fft_freqs - lower) / (center - lower)
+    falling = (upper - fft_freqs) / (upper - center)
+    return np.maximum(0, np.minimum(rising, falling))
+
+
+class MFCCExtractor:
+    """
+    39-dim MFCC frames for one sample rate.
+
+    Args:
+        sample_rate (int): Sample rate of the audio.
+        win_ms (float): Analysis window length in ms.
+        hop_ms (float): Frame shift in ms (10 ms for the Data2 features).
+        n_mels (int): Number of mel filters.
+        preemphasis (float): Pre-emphasis coefficient.
+    """
+
+    def __init__(self, sample_rate, win_ms=25.0, hop_ms=10.0, n_mels=26, preemphasis=0.97):
+        self.sample_rate = sample_rate
+        self.win = int(round(sample_rate * win_ms / 1000))
+        self.hop = int(round(sample_rate * hop_ms / 1000))
+        self.n_fft = 1 << (self.win - 1).bit_length()
+        self.preemphasis = preemphasis
+        self.window = np.hamming(self.win)
+        self.filters = mel_filterbank(sample_rate, self.n_fft, n_mels=n_mels)
+
+    def n_frames(self, n_samples):
+        return 0 if n_samples < self.win else 1 + (n_samples - self.win) // self.hop
+
+    def static(self, signal):
+        """Static c0..c12 for every full frame of an already pre-emphasized signal."""
+        n_frames = self.n_frames(len(signal))
+        if n_frames == 0:
+            return np.zeros((0, N_CEPS))
+        frames = np.lib.stride_tricks.sliding_window_view(signal, self.win)[::self.hop][:n_frames]
+        power = np.abs(np.fft.rfft(frames * self.window, n=self.n_fft)) ** 2 / self.n_fft
+        log_mel = np.log(np.maximum(power @ self.filters.T, np.finfo(float).tiny))
+        return dct(log_mel, type=2, axis=1, norm='ortho')[:, :N_CEPS]
+
+
+def deltas(features, width=DELTA_WIDTH):
+    """Regression deltas over +/- width frames with edge replication."""
+    padded = np.pad(features, ((width, width), (0, 0)), mode='edge')
+    n = len(features)
+    numerator = sum(k * (padded[width + k:width + k + n] - padded[width - k:width - k + n]) for k in range(1, width + 1))
+    return numerator / (2 * sum(k * k for k in range(1, width + 1)))
+
+
+def add_deltas(static):
+    first = deltas(static)
+    return np.hstack([static, first, deltas(first)])
+
+
+def _read_samples(wav_file, start, stop):
+    """Mono float samples [start, stop) of an open wave.Wave_read."""
+    wav_file.setpos(start)
+    raw = wav_file.readframes(stop - start)
+    width, channels = wav_file.getsampwidth(), wav_file.getnchannels()
+    if width == 1:
+        samples = np.frombuffer(raw, dtype=np.uint8).astype(np.float64) - 128
+    elif width in (2, 4):
+        samples = np.frombuffer(raw, dtype=f'<i{width}').astype(np.float64)
+    else:
+        raise ValueError(f"Unsupported sample width: {width} bytes.")
+    return samples.reshape(-1, channels).mean(axis=1)
+
+
+def iter_mfcc_chunks(path, chunk_seconds=60.0, extractor=None):
+    """
+    Yield the 39-dim MFCC frames of a wav file chunk by chunk.
+
+    Every chunk is computed with enough neighbouring samples for pre-emphasis
+    and the delta windows, so the concatenated output equals extracting the
+    whole file at once while memory stays bounded by the chunk length.
+    """
+    with wave.open(path, 'rb') as wav_file:
+        sample_rate, n_samples = wav_file.getframerate(), wav_file.getnframes()
+        extractor = extractor if extractor and extractor.sample_rate == sample_rate else MFCCExtractor(sample_rate)
+        n_frames = extractor.n_frames(n_samples)
+        chunk_frames = max(1, int(chunk_seconds * sample_rate) // extractor.hop)
+
+        for f0 in range(0, n_frames, chunk_frames):
+            f1 = min(f0 + chunk_frames, n_frames)
+            c0, c1 = max(0, f0 - CONTEXT_FRAMES), min(n_frames, f1 + CONTEXT_FRAMES)
+            start, stop = c0 * extractor.hop, (c1 - 1) * extractor.hop + extractor.win
+            # 预加重需要前一个采样点
+            lead = 1 if start > 0 else 0
+            samples = _read_samples(wav_file, start - lead, stop)
+            emphasized = np.append(samples[0], samples[1:] - extractor.preemphasis * samples[:-1])[lead:]
+            features = add_deltas(extractor.static(emphasized))
+            yield features[f0 - c0:f1 - c0]
+
+
+def file_stats(path, chunk_seconds=60.0):
+    """RunningStats of all MFCC frames in one wav file."""
+    stats = RunningStats(3 * N_CEPS)
+    for frames in iter_mfcc_chunks(path, chunk_seconds=chunk_seconds):
+        stats.update(frames)
+    return stats
+
+
+def read_manifest(manifest_path):
+    """
+    Read a CSV manifest with columns path, area, slice (slice may be empty).
+    Paths are relative to the wav directory.
+    """
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        rows = [(row['path'], row['area'], row.get('slice') or '') for row in csv.DictReader(f)]
+    if not rows:
+        raise ValueError(f"Manifest '{manifest_path}' has no entries.")
+    return rows
+
+
+def _save_group_means(groups, output_path, names_key):
+    names = list(groups)
+    np.savez_compressed(
+        output_path,
+        features=np.array([groups[name].mean for name in names], dtype=np.float32),
+        **{names_key: np.array(names)},
+        variances=np.array([groups[name].variance for name in names], dtype=np.float32),
+        frame_counts=np.array([groups[name].count for name in names], dtype=np.int64),
+    )
+    print(f"成功将 {len(names)} 组平均特征保存到: {output_path}")
+
+
+def aggregate_mfcc(wav_dir, manifest_path, dialect_output_path=data2_mfcc_dialect_mean_path,
+                   slice_output_path=data2_mfcc_dialect_slice_path, n_workers=None, chunk_seconds=60.0):
+    """
+    Regenerate dialect_mean_features.npz and dialect_slice_mean_features.npz.
+
+    Args:
+        wav_dir (str): Directory the manifest paths are relative to.
+        manifest_path (str): CSV with columns path, area, slice.
+        dialect_output_path (str): Output for per-area means ('features', 'dialect_names').
+        slice_output_path (str): Output for per-slice means ('features', 'slice_names').
+        n_workers (int, optional): Number of worker processes. Defaults to os.cpu_count().
+        chunk_seconds (float): Audio read and processed per step inside a worker.
+
+    Returns:
+        tuple: (area_stats, slice_stats), dicts of name -> RunningStats, in manifest order.
+    """
+    manifest = read_manifest(manifest_path)
+    print(f"共 {len(manifest)} 个音频文件。")
+    area_stats, slice_stats = {}, {}
+    dim = 3 * N_CEPS
+
+    paths = [os.path.join(wav_dir, path) for path, _, _ in manifest]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(file_stats, paths, [chunk_seconds] * len(paths))
+        for i, ((_, area, slice_name), stats) in enumerate(zip(manifest, results), 1):
+            area_stats.setdefault(area, RunningStats(dim)).merge(stats)
+            if slice_name:
+                slice_stats.setdefault(slice_name, RunningStats(dim)).merge(stats)
+            if i % 100 == 0:
+                print(f"  Processed {i}/{len(manifest)} files...")
+
+    _save_group_means(area_stats, dialect_output_path, 'dialect_names')
+    if slice_stats:
+        _save_group_means(slice_stats, slice_output_path, 'slice_names')
+    return area_stats, slice_stats
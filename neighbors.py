@@ -0,0 +1,258 @@
+"""
+Precomputed top-k nearest dialects for distance matrices and feature sets.
+
+For a distance matrix every row is reduced with np.argpartition to its k
+nearest rows; for feature vectors (Data2 MFCC means, i-vectors) the
+distances are computed batch by batch as matrix products (cosine or
+Euclidean) and reduced the same way. Only the [n, k] neighbour lists and
+the row labels used for filtering are persisted (Data<X>/neighbors/*.npz),
+so a service can answer queries without loading the full matrices.
+"""
+import os
+import numpy as np
+
+from geo import LABEL_KEYS
+from load import (load_feats, source_signature, CondensedDistanceMatrix,
+                  BASE_DATA2_DIR, BASE_DATA3_DIR, BASE_DATA4_DIR)
+
+NEIGHBOR_DIRS = {'Data4': os.path.join(BASE_DATA4_DIR, 'neighbors'),
+                 'Data3': os.path.join(BASE_DATA3_DIR, 'neighbors'),
+                 'Data2': os.path.join(BASE_DATA2_DIR, 'neighbors')}
+
+
+def _row_block(matrix, start, stop):
+    if isinstance(matrix, CondensedDistanceMatrix):
+        return np.array([matrix.row(i, dtype=np.float64) for i in range(start, stop)])
+    return np.asarray(matrix[start:stop], dtype=np.float64)
+
+
+def _check_k(k):
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}.")
+
+
+def _select_top_k(block, k, rows):
+    """k smallest entries of each row of a distance block, sorted; the row itself excluded."""
+    if k == 0:
+        # 只有一行时没有其它方言可选
+        return np.empty((len(block), 0), dtype=np.int64), np.empty((len(block), 0))
+    block = np.where(np.isnan(block), np.inf, block) # 无可比特征的方言对排在最后
+    if rows is not None:
+        # NaN 在排序中排在 inf 之后，保证自身不会与缺失的方言对同列最后而被选中
+        block[np.arange(len(block)), rows] = np.nan
+    part = np.argpartition(block, k - 1, axis=1)[:, :k]
+    part_dist = np.take_along_axis(block, part, axis=1)
+    order = np.argsort(part_dist, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_dist, order, axis=1)
+
+
+def top_k_from_distances(matrix, k=50, row_block=256):
+    """
+    Top-k neighbour lists of a square distance matrix.
+
+    Args:
+        matrix: [n, n] array (memory-mapped arrays are read block by block) or CondensedDistanceMatrix.
+        k (int): Neighbours per row (the row itself is excluded), clamped to n - 1.
+        row_block (int): Rows reduced per step.
+
+    Returns:
+        tuple: (indices int32 [n, k], distances float32 [n, k]); missing pairs have distance inf.
+    """
+    _check_k(k)
+    n = len(matrix)
+    k = min(k, n - 1)
+    indices = np.empty((n, k), dtype=np.int32)
+    distances = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, row_block):
+        stop = min(start + row_block, n)
+        indices[start:stop], distances[start:stop] = _select_top_k(_row_block(matrix, start, stop), k,
+                                                                   np.arange(start, stop))
+    return indices, distances
+
+
+def _pairwise(queries, features, metric, feature_norms):
+    if metric == 'cosine':
+        return 1.0 - queries @ features.T
+    if metric == 'euclidean':
+        squared = (queries ** 2).sum(axis=1)[:, None] + feature_norms[None, :] - 2 * queries @ features.T
+        return np.sqrt(np.maximum(squared, 0))
+    raise ValueError(f"Unknown metric '{metric}', use 'cosine' or 'euclidean'.")
+
+
+def _prepare_features(features, metric):
+    features = np.asarray(features, dtype=np.float64)
+    if metric == 'cosine':
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        features = features / np.where(norms == 0, 1, norms)
+    return features, (features ** 2).sum(axis=1)
+
+
+def top_k_from_features(features, k=50, metric='cosine', batch_size=1024, queries=None):
+    """
+    Top-k neighbour lists of feature vectors by batched matrix products.
+
+    Args:
+        features (array_like): [n, d] vectors, e.g. load_feats(name='Data2', ...)['features'].
+        k (int): Neighbours per row, clamped to the number of candidate rows.
+        metric (str): 'cosine' (1 - cosine similarity) or 'euclidean'.
+        batch_size (int): Query rows per matrix product.
+        queries (array_like, optional): [m, d] vectors to search for instead of the rows themselves
+                                        (then no row is excluded).
+
+    Returns:
+        tuple: (indices int32 [m, k], distances float32 [m, k])
+    """
+    _check_k(k)
+    features, norms = _prepare_features(features, metric)
+    self_search = queries is None
+    queries = features if self_search else _prepare_features(queries, metric)[0]
+    k = min(k, len(features) - 1 if self_search else len(features))
+    indices = np.empty((len(queries), k), dtype=np.int32)
+    distances = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        stop = min(start + batch_size, len(queries))
+        block = _pairwise(queries[start:stop], features, metric, norms)
+        indices[start:stop], distances[start:stop] = _select_top_k(
+            block, k, np.arange(start, stop) if self_search else None)
+    return indices, distances
+
+
+class NeighborIndex:
+    """
+    Persisted neighbour lists with row labels for filtering.
+
+    Args:
+        indices (np.ndarray): [n, k] neighbour rows, nearest first.
+        distances (np.ndarray): [n, k] matching distances.
+        labels (dict, optional): Label name -> sequence of length n (e.g. 'areas', 'slice', 'names').
+        metric (str): Description of the distance ('precomputed', 'cosine', 'euclidean').
+        source (str): Signature of the data the lists were computed from.
+    """
+
+    def __init__(self, indices, distances, labels=None, metric='precomputed', source=''):
+        self.indices, self.distances = indices, distances
+        self.labels = {key: np.asarray(values).astype(str) for key, values in (labels or {}).items()}
+        self.metric, self.source = metric, source
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    def query(self, rows, k=10, filters=None):
+        """
+        Nearest dialects of one row or a batch of rows.
+
+        Args:
+            rows (int or sequence): Row index/indices (as in the matrix / info arrays).
+            k (int): Number of neighbours to return (at most the stored k).
+            filters (dict, optional): Label name -> value or list of values; only neighbours with
+                                      matching labels are kept, e.g. {'areas': '西南官话'}. Filtering draws
+                                      from the stored lists, so fewer than k may be returned.
+
+        Returns:
+            dict (single row) or list of dicts: 'indices', 'distances' and the neighbours' labels.
+        """
+        _check_k(k)
+        single = np.ndim(rows) == 0
+        rows = np.atleast_1d(rows)
+        candidates, dists = self.indices[rows], self.distances[rows]
+        keep = np.ones(candidates.shape, dtype=bool)
+        for key, values in (filters or {}).items():
+            if key not in self.labels:
+                raise KeyError(f"Unknown label '{key}', available: {list(self.labels)}.")
+            keep &= np.isin(self.labels[key][candidates], np.atleast_1d(values).astype(str))
+
+        results = []
+        for i in range(len(rows)):
+            selected = candidates[i][keep[i]][:k]
+            result = {'indices': selected, 'distances': dists[i][keep[i]][:k]}
+            result.update({key: values[selected] for key, values in self.labels.items()})
+            results.append(result)
+        return results[0] if single else results
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, indices=self.indices, distances=self.distances, metric=self.metric, source=self.source,
+                 label_keys=np.array(list(self.labels), dtype=str),
+                 **{f'label_{key}': values for key, values in self.labels.items()})
+        print(f"成功将近邻索引保存到: {path}")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            labels = {key: data[f'label_{key}'] for key in data['label_keys']}
+            return cls(data['indices'], data['distances'], labels=labels, metric=str(data['metric']),
+                       source=str(data['source']))
+
+
+def neighbor_index_path(name, type, key):
+    return os.path.join(NEIGHBOR_DIRS[name], f'{type}_{key}.npz')
+
+
+def _signature(name, type):
+    return repr(source_signature(name, type))
+
+
+def build_neighbor_index(name, type, key, k=50, metric='cosine', row_block=256):
+    """
+    Compute the neighbour lists of one matrix or feature set of a dataset.
+
+    Args:
+        name (str): Dataset, e.g. 'Data4', 'Data3', 'Data2'.
+        type (str): load_feats type, e.g. 'distance_matrices', 'condensed_distance_matrices',
+                    'mfcc_dialect_mean', 'mfcc_dialect_gmm_ivector'.
+        key (str): Output key of that type, e.g. 'overall_distance' or 'features'.
+        k (int): Neighbours stored per row; keep it larger than the usual query k when filtering.
+        metric (str): Used for feature sets only ('cosine' or 'euclidean').
+
+    Returns:
+        NeighborIndex
+    """
+    data = load_feats(name=name, type=type)
+    if key not in data:
+        raise KeyError(f"'{key}' not found in {name}/{type}.")
+    values = data[key]
+    if type.endswith('distance_matrices'):
+        indices, distances = top_k_from_distances(values, k=k, row_block=row_block)
+        metric = 'precomputed'
+    else:
+        indices, distances = top_k_from_features(values, k=k, metric=metric)
+
+    labels = {}
+    if 'names' in data:
+        labels['names'] = data['names']
+    elif LABEL_KEYS.get(name):
+        info = load_feats(name=name, type='info')
+        labels = {label: info[label] for label in LABEL_KEYS[name] if label in info and len(info[label]) == len(indices)}
+    return NeighborIndex(indices, distances, labels=labels, metric=metric, source=_signature(name, type))
+
+
+def load_neighbor_index(name, type, key, path=None, rebuild=False, **kwargs):
+    """
+    Load the persisted neighbour lists, computing and saving them when missing or stale.
+    When the source matrix is not present (e.g. on a query server), the saved lists are used as they are.
+
+    Args:
+        path (str, optional): Defaults to Data<X>/neighbors/<type>_<key>.npz.
+        **kwargs: Passed to build_neighbor_index.
+
+    Returns:
+        NeighborIndex
+    """
+    path = path or neighbor_index_path(name, type, key)
+    if not rebuild and os.path.exists(path):
+        index = NeighborIndex.load(path)
+        try:
+            current = _signature(name, type)
+        except FileNotFoundError:
+            # 部署时可以只带近邻文件，不带完整矩阵
+            return index
+        if index.source == current:
+            return index
+        print(f"'{path}' 已过期，重新计算。")
+    index = build_neighbor_index(name, type, key, **kwargs)
+    index.save(path)
+    return index
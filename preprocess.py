@@ -0,0 +1,141 @@
+"""
+Missing-value filtering of the Data4 transcriptions (section 4.2 of the README).
+
+A transcription counts as missing when it is marked 'MISSING' or when its
+symbol occurs fewer than `freq_cutoff` times in the whole field. Dialects
+(rows) and words (columns) whose share of missing values exceeds
+`missing_ratio` percent in any of the initial/final/tone fields are dropped.
+
+MissingValueFilter encodes the three fields once and keeps per-row and
+per-column symbol counts, so any (missing_ratio, freq_cutoff) setting is
+evaluated from the cached counts without touching the string tables again.
+"""
+import numpy as np
+
+from distance import MISSING_CODE, DISTANCE_KEYS, encode_transcriptions, cal_distance_codes
+from load import EncodedTranscription
+
+FIELDS = ['initial', 'final', 'tone']
+# raw 中与方言 (行) 对齐的元数据 -> processed_info.pkl 中的键名
+ROW_META_KEYS = {'area': 'areas', 'slice': 'slice', 'slices': 'slices', 'coords': 'coords'}
+
+
+def _bincount_2d(codes, n_vocab, axis):
+    """Symbol counts per row (axis=1) or per column (axis=0): [n_rows or n_cols, n_vocab]."""
+    if axis == 0:
+        codes = codes.T
+    n = codes.shape[0]
+    flat = (np.arange(n, dtype=np.int64)[:, None] * n_vocab + codes).ravel()
+    return np.bincount(flat, minlength=n * n_vocab).reshape(n, n_vocab)
+
+
+class MissingValueFilter:
+    """
+    Cached missing-value statistics for the initial/final/tone tables.
+
+    Args:
+        raw (dict): load_feats(name='Data4', type='raw') output, or any dict holding 'initial',
+                    'final', 'tone' (string tables or EncodedTranscription) and optionally
+                    'word_name', 'area', 'slice', 'slices', 'coords'.
+        missing_value (str): Indicator of missing values.
+    """
+
+    def __init__(self, raw, missing_value='MISSING'):
+        self.codes, self.vocab = {}, {}
+        self.freq, self.row_counts, self.col_counts = {}, {}, {}
+        for field in FIELDS:
+            table = raw[field]
+            if isinstance(table, EncodedTranscription):
+                codes, vocab = np.asarray(table.codes), table.vocab
+            else:
+                codes, vocab = encode_transcriptions(np.asarray(table), missing_value=missing_value)
+            self.codes[field], self.vocab[field] = codes, vocab
+            # 每个符号在整个字段中的出现次数，以及按行、按列的计数
+            self.row_counts[field] = _bincount_2d(codes, len(vocab), axis=1)
+            self.col_counts[field] = _bincount_2d(codes, len(vocab), axis=0)
+            self.freq[field] = self.row_counts[field].sum(axis=0)
+
+        self.shape = self.codes[FIELDS[0]].shape
+        self.word_names = np.asarray(raw['word_name'], dtype=object) if 'word_name' in raw else None
+        self.meta = {key: np.asarray(raw[key], dtype=float if key == 'coords' else object)
+                     for key in ROW_META_KEYS if key in raw}
+        self._missing_cache = {}
+
+    def rare_symbols(self, field, freq_cutoff):
+        """Boolean mask over the field's vocabulary of codes treated as missing."""
+        rare = self.freq[field] < freq_cutoff
+        rare[MISSING_CODE] = True
+        return rare
+
+    def missing_counts(self, freq_cutoff):
+        """Per field: (missing count per row, missing count per column) for one frequency cutoff."""
+        if freq_cutoff not in self._missing_cache:
+            counts = {}
+            for field in FIELDS:
+                rare = self.rare_symbols(field, freq_cutoff).astype(np.int64)
+                counts[field] = (self.row_counts[field] @ rare, self.col_counts[field] @ rare)
+            self._missing_cache[freq_cutoff] = counts
+        return self._missing_cache[freq_cutoff]
+
+    def select(self, missing_ratio=30, freq_cutoff=1000):
+        """
+        Kept rows and columns for one setting.
+
+        Args:
+            missing_ratio (int or float): Percentage (0-100); rows/columns above it in any field are dropped.
+            freq_cutoff (int): Symbols occurring fewer times than this in a field count as missing.
+
+        Returns:
+            dict: 'missing_ratio', 'freq_cutoff', 'rows' and 'cols' (int arrays of kept indices).
+        """
+        n_rows, n_cols = self.shape
+        drop_rows = np.zeros(n_rows, dtype=bool)
+        drop_cols = np.zeros(n_cols, dtype=bool)
+        for row_missing, col_missing in self.missing_counts(freq_cutoff).values():
+            drop_rows |= row_missing / n_cols * 100 > missing_ratio
+            drop_cols |= col_missing / n_rows * 100 > missing_ratio
+        return {'missing_ratio': missing_ratio, 'freq_cutoff': freq_cutoff,
+                'rows': np.flatnonzero(~drop_rows), 'cols': np.flatnonzero(~drop_cols)}
+
+    def sweep(self, missing_ratios=(20, 30), freq_cutoffs=(500, 1000)):
+        """
+        Evaluate every (missing_ratio, freq_cutoff) combination from the cached counts.
+
+        Returns:
+            list: select() results, one per combination.
+        """
+        results = [self.select(ratio, cutoff) for cutoff in freq_cutoffs for ratio in missing_ratios]
+        for result in results:
+            print(f"缺失比例阈值 {result['missing_ratio']}%, 频次下限 {result['freq_cutoff']}: "
+                  f"保留 {len(result['rows'])} 行, {len(result['cols'])} 列。")
+        return results
+
+    def processed_codes(self, selection):
+        """Code matrices restricted to the kept rows/columns, with rare symbols set to MISSING_CODE."""
+        rows, cols = selection['rows'], selection['cols']
+        processed = {}
+        for field in FIELDS:
+            sub = self.codes[field][np.ix_(rows, cols)]
+            rare = self.rare_symbols(field, selection['freq_cutoff'])
+            processed[field] = np.where(rare[sub], MISSING_CODE, sub).astype(sub.dtype)
+        return processed
+
+    def processed_info(self, selection):
+        """Metadata aligned with the kept rows/columns, keyed like processed_info.pkl."""
+        info = {out_key: self.meta[key][selection['rows']] for key, out_key in ROW_META_KEYS.items() if key in self.meta}
+        if self.word_names is not None:
+            info['word_names'] = self.word_names[selection['cols']]
+        return info
+
+    def distance_matrices(self, selection, block_size=64, n_jobs=None):
+        """
+        Feed the processed tables straight into the distance engine.
+
+        Returns:
+            dict: {'initials', 'finals', 'tones', 'overall'} as in distance_matrices.npz.
+        """
+        processed = self.processed_codes(selection)
+        matrices = {key: cal_distance_codes(processed[field], block_size=block_size, n_jobs=n_jobs)
+                    for field, key in zip(FIELDS, DISTANCE_KEYS)}
+        matrices['overall'] = (matrices['initials'] + matrices['finals'] + matrices['tones']) / 3
+        return matrices
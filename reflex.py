@@ -0,0 +1,369 @@
+"""
+Middle Chinese reflex index: how each Data1 category surfaces in each dialect.
+
+The Data4 word columns ('0001多', ...) are mapped to Data1 characters. For
+every Middle Chinese field (initial, final_1..3, tone) a dense cube
+[n_dialects, n_categories, n_reflexes] counts, per dialect, how often a
+category is realized by each symbol of the corresponding Data4 field
+(initial, final, tone). Cubes are filled with one np.bincount per block of
+dialects; per-cell summaries (total, dominant reflex and its count, entropy)
+are kept next to them, so regularity and merger queries never touch the
+cubes.
+
+The index is persisted under Data4/reflex_index/ together with the code
+matrices and column categories it was built from. ReflexIndex.update()
+compares both with new data and only recounts the changed dialects (rows)
+and the words (columns) whose Data1 category changed.
+"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+from distance import MISSING_CODE, encode_transcriptions
+from load import load_feats, BASE_DATA4_DIR
+
+REFLEX_INDEX_DIR = os.path.join(BASE_DATA4_DIR, 'reflex_index')
+REFLEX_META_FILE = 'meta.pkl'
+# 中古音字段 -> 对应的 Data4 转写字段
+MC_FIELDS = {'initial': 'initial', 'final_1': 'final', 'final_2': 'final', 'final_3': 'final', 'tone': 'tone'}
+DIALECT_FIELDS = ['initial', 'final', 'tone']
+NO_CATEGORY = -1 # 没有对应 Data1 汉字或类别缺失的列
+
+
+def word_characters(word_names):
+    """'0001多' -> '多': strip the numbering of Data4 word names."""
+    return [str(name).lstrip('0123456789') for name in word_names]
+
+
+def column_categories(word_names, data1_info):
+    """
+    Data1 category index of every Data4 word column for each MC field.
+
+    Returns:
+        tuple: (column_cats, categories)
+            column_cats (dict): MC field -> int array [n_words], NO_CATEGORY where unmapped.
+            categories (dict): MC field -> array of the Data1 category values (cube axis 1).
+    """
+    row_of = {char: i for i, char in enumerate(data1_info['word'])}
+    rows = np.array([row_of.get(char, -1) for char in word_characters(word_names)])
+    mapped = rows >= 0
+    column_cats, categories = {}, {}
+    for field in MC_FIELDS:
+        values = np.asarray(data1_info[field], dtype=float)
+        categories[field], inverse = np.unique(values[~np.isnan(values)], return_inverse=True)
+        cat_of_row = np.full(len(values), NO_CATEGORY)
+        cat_of_row[~np.isnan(values)] = inverse.ravel()
+        cats = np.full(len(rows), NO_CATEGORY)
+        cats[mapped] = cat_of_row[rows[mapped]]
+        column_cats[field] = cats
+    return column_cats, categories
+
+
+def _count_block(codes, cats, n_categories, n_vocab):
+    """Contingency counts [n_rows, n_categories, n_vocab] of a row block over the categorized columns."""
+    columns = np.flatnonzero(cats != NO_CATEGORY)
+    block = codes[:, columns].astype(np.int64)
+    rows = np.broadcast_to(np.arange(len(codes))[:, None], block.shape)
+    valid = block != MISSING_CODE
+    flat = (rows[valid] * n_categories + cats[columns][None, :].repeat(len(codes), 0)[valid]) * n_vocab + block[valid]
+    return np.bincount(flat, minlength=len(codes) * n_categories * n_vocab).reshape(len(codes), n_categories, n_vocab)
+
+
+def _summaries(cube):
+    """Per cell: total count, dominant reflex code, its count and the reflex entropy in bits."""
+    cube = np.asarray(cube)
+    totals = cube.sum(axis=2, dtype=np.int64)
+    dominant = cube.argmax(axis=2)
+    dominant_counts = np.take_along_axis(cube, dominant[..., None], axis=2)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = cube / totals[..., None]
+        entropy = -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=2)
+    entropy[totals == 0] = np.nan
+    return {'totals': totals, 'dominant': dominant, 'dominant_counts': dominant_counts.astype(np.int64),
+            'entropy': entropy}
+
+
+class ReflexIndex:
+    """
+    Contingency cubes dialect x MC category x dialect reflex.
+
+    Build with ReflexIndex.build or load_reflex_index; the attributes are
+        codes (dict): Data4 field -> code matrix [n_dialects, n_words] the cubes were counted from.
+        vocab (dict): Data4 field -> reflex symbols (cube axis 2).
+        column_cats, categories: see column_categories.
+        cubes (dict): MC field -> uint16 array [n_dialects, n_categories, n_vocab].
+        summaries (dict): MC field -> _summaries of its cube.
+    """
+
+    def __init__(self, codes, vocab, word_names, column_cats, categories, cubes=None, summaries=None):
+        self.codes, self.vocab = codes, vocab
+        self.word_names = list(word_names)
+        self.column_cats, self.categories = column_cats, categories
+        self.cubes = cubes if cubes is not None else {}
+        self.summaries = summaries if summaries is not None else {}
+
+    @property
+    def n_dialects(self):
+        return self.codes[DIALECT_FIELDS[0]].shape[0]
+
+    @staticmethod
+    def _encode(transcriptions, vocab=None):
+        codes, vocabs = {}, {}
+        for field in DIALECT_FIELDS:
+            # EncodedTranscription 通过 __array__ 解码，重新编码后与已有词表保持一致
+            codes[field], vocabs[field] = encode_transcriptions(np.asarray(transcriptions[field]),
+                                                                vocab=None if vocab is None else vocab[field])
+        return codes, vocabs
+
+    @classmethod
+    def build(cls, transcriptions, word_names, data1_info=None, row_block=64):
+        """
+        Count all cubes.
+
+        Args:
+            transcriptions (dict): 'initial', 'final', 'tone' tables [n_dialects, n_words]
+                                   (strings or EncodedTranscription), e.g. the processed Data4 tables.
+            word_names (sequence): Data4 word names of the columns, e.g. processed_info['word_names'].
+            data1_info (dict, optional): load_feats(name='Data1', type='info'); loaded when omitted.
+            row_block (int): Dialects counted per np.bincount call.
+        """
+        data1_info = data1_info or load_feats(name='Data1', type='info')
+        codes, vocab = cls._encode(transcriptions)
+        column_cats, categories = column_categories(word_names, data1_info)
+        index = cls(codes, vocab, word_names, column_cats, categories)
+        print(f"{(column_cats['initial'] != NO_CATEGORY).sum()}/{len(word_names)} 个词在 Data1 中找到对应汉字。")
+        for field in MC_FIELDS:
+            index._recount(field, np.arange(index.n_dialects), row_block)
+        return index
+
+    def _ensure_cube(self, field):
+        """
+        Allocate or grow the cube of an MC field to the current dialects and vocabulary.
+        Returns False when it had to be created from scratch (all rows need counting).
+        """
+        shape = (self.n_dialects, len(self.categories[field]), len(self.vocab[MC_FIELDS[field]]))
+        cube = self.cubes.get(field)
+        if cube is None or cube.shape[1] != shape[1]:
+            self.cubes[field] = np.zeros(shape, dtype=np.uint16)
+            return False
+        if cube.shape != shape:
+            # 新方言追加在末尾、新符号追加在词表末尾，已有计数原样保留
+            grown = np.zeros(shape, dtype=np.uint16)
+            grown[:cube.shape[0], :, :cube.shape[2]] = cube
+            self.cubes[field] = grown
+        elif not cube.flags.writeable:
+            self.cubes[field] = np.array(cube)
+        return True
+
+    def _recount(self, field, rows, row_block=64):
+        """Recount the cube rows `rows` of one MC field from the codes and refresh its summaries."""
+        if not self._ensure_cube(field):
+            rows = np.arange(self.n_dialects)
+        codes, cube = self.codes[MC_FIELDS[field]], self.cubes[field]
+        for start in range(0, len(rows), row_block):
+            block = rows[start:start + row_block]
+            cube[block] = _count_block(codes[block], self.column_cats[field], cube.shape[1], cube.shape[2])
+        self._refresh_summaries(field, rows)
+
+    def _refresh_summaries(self, field, rows):
+        current = self.summaries.get(field)
+        if current is None or len(rows) == self.n_dialects or current['totals'].shape != self.cubes[field].shape[:2]:
+            self.summaries[field] = _summaries(self.cubes[field])
+        elif len(rows):
+            for key, values in _summaries(self.cubes[field][rows]).items():
+                current[key][rows] = values
+
+    def update(self, transcriptions=None, word_names=None, data1_info=None, row_block=64):
+        """
+        Bring the index up to date after Data4 and/or Data1 changed.
+
+        Dialect rows whose codes differ (and appended rows) are recounted; when Data1
+        categories change, only the affected word columns are moved between categories.
+        A different word list triggers a full rebuild, which needs the transcriptions.
+
+        Returns:
+            dict: Numbers of recounted 'rows' and re-categorized 'columns'.
+        """
+        if word_names is not None and list(word_names) != self.word_names:
+            if transcriptions is None:
+                raise ValueError("The word list changed; pass the matching transcriptions to rebuild the index.")
+            print("词表发生变化，重新构建反映索引。")
+            rebuilt = ReflexIndex.build(transcriptions, word_names, data1_info, row_block=row_block)
+            self.__dict__.update(rebuilt.__dict__)
+            return {'rows': self.n_dialects, 'columns': len(self.word_names)}
+
+        changed_rows = np.zeros(0, dtype=np.int64)
+        if transcriptions is not None:
+            codes, vocab = self._encode(transcriptions, self.vocab)
+            n_old = self.n_dialects
+            if len(codes[DIALECT_FIELDS[0]]) < n_old:
+                raise ValueError("Removing dialects is not supported; rebuild the index instead.")
+            changed = np.zeros(len(codes[DIALECT_FIELDS[0]]), dtype=bool)
+            for field in DIALECT_FIELDS:
+                shared = min(n_old, len(codes[field]))
+                changed[:shared] |= (codes[field][:shared] != self.codes[field][:shared]).any(axis=1)
+                changed[shared:] = True
+            self.codes, self.vocab = codes, vocab
+            changed_rows = np.flatnonzero(changed)
+
+        changed_columns = {field: np.zeros(0, dtype=np.int64) for field in MC_FIELDS}
+        if data1_info is not None:
+            column_cats, categories = column_categories(self.word_names, data1_info)
+            for field in MC_FIELDS:
+                if not np.array_equal(categories[field], self.categories[field]):
+                    # 类别集合改变时坐标轴本身变化，整个字段重新计数
+                    self.column_cats[field], self.categories[field] = column_cats[field], categories[field]
+                    self.cubes.pop(field, None)
+                else:
+                    changed_columns[field] = np.flatnonzero(column_cats[field] != self.column_cats[field])
+
+        for field in MC_FIELDS:
+            columns = changed_columns[field]
+            if len(columns):
+                # 已改变的方言行随后会整行重新计数，这里的增量对它们不必精确
+                self._move_columns(field, columns, column_cats[field], row_block)
+            self._recount(field, changed_rows, row_block)
+            if len(columns):
+                self._refresh_summaries(field, np.arange(self.n_dialects))
+        n_columns = len(np.unique(np.concatenate(list(changed_columns.values()))))
+        print(f"重新计数 {len(changed_rows)} 个方言点, 重新归类 {n_columns} 个词。")
+        return {'rows': len(changed_rows), 'columns': n_columns}
+
+    def _move_columns(self, field, columns, new_cats, row_block):
+        """Subtract the counts of `columns` under their old categories and add them under the new ones."""
+        if not self._ensure_cube(field):
+            self.column_cats[field] = new_cats
+            return
+        codes, cube = self.codes[MC_FIELDS[field]], self.cubes[field]
+        old = np.full(len(new_cats), NO_CATEGORY)
+        new = np.full(len(new_cats), NO_CATEGORY)
+        old[columns], new[columns] = self.column_cats[field][columns], new_cats[columns]
+        for start in range(0, self.n_dialects, row_block):
+            rows = slice(start, start + row_block)
+            delta = (_count_block(codes[rows], new, cube.shape[1], cube.shape[2])
+                     - _count_block(codes[rows], old, cube.shape[1], cube.shape[2]))
+            cube[rows] = (cube[rows].astype(np.int64) + delta).astype(np.uint16)
+        self.column_cats[field] = new_cats
+
+    # --- 查询 ---
+    def table(self, dialect, field='initial'):
+        """
+        Correspondence table of one dialect: MC categories (rows) x attested reflexes (columns).
+
+        Returns:
+            pandas.DataFrame: Counts, only non-empty rows and columns.
+        """
+        counts = np.asarray(self.cubes[field][dialect])
+        rows, cols = np.flatnonzero(counts.any(axis=1)), np.flatnonzero(counts.any(axis=0))
+        return pd.DataFrame(counts[np.ix_(rows, cols)], index=self.categories[field][rows],
+                            columns=self.vocab[MC_FIELDS[field]][cols])
+
+    def regularity(self, field='initial', per_category=False):
+        """
+        Share of the dominant reflex.
+
+        Returns:
+            np.ndarray: [n_dialects] count-weighted over categories, or [n_dialects, n_categories]
+                        (NaN for unattested categories) with per_category=True.
+        """
+        summary = self.summaries[field]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if per_category:
+                return summary['dominant_counts'] / summary['totals']
+            return summary['dominant_counts'].sum(axis=1) / summary['totals'].sum(axis=1)
+
+    def entropy(self, field='initial', per_category=False):
+        """
+        Reflex entropy in bits: [n_dialects] conditional entropy H(reflex | category),
+        or [n_dialects, n_categories] with per_category=True.
+        """
+        summary = self.summaries[field]
+        if per_category:
+            return summary['entropy']
+        totals = summary['totals']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nansum(summary['entropy'] * totals, axis=1) / totals.sum(axis=1)
+
+    def category_index(self, field, category):
+        """Cube axis-1 position of a Data1 category value of an MC field."""
+        matches = np.flatnonzero(self.categories[field] == category)
+        if not len(matches):
+            raise ValueError(f"Unknown {field} category {category!r}, available: {list(self.categories[field])}.")
+        return int(matches[0])
+
+    def merged(self, field, category_a, category_b, min_share=0.5):
+        """
+        Bool [n_dialects]: both categories are attested and share the same dominant reflex,
+        each with at least `min_share` of its tokens.
+        """
+        a, b = self.category_index(field, category_a), self.category_index(field, category_b)
+        summary = self.summaries[field]
+        share = self.regularity(field, per_category=True)
+        attested = (summary['totals'][:, a] > 0) & (summary['totals'][:, b] > 0)
+        with np.errstate(invalid='ignore'):
+            strong = (share[:, a] >= min_share) & (share[:, b] >= min_share)
+        return attested & strong & (summary['dominant'][:, a] == summary['dominant'][:, b])
+
+    def mergers(self, dialect, field='initial', min_share=0.5):
+        """
+        MC categories that one dialect merges: dominant reflex -> list of categories (only groups of 2+).
+        """
+        summary = self.summaries[field]
+        share = self.regularity(field, per_category=True)[dialect]
+        with np.errstate(invalid='ignore'):
+            eligible = np.flatnonzero((summary['totals'][dialect] > 0) & (share >= min_share))
+        groups = {}
+        for cat in eligible:
+            groups.setdefault(self.vocab[MC_FIELDS[field]][summary['dominant'][dialect, cat]], []).append(
+                self.categories[field][cat])
+        return {reflex: cats for reflex, cats in groups.items() if len(cats) > 1}
+
+    # --- 持久化 ---
+    def save(self, path=REFLEX_INDEX_DIR):
+        os.makedirs(path, exist_ok=True)
+        for field in MC_FIELDS:
+            np.save(os.path.join(path, f'cube_{field}.npy'), self.cubes[field])
+        for field in DIALECT_FIELDS:
+            np.save(os.path.join(path, f'codes_{field}.npy'), self.codes[field])
+        meta = {'vocab': self.vocab, 'word_names': self.word_names, 'column_cats': self.column_cats,
+                'categories': self.categories, 'summaries': self.summaries}
+        with open(os.path.join(path, REFLEX_META_FILE), 'wb') as f:
+            pickle.dump(meta, f)
+        print(f"成功将反映索引保存到: {path}")
+
+    @classmethod
+    def load(cls, path=REFLEX_INDEX_DIR):
+        """Open a saved index; cubes are memory-mapped read-only until an update needs them in memory."""
+        with open(os.path.join(path, REFLEX_META_FILE), 'rb') as f:
+            meta = pickle.load(f)
+        cubes = {field: np.load(os.path.join(path, f'cube_{field}.npy'), mmap_mode='r') for field in MC_FIELDS}
+        codes = {field: np.load(os.path.join(path, f'codes_{field}.npy')) for field in DIALECT_FIELDS}
+        return cls(codes, meta['vocab'], meta['word_names'], meta['column_cats'], meta['categories'],
+                   cubes=cubes, summaries=meta['summaries'])
+
+
+def load_reflex_index(transcriptions=None, word_names=None, data1_info=None, path=REFLEX_INDEX_DIR):
+    """
+    Open the persisted index, building it when missing and updating it when data is given.
+
+    Args:
+        transcriptions, word_names: Current Data4 tables and word names (see ReflexIndex.build).
+        data1_info (dict, optional): Current Data1 info.
+        path (str): Index directory.
+
+    Returns:
+        ReflexIndex
+    """
+    if not os.path.exists(os.path.join(path, REFLEX_META_FILE)):
+        if transcriptions is None or word_names is None:
+            raise ValueError(f"No reflex index at '{path}'; pass transcriptions and word_names to build it.")
+        index = ReflexIndex.build(transcriptions, word_names, data1_info)
+        index.save(path)
+        return index
+    index = ReflexIndex.load(path)
+    if transcriptions is not None or data1_info is not None:
+        changes = index.update(transcriptions, word_names, data1_info)
+        if changes['rows'] or changes['columns']:
+            index.save(path)
+    return index
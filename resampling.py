@@ -0,0 +1,198 @@
+"""
+Bootstrap / jackknife confidence for the Data4 distance matrices.
+
+A replicate resamples the words (columns) with weights w, so its distance is
+
+    d_w(i, j) = sum_k w_k * differs_ijk / sum_k w_k * valid_ijk.
+
+For a block of dialect pairs the per-word indicators differs_ijk / valid_ijk
+are computed once, and all replicates are obtained together as two matrix
+products with the weight matrix W [n_words, n_replicates]. Every pair thus
+sees all of its replicates at once: means, variances and percentiles are
+exact and no replicate matrix is ever stored. Row blocks are spread over a
+process pool.
+
+Optional cluster support recombines replicates in small batches into full
+matrices, clusters each one and counts how often every clade of the
+reference tree reappears.
+"""
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import squareform
+
+from distance import MISSING_CODE, DISTANCE_KEYS, as_codes, cal_distance_codes
+
+_WORKER = {} # 工作进程中的编码矩阵和权重，由 initializer 设置一次
+
+
+def replicate_weights(n_words, n_replicates=1000, method='bootstrap', seed=0):
+    """
+    Word weights [n_words, n_replicates].
+
+    'bootstrap' draws words with replacement (multinomial counts); 'jackknife'
+    leaves out one word per replicate (n_replicates is then n_words).
+    """
+    if method == 'bootstrap':
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(n_words, np.full(n_words, 1 / n_words), size=n_replicates)
+        return counts.T.astype(np.float32)
+    if method == 'jackknife':
+        return (1 - np.eye(n_words)).astype(np.float32)
+    raise ValueError(f"Unknown method '{method}', use 'bootstrap' or 'jackknife'.")
+
+
+def _init_worker(codes, weights):
+    _WORKER['codes'] = codes
+    # 计数和比值都在 float64 中计算，单位权重时与 cal_distance 逐位一致
+    _WORKER['weights'] = np.asarray(weights, dtype=np.float64)
+
+
+def _replicate_distances(codes, weights, r0, r1, c0):
+    """Replicate distances [r1 - r0, n - c0, B] for rows [r0, r1) against columns [c0, n)."""
+    rows, cols = codes[r0:r1], codes[c0:]
+    valid = (rows[:, None, :] != MISSING_CODE) & (cols[None, :, :] != MISSING_CODE)
+    differs = valid & (rows[:, None, :] != cols[None, :, :])
+    shape = valid.shape[:2]
+    n_valid = valid.reshape(-1, valid.shape[2]).astype(np.float64) @ weights
+    n_diff = differs.reshape(-1, differs.shape[2]).astype(np.float64) @ weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = n_diff / n_valid
+    dist[n_valid == 0] = np.nan
+    return dist.reshape(*shape, weights.shape[1])
+
+
+def _block_distances(r0, r1, c0):
+    """Replicate distances of every field (plus 'overall') for one block."""
+    dists = {key: _replicate_distances(codes, _WORKER['weights'], r0, r1, c0)
+             for key, codes in _WORKER['codes'].items()}
+    if all(key in dists for key in DISTANCE_KEYS):
+        dists['overall'] = (dists['initials'] + dists['finals'] + dists['tones']) / 3
+    return dists
+
+
+def _block_stats(r0, r1, percentiles, jackknife):
+    stats = {}
+    for key, dist in _block_distances(r0, r1, r0).items():
+        with warnings.catch_warnings():
+            # 没有可比较特征的方言对在所有重抽样中都是 NaN，结果保持 NaN 即可
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(dist, axis=2)
+            if jackknife:
+                # 留一法方差: (m - 1) / m * sum (theta_i - theta_bar)^2
+                var = np.nanvar(dist, axis=2) * (dist.shape[2] - 1)
+            else:
+                var = np.nanvar(dist, axis=2, ddof=1)
+            pct = np.nanpercentile(dist, percentiles, axis=2) if percentiles else None
+        stats[key] = (mean, var, pct)
+    return r0, r1, stats
+
+
+def _block_batch(r0, r1, batch):
+    weights = _WORKER['weights']
+    _WORKER['weights'] = weights[:, batch]
+    try:
+        return r0, r1, _block_distances(r0, r1, r0)
+    finally:
+        _WORKER['weights'] = weights
+
+
+def _clade_keys(Z, leaf_hashes):
+    """Order-independent hash of the leaf set under every internal node of a linkage."""
+    n = len(leaf_hashes)
+    node_hashes = np.empty(2 * n - 1, dtype=np.uint64)
+    node_hashes[:n] = leaf_hashes
+    left, right = Z[:, 0].astype(np.int64), Z[:, 1].astype(np.int64)
+    with np.errstate(over='ignore'):
+        for k in range(n - 1):
+            node_hashes[n + k] = node_hashes[left[k]] + node_hashes[right[k]]
+    return node_hashes[n:]
+
+
+def _linkage(dist_matrix, method):
+    dist_matrix = np.where(np.isnan(dist_matrix), np.nanmax(dist_matrix), dist_matrix)
+    np.fill_diagonal(dist_matrix, 0.0)
+    return linkage(squareform(dist_matrix, checks=False), method=method)
+
+
+def resample_distances(fields, n_replicates=1000, method='bootstrap', percentiles=(2.5, 97.5), seed=0,
+                       n_workers=None, row_block=8, cluster_support=False, support_key='overall',
+                       linkage_method='average', replicate_batch=32):
+    """
+    Resampling statistics of the distance matrices.
+
+    Args:
+        fields (dict): Field name -> transcription table, EncodedTranscription or code matrix, all with
+                       the same words. Use 'initials', 'finals', 'tones' to also get 'overall'.
+        n_replicates (int): Number of bootstrap replicates (ignored for 'jackknife').
+        method (str): 'bootstrap' or 'jackknife'.
+        percentiles (sequence): Percentiles (0-100) to report, e.g. (2.5, 97.5) for a 95% interval.
+        seed (int): Seed of the bootstrap weights.
+        n_workers (int, optional): Number of worker processes.
+        row_block (int): Dialects per task; memory per task grows with row_block * n * (n_words + n_replicates).
+        cluster_support (bool): Also compute clade support of the reference tree of `support_key`.
+        linkage_method (str): scipy linkage method used for the trees.
+        replicate_batch (int): Replicates recombined into full matrices at a time for cluster support.
+
+    Returns:
+        dict: Field name -> {'mean', 'var', 'percentiles' (dict p -> matrix)}. With cluster_support,
+              also 'linkage' (reference tree on the full data) and 'support' (fraction of replicates
+              containing the clade formed at each linkage row).
+    """
+    codes = {key: as_codes(table) for key, table in fields.items()}
+    n_dialects, n_words = next(iter(codes.values())).shape
+    weights = replicate_weights(n_words, n_replicates, method=method, seed=seed)
+    jackknife = method == 'jackknife'
+    percentiles = list(percentiles or [])
+    keys = list(codes) + (['overall'] if all(key in codes for key in DISTANCE_KEYS) else [])
+    print(f"Resampling {n_words} words for {n_dialects} dialects: {weights.shape[1]} {method} replicates...")
+
+    results = {key: {'mean': np.zeros((n_dialects, n_dialects)), 'var': np.zeros((n_dialects, n_dialects)),
+                     'percentiles': {p: np.zeros((n_dialects, n_dialects)) for p in percentiles}}
+               for key in keys}
+    blocks = [(r0, min(r0 + row_block, n_dialects)) for r0 in range(0, n_dialects, row_block)]
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(codes, weights)) as executor:
+        futures = [executor.submit(_block_stats, r0, r1, percentiles, jackknife) for r0, r1 in blocks]
+        for future in futures:
+            r0, r1, stats = future.result()
+            for key, (mean, var, pct) in stats.items():
+                targets = [(results[key]['mean'], mean), (results[key]['var'], var)]
+                targets += [(results[key]['percentiles'][p], pct[i]) for i, p in enumerate(percentiles)]
+                for matrix, block in targets:
+                    matrix[r0:r1, r0:] = block
+                    matrix[r0:, r0:r1] = block.T
+        for key in keys:
+            for matrix in [results[key]['mean'], results[key]['var']] + list(results[key]['percentiles'].values()):
+                np.fill_diagonal(matrix, 0.0)
+
+        if cluster_support:
+            results[support_key].update(_cluster_support(executor, codes, weights, blocks, n_dialects,
+                                                         support_key, linkage_method, replicate_batch, seed))
+    print("Resampling finished.")
+    return results
+
+
+def _cluster_support(executor, codes, weights, blocks, n_dialects, support_key, linkage_method, batch_size, seed):
+    full = {key: cal_distance_codes(c) for key, c in codes.items()}
+    if support_key == 'overall':
+        full['overall'] = (full['initials'] + full['finals'] + full['tones']) / 3
+    reference = _linkage(full[support_key], linkage_method)
+    leaf_hashes = np.random.default_rng(seed).integers(0, 2 ** 63, size=n_dialects, dtype=np.uint64)
+    reference_keys = _clade_keys(reference, leaf_hashes)
+    counts = np.zeros(n_dialects - 1)
+
+    n_replicates = weights.shape[1]
+    for start in range(0, n_replicates, batch_size):
+        batch = np.arange(start, min(start + batch_size, n_replicates))
+        dist = np.zeros((n_dialects, n_dialects, len(batch)))
+        for future in [executor.submit(_block_batch, r0, r1, batch) for r0, r1 in blocks]:
+            r0, r1, block = future.result()
+            dist[r0:r1, r0:] = block[support_key]
+            dist[r0:, r0:r1] = block[support_key].transpose(1, 0, 2)
+        for b in range(len(batch)):
+            replicate_keys = _clade_keys(_linkage(dist[:, :, b], linkage_method), leaf_hashes)
+            counts += np.isin(reference_keys, replicate_keys)
+        print(f"  Clustered {batch[-1] + 1}/{n_replicates} replicates...")
+    return {'linkage': reference, 'support': counts / n_replicates}
@@ -0,0 +1,124 @@
+"""
+On-disk storage formats for the processed datasets.
+
+Raw Data4 transcriptions are stored dictionary-encoded: one uint16 code matrix
+per field (<field>.npy, opened with mmap_mode='r' by load_feats), a small
+vocabulary table (vocab.npz, code 0 = 'MISSING') and the remaining metadata
+(meta.pkl).
+
+Distance matrices can be stored condensed: only the upper triangle, as an
+uncompressed float32 <key>.npy per matrix, opened as CondensedDistanceMatrix.
+"""
+import os
+import pickle
+import numpy as np
+
+from load import (data4_raw_data_path, data4_raw_codes_dir, ENCODED_VOCAB_FILE, ENCODED_META_FILE,
+                  EncodedTranscription, data4_distance_matrix_path, data4_condensed_distance_dir,
+                  CondensedDistanceMatrix)
+from distance import encode_transcriptions
+
+TRANSCRIPTION_KEYS = ['initial', 'final', 'tone']
+
+
+def save_encoded_raw(data_dict, output_dir=data4_raw_codes_dir, missing_value='MISSING'):
+    """
+    Write a Data4 raw dictionary (as stored in transcription_areas.pkl) in the encoded format.
+
+    Args:
+        data_dict (dict): Must contain 'initial', 'final', 'tone' as 2D string arrays;
+                          every other key is kept as metadata.
+        output_dir (str): Target directory.
+        missing_value (str): Marker mapped to the reserved code 0.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    vocabs = {}
+    for key in TRANSCRIPTION_KEYS:
+        codes, vocab = encode_transcriptions(np.asarray(data_dict[key]), missing_value=missing_value)
+        if codes.dtype != np.uint16:
+            raise ValueError(f"Field '{key}' has {len(vocab)} symbols, too many for uint16 codes.")
+        np.save(os.path.join(output_dir, f'{key}.npy'), codes)
+        vocabs[key] = vocab.astype(str)
+        print(f"'{key}': {codes.shape}, {len(vocab)} 个符号")
+
+    np.savez(os.path.join(output_dir, ENCODED_VOCAB_FILE), **vocabs)
+    meta = {key: value for key, value in data_dict.items() if key not in TRANSCRIPTION_KEYS}
+    with open(os.path.join(output_dir, ENCODED_META_FILE), 'wb') as f:
+        pickle.dump(meta, f)
+    print(f"成功将编码后的转写保存到: {output_dir}")
+
+
+def convert_raw_pickle(input_path=data4_raw_data_path, output_dir=data4_raw_codes_dir, missing_value='MISSING'):
+    """
+    Convert Data4/transcription_areas.pkl to the encoded, memory-mappable format.
+
+    After conversion load_feats(name='Data4', type='raw', encoded=True) reads the transcriptions from
+    output_dir as EncodedTranscription objects instead of unpickling the string arrays.
+    """
+    with open(input_path, 'rb') as f:
+        data_dict = pickle.load(f)
+    save_encoded_raw(data_dict, output_dir=output_dir, missing_value=missing_value)
+
+
+def open_encoded_raw(input_dir=data4_raw_codes_dir):
+    """
+    Open the encoded transcriptions without going through load_feats.
+
+    Returns:
+        dict: Field name -> EncodedTranscription backed by a read-only memory map.
+    """
+    with np.load(os.path.join(input_dir, ENCODED_VOCAB_FILE)) as vocab_npz:
+        return {key: EncodedTranscription(np.load(os.path.join(input_dir, f'{key}.npy'), mmap_mode='r'),
+                                          vocab_npz[key])
+                for key in TRANSCRIPTION_KEYS}
+
+
+def save_condensed_matrix(matrix, output_path, dtype=np.float32):
+    """
+    Write the upper triangle of a symmetric distance matrix as a flat .npy file.
+
+    Rows are copied one at a time into a memory-mapped output, so the input may
+    itself be a memory map larger than RAM.
+    """
+    n = matrix.shape[0]
+    if matrix.ndim != 2 or matrix.shape[1] != n:
+        raise ValueError("Input 'matrix' must be a square 2D array.")
+    out = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=(n * (n - 1) // 2,))
+    start = 0
+    for i in range(n - 1):
+        out[start:start + n - i - 1] = matrix[i, i + 1:]
+        start += n - i - 1
+    out.flush()
+    del out
+
+
+def save_condensed_matrices(matrices, output_dir=data4_condensed_distance_dir, dtype=np.float32):
+    """
+    Save a dict of distance matrices (keys as in distance_matrices.npz) in the condensed format
+    read by load_feats(type='condensed_distance_matrices').
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for key, matrix in matrices.items():
+        save_condensed_matrix(matrix, os.path.join(output_dir, f'{key}.npy'), dtype=dtype)
+    print(f"成功将压缩距离矩阵保存到: {output_dir}")
+
+
+def convert_distance_npz(input_path=data4_distance_matrix_path, output_dir=data4_condensed_distance_dir,
+                         dtype=np.float32):
+    """Convert a distance_matrices.npz file to the condensed format."""
+    os.makedirs(output_dir, exist_ok=True)
+    with np.load(input_path) as loaded_npz:
+        for key in loaded_npz.files:
+            save_condensed_matrix(loaded_npz[key], os.path.join(output_dir, f'{key}.npy'), dtype=dtype)
+    print(f"成功将压缩距离矩阵保存到: {output_dir}")
+
+
+def open_condensed(input_dir=data4_condensed_distance_dir):
+    """
+    Open every condensed matrix in a directory without going through load_feats.
+
+    Returns:
+        dict: Key -> CondensedDistanceMatrix backed by a read-only memory map.
+    """
+    return {name[:-len('.npy')]: CondensedDistanceMatrix(np.load(os.path.join(input_dir, name), mmap_mode='r'))
+            for name in sorted(os.listdir(input_dir)) if name.endswith('.npy')}
@@ -0,0 +1,49 @@
+import warnings
+
+import numpy as np
+import pytest
+from scipy.spatial.distance import pdist, squareform
+
+from cluster import classify, heat_labels, silhouettes
+
+
+def random_distances(n=30, seed=0):
+    points = np.random.default_rng(seed).normal(size=(n, 3))
+    return squareform(pdist(points))
+
+
+def test_silhouettes_match_sklearn():
+    metrics = pytest.importorskip('sklearn.metrics')
+    dist = random_distances()
+    labels = np.random.default_rng(1).integers(1, 4, len(dist))
+    np.testing.assert_allclose(silhouettes(dist, labels),
+                               metrics.silhouette_samples(dist, labels, metric='precomputed'))
+
+
+def test_zero_distance_duplicates_are_transitional():
+    dist = np.zeros((4, 4))
+    labels = np.array([1, 1, 2, 2])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        s = silhouettes(dist, labels)
+    np.testing.assert_array_equal(s, 0.0)
+    assert list(heat_labels(dist, labels)) == ['Z'] * 4
+
+
+def test_singletons_and_skipped_labels():
+    dist = random_distances(6)
+    s = silhouettes(dist, np.array([1, 1, 1, 3, 3, 4]))
+    assert s[5] == 0.0
+    assert np.isfinite(s).all()
+
+
+def test_fewer_than_two_clusters_rejected():
+    dist = random_distances(10)
+    with pytest.raises(ValueError):
+        silhouettes(dist, np.ones(10, dtype=int))
+    with pytest.raises(ValueError):
+        classify(dist, ks=[1, 2, 3])
+    result = classify(dist, ks=[2, 3, 50])
+    assert sorted(result['sharp']) == [2, 3]
+    for k, heat in result['heat'].items():
+        assert all(label == 'Z' or label.startswith('Cluster ') for label in heat)
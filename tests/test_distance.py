@@ -0,0 +1,187 @@
+import os
+import pickle
+import numpy as np
+import pytest
+
+from distance import (MISSING_CODE, cal_distance, cal_distance_codes, encode_transcriptions, cal_distance_tiled,
+                      update_distance_matrices, update_distance_files, symbol_costs, cal_graded_distance)
+from load import TILE_PROGRESS_FILE, _use_npy_dir
+
+
+def cal_distance_loop(features, missing_value='MISSING'):
+    """The loop version from code.ipynb, kept as the reference implementation."""
+    n_dialects, n_features = features.shape
+    dist_matrix = np.full((n_dialects, n_dialects), np.nan, dtype=float)
+    is_valid = (features != missing_value)
+    for i in range(n_dialects):
+        dist_matrix[i, i] = 0.0
+        features_i = features[i]
+        is_valid_i = is_valid[i]
+        for j in range(i + 1, n_dialects):
+            valid_comparison_mask = is_valid_i & is_valid[j]
+            num_valid_features = np.sum(valid_comparison_mask)
+            if num_valid_features == 0:
+                dist_matrix[j, i] = np.nan
+                continue
+            num_differences = np.sum((features_i != features[j]) & valid_comparison_mask)
+            distance = num_differences / num_valid_features
+            dist_matrix[i, j] = distance
+            dist_matrix[j, i] = distance
+    return dist_matrix
+
+
+def synthetic_features(n_dialects, n_features, missing_rate=0.3, n_symbols=30, seed=0):
+    """Random transcription table with 'MISSING' cells; row 3 is missing everywhere."""
+    rng = np.random.default_rng(seed)
+    symbols = np.array([f's{i}' for i in range(n_symbols)], dtype=object)
+    features = symbols[rng.integers(0, n_symbols, (n_dialects, n_features))]
+    features[rng.random((n_dialects, n_features)) < missing_rate] = 'MISSING'
+    features[3] = 'MISSING'
+    return features
+
+
+def assert_same(actual, expected):
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    valid = ~np.isnan(expected)
+    assert np.array_equal(actual[valid], expected[valid]) # 逐位一致，不允许误差
+
+
+def test_cal_distance_matches_loop():
+    for seed, block_size in ((0, 64), (1, 7), (2, 1000)):
+        features = synthetic_features(40, 150, seed=seed)
+        assert_same(cal_distance(features, block_size=block_size), cal_distance_loop(features))
+
+
+def test_cal_distance_codes_matches_loop():
+    features = synthetic_features(30, 80, missing_rate=0.5, n_symbols=5, seed=3)
+    codes, _ = encode_transcriptions(features)
+    assert_same(cal_distance_codes(codes, block_size=16, n_jobs=2), cal_distance_loop(features))
+
+
+def test_cal_distance_tiled_matches_loop(tmp_path):
+    fields = {key: synthetic_features(23, 60, seed=seed) for seed, key in enumerate(['initials', 'finals', 'tones'])}
+    result = cal_distance_tiled(fields, output_dir=str(tmp_path), tile_size=5, n_workers=2)
+    expected = {key: cal_distance_loop(features) for key, features in fields.items()}
+    for key in fields:
+        assert_same(result[key], expected[key])
+    assert_same(result['overall'], (expected['initials'] + expected['finals'] + expected['tones']) / 3)
+
+
+def test_cal_distance_tiled_resumes_only_same_data(tmp_path):
+    output_dir = str(tmp_path)
+    first = synthetic_features(12, 40, seed=0)
+    cal_distance_tiled({'initials': first}, output_dir=output_dir, tile_size=4, n_workers=1)
+
+    # 中断: 只保留前两个块的记录，续算结果不变
+    progress_path = os.path.join(output_dir, TILE_PROGRESS_FILE)
+    with open(progress_path) as f:
+        lines = f.read().splitlines()
+    with open(progress_path, 'w') as f:
+        f.write('\n'.join(lines[:3]) + '\n')
+    resumed = cal_distance_tiled({'initials': first}, output_dir=output_dir, tile_size=4, n_workers=1)
+    assert_same(resumed['initials'], cal_distance_loop(first))
+
+    # 同样形状、不同数据必须重新计算，不能沿用旧结果
+    second = synthetic_features(12, 40, seed=1)
+    changed = cal_distance_tiled({'initials': second}, output_dir=output_dir, tile_size=4, n_workers=1)
+    assert_same(changed['initials'], cal_distance_loop(second))
+
+
+def test_unfinished_tiles_are_not_loaded(tmp_path):
+    npy_dir = tmp_path / 'distance_matrices'
+    npz_path = tmp_path / 'distance_matrices.npz'
+    np.savez(npz_path, initials=np.zeros((2, 2)))
+    cal_distance_tiled({'initials': synthetic_features(8, 20)}, output_dir=str(npy_dir), tile_size=4, n_workers=1)
+    config = {'file': str(npz_path), 'npy_dir': str(npy_dir), 'loader': 'numpy_npz'}
+    assert _use_npy_dir(config)
+
+    progress_path = npy_dir / TILE_PROGRESS_FILE
+    lines = progress_path.read_text().splitlines()
+    progress_path.write_text('\n'.join(lines[:-1]) + '\n')
+    assert not _use_npy_dir(config)
+
+    # 完成后又更新过的 npz 优先
+    progress_path.write_text('\n'.join(lines) + '\n')
+    assert _use_npy_dir(config)
+    os.utime(npz_path, ns=(progress_path.stat().st_mtime_ns + 10 ** 9,) * 2)
+    assert not _use_npy_dir(config)
+
+
+def test_update_distance_matrices_matches_loop():
+    fields = {key: synthetic_features(25, 50, seed=seed) for seed, key in enumerate(['initials', 'finals', 'tones'])}
+    vocabs = {key: encode_transcriptions(features)[1] for key, features in fields.items()}
+    old = {key: cal_distance_loop(features[:20]) for key, features in fields.items()}
+    # 修改第 2、7 行，并追加 5 个方言
+    for seed, features in enumerate(fields.values()):
+        features[[2, 7]] = synthetic_features(2 + 3, 50, seed=10 + seed)[[0, 4]]
+    codes = {key: encode_transcriptions(features, vocab=vocabs[key])[0] for key, features in fields.items()}
+
+    updated, _ = update_distance_matrices(old, codes, rows=[2, 7])
+    expected = {key: cal_distance_loop(features) for key, features in fields.items()}
+    for key in fields:
+        assert_same(updated[key], expected[key])
+    assert_same(updated['overall'], (expected['initials'] + expected['finals'] + expected['tones']) / 3)
+
+
+def test_update_distance_files_keeps_other_matrices(tmp_path):
+    fields = {key: synthetic_features(10, 30, seed=seed) for seed, key in enumerate(['initials', 'finals', 'tones'])}
+    matrices = {key: cal_distance_loop(features) for key, features in fields.items()}
+    matrices['overall'] = (matrices['initials'] + matrices['finals'] + matrices['tones']) / 3
+    matrices['overall_graded'] = matrices['overall'] / 2
+    matrix_path, info_path = str(tmp_path / 'distance_matrices.npz'), str(tmp_path / 'processed_info.pkl')
+    np.savez_compressed(matrix_path, **matrices)
+    with open(info_path, 'wb') as f:
+        pickle.dump({'areas': ['a'] * 10, 'slice': ['s'] * 10, 'slices': ['s'] * 10, 'coords': [[0, 0]] * 10}, f)
+
+    initials, vocab = encode_transcriptions(fields['initials'])
+    initials[4] = initials[5]
+    update_distance_files({'initials': initials}, rows=[4], matrix_path=matrix_path, info_path=info_path)
+
+    with np.load(matrix_path) as saved:
+        assert sorted(saved.files) == ['finals', 'initials', 'overall', 'tones']
+        assert_same(saved['initials'], cal_distance_loop(vocab[initials]))
+        assert_same(saved['finals'], matrices['finals'])
+        assert_same(saved['overall'], (saved['initials'] + matrices['finals'] + matrices['tones']) / 3)
+
+
+def levenshtein(a, b):
+    """Plain edit distance with unit insertion, deletion and substitution costs."""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def test_unit_costs_reproduce_cal_distance():
+    features = synthetic_features(40, 60)
+    codes, vocab = encode_transcriptions(features)
+    costs = 1.0 - np.eye(len(vocab))
+    costs[MISSING_CODE, :] = costs[:, MISSING_CODE] = 0.0
+    assert_same(cal_graded_distance(codes, costs=costs, block_size=16), cal_distance_codes(codes))
+    assert_same(cal_graded_distance(features, costs=costs), cal_distance_loop(features))
+
+
+def test_graded_costs_are_normalized_levenshtein():
+    features = np.array([['an', 'ian', 'ts', 'MISSING'],
+                         ['aŋ', 'ian', 'tsʰ', 'y'],
+                         ['y', 'MISSING', 's', 'yn'],
+                         ['an', 'iaŋ', 'ts', 'MISSING']], dtype=object)
+    codes, vocab = encode_transcriptions(features)
+    costs = symbol_costs(vocab, chunk_size=3)
+    for a, symbol_a in enumerate(vocab[1:], 1):
+        for b, symbol_b in enumerate(vocab[1:], 1):
+            expected = levenshtein(symbol_a, symbol_b) / max(len(symbol_a), len(symbol_b))
+            assert costs[a, b] == expected, (symbol_a, symbol_b)
+    assert not costs[MISSING_CODE].any() and not costs[:, MISSING_CODE].any()
+
+    expected = np.zeros((4, 4))
+    for i in range(4):
+        for j in range(4):
+            both = (features[i] != 'MISSING') & (features[j] != 'MISSING')
+            pair_costs = [levenshtein(x, y) / max(len(x), len(y)) for x, y in zip(features[i][both], features[j][both])]
+            expected[i, j] = np.mean(pair_costs)
+    np.testing.assert_allclose(cal_graded_distance(features), expected, rtol=1e-12, atol=0)
+    assert cal_graded_distance(features)[0, 1] == pytest.approx((0.5 + 0 + 1 / 3) / 3)
@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+from scipy.spatial.distance import pdist, squareform
+
+import embedding
+from embedding import classical_mds, embed
+from load import CondensedDistanceMatrix
+
+
+def planar_configuration(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # 两个轴方差不同，特征值不会重合
+    return rng.normal(size=(n, 2)) * [3.0, 1.0]
+
+
+def procrustes_residual(points, reference):
+    """Largest deviation of `points` from `reference` after centring and the best rotation/reflection."""
+    points, reference = points - points.mean(axis=0), reference - reference.mean(axis=0)
+    u, _, vt = np.linalg.svd(points.T @ reference)
+    return np.abs(points @ u @ vt - reference).max()
+
+
+@pytest.mark.parametrize('n', [3, 40])
+def test_classical_mds_recovers_planar_configuration(n):
+    # n=3 走完整分解，n=40 走 eigsh
+    points = planar_configuration(n)
+    dist = squareform(pdist(points))
+    coords = classical_mds(dist, n_components=2)
+    assert coords.shape == (n, 2)
+    np.testing.assert_allclose(pdist(coords), pdist(points), atol=1e-8)
+    assert procrustes_residual(coords, points) < 1e-8
+    np.testing.assert_array_equal(classical_mds(dist, n_components=2), coords)
+
+
+def test_classical_mds_extra_components_are_zero():
+    points = planar_configuration(25, seed=1)
+    coords = classical_mds(squareform(pdist(points)), n_components=4)
+    np.testing.assert_allclose(coords[:, 2:], 0, atol=1e-6)
+    np.testing.assert_allclose(pdist(coords[:, :2]), pdist(points), atol=1e-8)
+
+
+def test_second_embed_reads_cache(tmp_path, monkeypatch):
+    dist = squareform(pdist(planar_configuration(30, seed=2)))
+    indices = [5, 0, 17, 3, 22, 9, 11]
+    first = embed(dist, indices=indices, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("embedding recomputed instead of read from the cache")
+
+    monkeypatch.setitem(embedding.METHODS, 'mds', fail)
+    np.testing.assert_array_equal(embed(dist, indices=indices, cache_dir=str(tmp_path)), first)
+    # 不同的子集、压缩矩阵 (哈希的是上三角向量) 使用不同的缓存键
+    with pytest.raises(AssertionError):
+        embed(dist, indices=indices[:-1], cache_dir=str(tmp_path))
+    with pytest.raises(AssertionError):
+        embed(CondensedDistanceMatrix(squareform(dist)), indices=indices, cache_dir=str(tmp_path))
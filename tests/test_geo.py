@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from geo import GeoIndex, haversine
+
+
+def random_coords(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(97, 123, n), rng.uniform(20, 45, n)])
+
+
+def test_query_matches_haversine_brute_force():
+    coords, points = random_coords(200), random_coords(30, seed=1)
+    result = GeoIndex(coords).query(points, k=5)
+    brute = haversine(points[:, None, 0], points[:, None, 1], coords[None, :, 0], coords[None, :, 1])
+    expected = np.argsort(brute, axis=1)[:, :5]
+    np.testing.assert_array_equal(result['indices'], expected)
+    np.testing.assert_allclose(result['distances_km'], np.take_along_axis(brute, expected, axis=1), rtol=1e-9)
+
+
+def test_majority_vote_on_known_locations():
+    # 北京附近两个点标为 A，上海附近三个点标为 B
+    coords = [[116.40, 39.90], [116.50, 39.95], [121.47, 31.23], [121.50, 31.30], [121.40, 31.10]]
+    index = GeoIndex(coords, labels={'areas': ['A', 'A', 'B', 'B', 'B']})
+    result = index.query([[116.45, 39.92], [121.45, 31.20], [117.0, 39.0]], k=3, vote=True)
+    assert list(result['areas_vote']) == ['A', 'B', 'A']
+    assert list(result['areas'][0]) == ['A', 'A', 'B']
+    # 同票时归更近的邻居
+    assert index.query([[116.3, 39.8]], k=4, vote=True)['areas_vote'][0] == 'A'
+    assert index.query([[121.2, 31.0]], k=1, vote=True)['areas_vote'][0] == 'B'
+
+
+def test_k_is_clamped_to_the_number_of_locations():
+    coords = random_coords(4)
+    index = GeoIndex(coords, labels={'areas': ['A', 'B', 'C', 'D']})
+    result = index.query(coords[:2], k=10, vote=True)
+    assert result['indices'].shape == (2, 4)
+    assert np.isfinite(result['distances_km']).all()
+    with pytest.raises(ValueError):
+        index.query(coords[:2], k=0)
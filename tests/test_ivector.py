@@ -0,0 +1,69 @@
+import os
+import numpy as np
+
+from ivector import UBM, IVectorExtractor, baum_welch_stats, extract_group_ivectors
+
+
+def synthetic_stats(n_recordings=40, n_components=4, dim=3, rank=2, n_frames=300, seed=0):
+    """UBM and Baum-Welch statistics of recordings whose component means are shifted by T w."""
+    rng = np.random.default_rng(seed)
+    ubm = UBM(np.full(n_components, 1 / n_components), rng.normal(scale=4.0, size=(n_components, dim)),
+              rng.uniform(0.5, 1.5, (n_components, dim)))
+    t_true = rng.normal(size=(n_components, dim, rank))
+    n_stats, f_stats = [], []
+    for _ in range(n_recordings):
+        shifted = ubm.means + t_true @ rng.normal(size=rank)
+        labels = rng.choice(n_components, n_frames, p=ubm.weights)
+        frames = shifted[labels] + rng.normal(size=(n_frames, dim)) * np.sqrt(ubm.variances[labels])
+        n_u, f_u = baum_welch_stats(frames, ubm, block_size=128)
+        n_stats.append(n_u)
+        f_stats.append(f_u)
+    return ubm, np.array(n_stats), np.array(f_stats)
+
+
+def log_likelihood(extractor, n_stats, f_stats):
+    """Total-variability log-likelihood of the statistics, up to terms that do not depend on T."""
+    C, D, R = extractor.T.shape
+    f_tilde = extractor._normalized_first_order(n_stats, f_stats).reshape(len(n_stats), C * D)
+    t_flat = extractor.T.reshape(C * D, R)
+    total = 0.0
+    for n_u, f_u in zip(n_stats, f_tilde):
+        precision = np.eye(R) + np.einsum('c,cdr,cds->rs', n_u, extractor.T, extractor.T)
+        linear = t_flat.T @ f_u
+        total += 0.5 * linear @ np.linalg.solve(precision, linear) - 0.5 * np.linalg.slogdet(precision)[1]
+    return total
+
+
+def test_training_does_not_decrease_log_likelihood():
+    ubm, n_stats, f_stats = synthetic_stats()
+    extractor = IVectorExtractor(ubm, rank=2, seed=1)
+    history = [log_likelihood(extractor, n_stats, f_stats)]
+    for _ in range(8):
+        # batch_size 小于录音数，累加器跨批次更新
+        extractor.train(n_stats, f_stats, n_iter=1, batch_size=7)
+        history.append(log_likelihood(extractor, n_stats, f_stats))
+    assert np.all(np.diff(history) >= -1e-8 * np.abs(history[1:]))
+    assert history[-1] > history[0]
+
+
+def test_train_independent_of_batch_size():
+    ubm, n_stats, f_stats = synthetic_stats(n_recordings=20, seed=2)
+    small = IVectorExtractor(ubm, rank=2, seed=3).train(n_stats, f_stats, n_iter=3, batch_size=3)
+    whole = IVectorExtractor(ubm, rank=2, seed=3).train(n_stats, f_stats, n_iter=3, batch_size=64)
+    np.testing.assert_allclose(small.T, whole.T, rtol=1e-10, atol=1e-12)
+
+
+def test_extract_shapes(tmp_path):
+    ubm, n_stats, f_stats = synthetic_stats(n_recordings=12, n_components=3, dim=2, rank=2, seed=4)
+    extractor = IVectorExtractor(ubm, rank=2, seed=0).train(n_stats, f_stats, n_iter=2)
+    ivectors = extractor.extract(n_stats, f_stats)
+    assert ivectors.shape == (12, 2) and np.isfinite(ivectors).all()
+    np.testing.assert_allclose(extractor.extract(n_stats[5], f_stats[5]), ivectors[5:6])
+
+    groups = np.array(['b', 'a', 'c'] * 4)
+    output_path = os.path.join(tmp_path, 'ivectors.npz')
+    features, names = extract_group_ivectors(extractor, n_stats, f_stats, groups, output_path=output_path)
+    assert features.shape == (3, 2) and list(names) == ['b', 'a', 'c']
+    with np.load(output_path) as saved:
+        np.testing.assert_array_equal(saved['features'], features)
+        assert list(saved['dialect_names']) == ['b', 'a', 'c']
@@ -0,0 +1,35 @@
+import pickle
+import numpy as np
+import pytest
+
+from load import load_feats, DATASET_CONFIG
+
+
+@pytest.fixture
+def info_dataset(tmp_path):
+    path = tmp_path / 'processed_info.pkl'
+    with open(path, 'wb') as f:
+        pickle.dump({'areas': ['北京官话', '吴语'], 'slice': ['无', '太湖片'], 'slices': ['无', '太湖片'],
+                     'coords': [[116.4, 39.9], [121.5, 31.2]],
+                     'word_names': np.array(['0001多', '0002拖'], dtype=object)}, f)
+    DATASET_CONFIG['_TestInfo'] = {'info': dict(DATASET_CONFIG['Data4']['info'], file=str(path))}
+    yield '_TestInfo'
+    DATASET_CONFIG.pop('_TestInfo')
+
+
+def test_cached_pickle_values_are_not_shared_mutably(info_dataset):
+    first = load_feats(info_dataset, type='info')
+    first['areas'].append('X')
+    first['coords'][0][0] = 0.0
+    with pytest.raises(ValueError):
+        first['word_names'][0] = 'X'
+
+    second = load_feats(info_dataset, type='info')
+    assert second['areas'] == ['北京官话', '吴语']
+    assert second['coords'][0] == [116.4, 39.9]
+
+
+def test_uncached_arrays_are_writable(info_dataset):
+    fresh = load_feats(info_dataset, type='info', cache=False)
+    fresh['word_names'][0] = 'X'
+    assert load_feats(info_dataset, type='info')['word_names'][0] == '0001多'
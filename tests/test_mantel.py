@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import pdist, squareform
+from scipy.stats import pearsonr, spearmanr
+
+from mantel import mantel, pairwise_mantel
+
+
+def related_matrices(n=25, seed=0):
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(n, 3))
+    x = squareform(pdist(points))
+    y = squareform(pdist(points + rng.normal(scale=0.7, size=points.shape)))
+    z = squareform(pdist(rng.normal(size=(n, 2))))
+    return x, y, z
+
+
+@pytest.mark.parametrize('method, reference', [('pearson', pearsonr), ('spearman', spearmanr)])
+def test_r_matches_scipy(method, reference):
+    x, y, z = related_matrices()
+    cx, cy, cz = (squareform(m, checks=False) for m in (x, y, z))
+    assert mantel(x, y, method=method, permutations=0)['r'] == pytest.approx(reference(cx, cy)[0])
+    r_xy, r_xz, r_yz = reference(cx, cy)[0], reference(cx, cz)[0], reference(cy, cz)[0]
+    partial = (r_xy - r_xz * r_yz) / np.sqrt((1 - r_xz ** 2) * (1 - r_yz ** 2))
+    assert mantel(x, y, z, method=method, permutations=0)['r'] == pytest.approx(partial)
+    results = pairwise_mantel({'x': x, 'y': y, 'z': cz}, method=method, permutations=0)
+    assert results[('x', 'z')]['r'] == pytest.approx(reference(cx, cz)[0])
+    assert results[('y', 'z')]['r'] == pytest.approx(r_yz)
+
+
+def test_null_matches_brute_force_permutations():
+    x, y, _ = related_matrices(n=12)
+    result = mantel(x, y, permutations=30, batch_size=8, n_workers=2, seed=3)
+    cy = squareform(y, checks=False)
+    expected = []
+    for seed_seq, size in zip(np.random.SeedSequence(3).spawn(4), [8, 8, 8, 6]):
+        rng = np.random.default_rng(seed_seq)
+        for _ in range(size):
+            p = rng.permutation(len(x))
+            expected.append(pearsonr(squareform(x[np.ix_(p, p)], checks=False), cy)[0])
+    np.testing.assert_allclose(result['null'], expected, atol=1e-12)
+    assert result['p_value'] == (np.sum(np.array(expected) >= result['r']) + 1) / 31
+
+
+def test_null_is_reproducible_across_worker_counts():
+    x, y, z = related_matrices(n=30)
+    runs = [mantel(x, y, z, permutations=50, batch_size=7, n_workers=workers, seed=11) for workers in (1, 3)]
+    np.testing.assert_array_equal(runs[0]['null'], runs[1]['null'])
+    assert runs[0]['p_value'] == runs[1]['p_value']
+    other_seed = mantel(x, y, z, permutations=50, batch_size=7, n_workers=1, seed=12)
+    assert not np.array_equal(runs[0]['null'], other_seed['null'])
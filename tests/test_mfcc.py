@@ -0,0 +1,61 @@
+import csv
+import wave
+import numpy as np
+
+from mfcc import MFCCExtractor, add_deltas, iter_mfcc_chunks, aggregate_mfcc, N_CEPS
+
+
+def write_wav(path, seconds=2.0, sample_rate=16000, freq=220.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = 0.5 * np.sin(2 * np.pi * freq * t) + 0.05 * rng.standard_normal(len(t))
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((signal * 20000).astype('<i2').tobytes())
+
+
+def whole_file_mfcc(path):
+    with wave.open(str(path), 'rb') as wav_file:
+        extractor = MFCCExtractor(wav_file.getframerate())
+        samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2').astype(np.float64)
+    emphasized = np.append(samples[0], samples[1:] - extractor.preemphasis * samples[:-1])
+    return add_deltas(extractor.static(emphasized))
+
+
+def test_chunked_extraction_equals_whole_file(tmp_path):
+    path = tmp_path / 'a.wav'
+    write_wav(path)
+    expected = whole_file_mfcc(path)
+    assert expected.shape == (198, 3 * N_CEPS)
+    for chunk_seconds in (0.05, 0.3, 10.0):
+        chunked = np.vstack(list(iter_mfcc_chunks(str(path), chunk_seconds=chunk_seconds)))
+        np.testing.assert_allclose(chunked, expected, rtol=0, atol=1e-10)
+
+
+def test_aggregate_mfcc_outputs(tmp_path):
+    rows = [('a.wav', '吴语', '太湖片'), ('b.wav', '吴语', ''), ('c.wav', '粤语', '广府片')]
+    for seed, (name, _, _) in enumerate(rows):
+        write_wav(tmp_path / name, seconds=1.0 + seed * 0.5, freq=200.0 + 100 * seed, seed=seed)
+    manifest = tmp_path / 'manifest.csv'
+    with open(manifest, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'area', 'slice'])
+        writer.writerows(rows)
+
+    dialect_path, slice_path = tmp_path / 'dialect.npz', tmp_path / 'slice.npz'
+    aggregate_mfcc(str(tmp_path), str(manifest), dialect_output_path=str(dialect_path),
+                   slice_output_path=str(slice_path), n_workers=2, chunk_seconds=0.2)
+
+    with np.load(dialect_path) as dialect:
+        assert sorted(dialect.files) == ['dialect_names', 'features', 'frame_counts', 'variances']
+        assert list(dialect['dialect_names']) == ['吴语', '粤语']
+        assert dialect['features'].shape == dialect['variances'].shape == (2, 3 * N_CEPS)
+        wu = np.vstack([whole_file_mfcc(tmp_path / 'a.wav'), whole_file_mfcc(tmp_path / 'b.wav')])
+        assert dialect['frame_counts'][0] == len(wu)
+        np.testing.assert_allclose(dialect['features'][0], wu.mean(axis=0), rtol=1e-5, atol=1e-4)
+    with np.load(slice_path) as slices:
+        assert sorted(slices.files) == ['features', 'frame_counts', 'slice_names', 'variances']
+        assert list(slices['slice_names']) == ['太湖片', '广府片']
+        assert slices['features'].shape == (2, 3 * N_CEPS)
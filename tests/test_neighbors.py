@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist, pdist, squareform
+
+from load import CondensedDistanceMatrix
+from neighbors import NeighborIndex, top_k_from_distances, top_k_from_features
+
+
+def random_matrix(n=40, seed=0, nan_pairs=5):
+    rng = np.random.default_rng(seed)
+    dist = squareform(pdist(rng.normal(size=(n, 4))))
+    i, j = rng.integers(0, n, (2, nan_pairs))
+    dist[i, j] = dist[j, i] = np.nan
+    np.fill_diagonal(dist, 0)
+    return dist
+
+
+def argsort_reference(dist, k):
+    """Full argsort with NaN pairs (inf) last and the row itself after them."""
+    full = np.where(np.isnan(dist), np.inf, dist)
+    np.fill_diagonal(full, np.nan) # 自身排在所有 inf 之后
+    order = np.argsort(full, axis=1, kind='stable')[:, :k]
+    return order, np.take_along_axis(full, order, axis=1)
+
+
+@pytest.mark.parametrize('k', [1, 7, 39, 100])
+def test_top_k_from_distances_matches_argsort(k):
+    dist = random_matrix()
+    expected_idx, expected_dist = argsort_reference(dist, min(k, len(dist) - 1))
+    for matrix in (dist, CondensedDistanceMatrix(squareform(dist, checks=False).astype(np.float32))):
+        indices, distances = top_k_from_distances(matrix, k=k, row_block=16)
+        np.testing.assert_allclose(distances, expected_dist, rtol=1e-6)
+        # 距离为 inf (缺失) 的方言对之间顺序任意，只比较有限部分
+        finite = np.isfinite(expected_dist)
+        np.testing.assert_array_equal(indices[finite], expected_idx[finite])
+        assert all(set(a) == set(b) for a, b in zip(indices, expected_idx))
+
+
+def test_top_k_from_features_matches_argsort():
+    features = np.random.default_rng(1).normal(size=(50, 6))
+    for metric in ('cosine', 'euclidean'):
+        indices, distances = top_k_from_features(features, k=5, metric=metric, batch_size=16)
+        expected_idx, expected_dist = argsort_reference(cdist(features, features, metric=metric), 5)
+        np.testing.assert_array_equal(indices, expected_idx)
+        np.testing.assert_allclose(distances, expected_dist, rtol=1e-5, atol=1e-6)
+
+
+def test_degenerate_k():
+    indices, distances = top_k_from_distances(np.zeros((1, 1)), k=5)
+    assert indices.shape == distances.shape == (1, 0)
+    with pytest.raises(ValueError):
+        top_k_from_distances(random_matrix(), k=0)
+    with pytest.raises(ValueError):
+        top_k_from_features(np.ones((3, 2)), k=-1)
+
+
+def test_query_filters_match_argsort():
+    dist = random_matrix()
+    areas = np.array(['北京官话', '西南官话', '吴语', '粤语'])[np.arange(len(dist)) % 4]
+    index = NeighborIndex(*top_k_from_distances(dist, k=len(dist) - 1), labels={'areas': areas})
+    full_idx, full_dist = argsort_reference(dist, len(dist) - 1)
+    wanted = ['西南官话', '吴语']
+    results = index.query([0, 5, 11], k=6, filters={'areas': wanted})
+    for row, result in zip([0, 5, 11], results):
+        keep = np.isin(areas[full_idx[row]], wanted)
+        np.testing.assert_array_equal(result['indices'], full_idx[row][keep][:6])
+        np.testing.assert_allclose(result['distances'], full_dist[row][keep][:6], rtol=1e-6)
+        assert set(result['areas']) <= set(wanted)
+    single = index.query(3, k=4)
+    np.testing.assert_array_equal(single['indices'], full_idx[3][:4])
+    with pytest.raises(ValueError):
+        index.query(3, k=0)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from preprocess import FIELDS, MissingValueFilter
+
+
+def synthetic_raw(n=30, m=40, seed=0):
+    rng = np.random.default_rng(seed)
+    symbols = np.array(['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+    p = np.array([0.3, 0.25, 0.2, 0.15, 0.06, 0.03, 0.01])
+    raw = {}
+    for field in FIELDS:
+        table = rng.choice(symbols, size=(n, m), p=p).astype(object)
+        table[rng.random((n, m)) < 0.08] = 'MISSING'
+        table[rng.integers(0, n, 3)] = np.where(rng.random((3, m)) < 0.6, 'MISSING', table[:3])
+        table[:, rng.integers(0, m, 3)] = np.where(rng.random((n, 3)) < 0.6, 'MISSING', table[:, :3])
+        raw[field] = table
+    raw['word_name'] = [f'{i:04d}字' for i in range(m)]
+    raw['area'] = [f'area{i % 4}' for i in range(n)]
+    return raw
+
+
+def notebook_pipeline(raw, missing_ratio, freq_cutoff):
+    """Section 4.2 as done in code.ipynb: mark rare symbols, drop rows/columns over the threshold."""
+    tables, drop_rows, drop_cols = {}, set(), set()
+    for field in FIELDS:
+        table = np.array(raw[field], dtype=object)
+        symbols, counts = np.unique(table.astype(str), return_counts=True)
+        rare = set(symbols[counts < freq_cutoff])
+        table[np.isin(table.astype(str), list(rare))] = 'MISSING'
+        missing = table == 'MISSING'
+        n_rows, n_cols = table.shape
+        drop_rows |= set(np.flatnonzero(missing.sum(axis=1) / n_cols * 100 > missing_ratio).tolist())
+        drop_cols |= set(np.flatnonzero(missing.sum(axis=0) / n_rows * 100 > missing_ratio).tolist())
+        tables[field] = table
+    drop_rows, drop_cols = sorted(drop_rows), sorted(drop_cols)
+    processed = {field: np.delete(np.delete(table, drop_rows, axis=0), drop_cols, axis=1)
+                 for field, table in tables.items()}
+    return drop_rows, drop_cols, processed
+
+
+def loop_distance(features):
+    n = len(features)
+    dist = np.full((n, n), np.nan)
+    valid = features != 'MISSING'
+    for i in range(n):
+        dist[i, i] = 0.0
+        for j in range(i + 1, n):
+            both = valid[i] & valid[j]
+            if both.sum() > 0:
+                dist[i, j] = dist[j, i] = np.sum(features[i][both] != features[j][both]) / both.sum()
+    return dist
+
+
+@pytest.mark.parametrize('missing_ratio, freq_cutoff', [(20, 1), (30, 30), (30, 80), (50, 200)])
+def test_matches_notebook_pipeline(missing_ratio, freq_cutoff):
+    raw = synthetic_raw()
+    flt = MissingValueFilter(raw)
+    selection = flt.select(missing_ratio=missing_ratio, freq_cutoff=freq_cutoff)
+    drop_rows, drop_cols, expected = notebook_pipeline(raw, missing_ratio, freq_cutoff)
+    n, m = flt.shape
+    np.testing.assert_array_equal(selection['rows'], np.setdiff1d(np.arange(n), drop_rows))
+    np.testing.assert_array_equal(selection['cols'], np.setdiff1d(np.arange(m), drop_cols))
+
+    processed = flt.processed_codes(selection)
+    for field in FIELDS:
+        np.testing.assert_array_equal(np.asarray(flt.vocab[field], dtype=object)[processed[field]], expected[field])
+
+    matrices = flt.distance_matrices(selection)
+    loops = [loop_distance(expected[field]) for field in FIELDS]
+    for key, loop in zip(['initials', 'finals', 'tones'], loops):
+        np.testing.assert_array_equal(matrices[key], loop)
+    np.testing.assert_array_equal(matrices['overall'], (loops[0] + loops[1] + loops[2]) / 3)
+
+    info = flt.processed_info(selection)
+    np.testing.assert_array_equal(info['areas'], np.delete(np.array(raw['area'], dtype=object), drop_rows))
+    np.testing.assert_array_equal(info['word_names'], np.delete(np.array(raw['word_name'], dtype=object), drop_cols))
+
+
+def test_sweep_reuses_select():
+    flt = MissingValueFilter(synthetic_raw())
+    results = flt.sweep(missing_ratios=(20, 30), freq_cutoffs=(10, 50))
+    assert [(r['missing_ratio'], r['freq_cutoff']) for r in results] == [(20, 10), (30, 10), (20, 50), (30, 50)]
+    for result in results:
+        expected = flt.select(result['missing_ratio'], result['freq_cutoff'])
+        np.testing.assert_array_equal(result['rows'], expected['rows'])
+        np.testing.assert_array_equal(result['cols'], expected['cols'])
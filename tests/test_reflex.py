@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from reflex import MC_FIELDS, ReflexIndex
+
+
+CHARS = list('多拖大哥饿河我个爬马茶沙')
+
+
+def synthetic_reflex_data(n_dialects=12, seed=0):
+    rng = np.random.default_rng(seed)
+    word_names = [f'{i + 1:04d}{char}' for i, char in enumerate(CHARS)] + ['0099无']
+    symbols = {'initial': ['p', 't', 'k', 'ts', 'MISSING'], 'final': ['a', 'o', 'ə', 'MISSING'],
+               'tone': ['1', '2', '3', 'MISSING']}
+    transcriptions = {field: rng.choice(values, size=(n_dialects, len(word_names))).astype(object)
+                      for field, values in symbols.items()}
+    data1_info = {'word': CHARS[:-1]} # 最后一个字在 Data1 中缺失
+    for field in MC_FIELDS:
+        values = rng.integers(0, 4, len(CHARS) - 1).astype(float)
+        values[rng.random(len(values)) < 0.15] = np.nan
+        data1_info[field] = values
+    return transcriptions, word_names, data1_info
+
+
+def assert_same_index(updated, fresh):
+    assert updated.n_dialects == fresh.n_dialects
+    for field in MC_FIELDS:
+        np.testing.assert_array_equal(updated.categories[field], fresh.categories[field])
+        np.testing.assert_array_equal(updated.column_cats[field], fresh.column_cats[field])
+        for dialect in range(fresh.n_dialects):
+            expected = fresh.table(dialect, field)
+            actual = updated.table(dialect, field)
+            # 两个索引的词表顺序可能不同，按符号对齐列
+            assert sorted(actual.columns) == sorted(expected.columns)
+            np.testing.assert_array_equal(actual[sorted(actual.columns)].to_numpy(),
+                                          expected[sorted(expected.columns)].to_numpy())
+            np.testing.assert_array_equal(actual.index, expected.index)
+        for key in ('totals', 'dominant_counts', 'entropy'):
+            np.testing.assert_allclose(updated.summaries[field][key], fresh.summaries[field][key])
+        np.testing.assert_allclose(updated.regularity(field), fresh.regularity(field))
+
+
+def test_update_matches_fresh_build(tmp_path):
+    transcriptions, word_names, data1_info = synthetic_reflex_data()
+    ReflexIndex.build(transcriptions, word_names, data1_info).save(str(tmp_path))
+    index = ReflexIndex.load(str(tmp_path))
+
+    rng = np.random.default_rng(1)
+    changed = {field: np.array(table) for field, table in transcriptions.items()}
+    changed['initial'][[1, 4]] = rng.choice(['p', 'm', 'MISSING'], size=(2, len(word_names)))
+    changed['tone'][7, :3] = '5' # 新符号追加到词表末尾
+    appended = synthetic_reflex_data(n_dialects=3, seed=2)[0]
+    changed = {field: np.vstack([table, appended[field]]) for field, table in changed.items()}
+    recategorized = {field: np.array(values) for field, values in data1_info.items()}
+    recategorized['initial'][[0, 5]] = recategorized['initial'][[5, 0]] + 0
+    recategorized['final_1'][2] = 1.0 if recategorized['final_1'][2] != 1.0 else 2.0
+    recategorized['tone'][3] = 9.0 # 类别集合本身改变
+
+    changes = index.update(changed, data1_info=recategorized)
+    assert changes['rows'] == 2 + 1 + 3
+    assert changes['columns'] > 0
+    assert_same_index(index, ReflexIndex.build(changed, word_names, recategorized))
+
+
+def test_changed_word_list_needs_transcriptions():
+    transcriptions, word_names, data1_info = synthetic_reflex_data()
+    index = ReflexIndex.build(transcriptions, word_names, data1_info)
+    with pytest.raises(ValueError):
+        index.update(word_names=word_names[::-1], data1_info=data1_info)
+
+
+def test_merged_rejects_unknown_categories():
+    transcriptions, word_names, data1_info = synthetic_reflex_data()
+    index = ReflexIndex.build(transcriptions, word_names, data1_info)
+    a, b = index.categories['initial'][:2]
+    assert index.merged('initial', a, b).shape == (index.n_dialects,)
+    with pytest.raises(ValueError):
+        index.merged('initial', a, 0.5)
+    with pytest.raises(ValueError):
+        index.merged('initial', a, 99)
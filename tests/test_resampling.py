@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from distance import MISSING_CODE, cal_distance_codes
+from resampling import _replicate_distances, replicate_weights, resample_distances
+
+
+def random_codes(n=14, m=60, missing_rate=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(1, 5, size=(n, m)).astype(np.uint16)
+    codes[rng.random((n, m)) < missing_rate] = MISSING_CODE
+    return codes
+
+
+def test_unit_weights_reproduce_cal_distance():
+    codes = random_codes()
+    n, m = codes.shape
+    dist = _replicate_distances(codes, np.ones((m, 1), dtype=np.float32), 0, n, 0)[:, :, 0]
+    expected = cal_distance_codes(codes)
+    off_diagonal = ~np.eye(n, dtype=bool)
+    np.testing.assert_array_equal(dist[off_diagonal], expected[off_diagonal])
+
+
+def brute_force(fields, weights):
+    """Recompute every replicate as a full distance matrix from repeated/omitted columns."""
+    replicates = {key: [] for key in list(fields) + ['overall']}
+    for b in range(weights.shape[1]):
+        counts = weights[:, b].astype(np.int64)
+        for key, codes in fields.items():
+            replicates[key].append(cal_distance_codes(np.repeat(codes, counts, axis=1)))
+        replicates['overall'].append(sum(replicates[key][-1] for key in fields) / 3)
+    return {key: np.stack(values, axis=2) for key, values in replicates.items()}
+
+
+@pytest.mark.parametrize('method', ['bootstrap', 'jackknife'])
+def test_statistics_match_brute_force(method):
+    fields = {key: random_codes(seed=seed, m=25) for seed, key in enumerate(['initials', 'finals', 'tones'])}
+    n_words = 25
+    result = resample_distances(fields, n_replicates=30, method=method, percentiles=(5, 50, 95), seed=4,
+                                n_workers=2, row_block=4)
+    weights = replicate_weights(n_words, 30, method=method, seed=4)
+    replicates = brute_force(fields, weights)
+    for key, dist in replicates.items():
+        mean = np.nanmean(dist, axis=2)
+        if method == 'jackknife':
+            var = np.nanvar(dist, axis=2) * (dist.shape[2] - 1)
+        else:
+            var = np.nanvar(dist, axis=2, ddof=1)
+        np.testing.assert_allclose(result[key]['mean'], mean, rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(result[key]['var'], var, rtol=1e-9, atol=1e-15)
+        for p in (5, 50, 95):
+            np.testing.assert_allclose(result[key]['percentiles'][p], np.nanpercentile(dist, p, axis=2),
+                                       rtol=1e-12, atol=1e-15)
@@ -0,0 +1,95 @@
+import os
+import pickle
+import numpy as np
+import pytest
+
+from distance import cal_distance
+from load import CondensedDistanceMatrix, EncodedTranscription, ENCODED_META_FILE
+from storage import (save_condensed_matrix, save_condensed_matrices, open_condensed, save_encoded_raw,
+                     convert_raw_pickle, open_encoded_raw)
+from test_distance import synthetic_features
+
+
+def synthetic_raw(n_dialects=12, n_words=9, seed=0):
+    """Dictionary in the layout of Data4/transcription_areas.pkl."""
+    return {
+        'word_name': np.array([f'w{i}' for i in range(n_words)], dtype=object),
+        'area': np.array([f'a{i % 3}' for i in range(n_dialects)], dtype=object),
+        'coords': np.random.default_rng(seed).uniform(100, 120, (n_dialects, 2)),
+        'initial': synthetic_features(n_dialects, n_words, seed=seed),
+        'final': synthetic_features(n_dialects, n_words, n_symbols=5, seed=seed + 1),
+        'tone': synthetic_features(n_dialects, n_words, missing_rate=0.0, n_symbols=4, seed=seed + 2),
+    }
+
+
+@pytest.fixture
+def dense():
+    # 第 3 行全部缺失，对应的距离为 NaN
+    return cal_distance(synthetic_features(15, 40, seed=4))
+
+
+def test_condensed_round_trip(tmp_path, dense):
+    path = os.path.join(tmp_path, 'initial.npy')
+    save_condensed_matrix(dense, path, dtype=np.float64)
+    matrix = CondensedDistanceMatrix(np.load(path, mmap_mode='r'))
+    assert matrix.shape == dense.shape
+
+    np.testing.assert_array_equal(matrix.to_dense(), dense)
+    for i in (0, 3, len(dense) - 1):
+        np.testing.assert_array_equal(matrix.row(i, dtype=np.float64), dense[i])
+    assert matrix.distance(2, 7) == dense[2, 7] and matrix.distance(5, 5) == 0.0
+
+    indices = [7, 2, 7, 3, 0, 2, 14]
+    np.testing.assert_array_equal(matrix.submatrix(indices, dtype=np.float64), dense[np.ix_(indices, indices)])
+
+
+def test_condensed_directory_round_trip(tmp_path, dense):
+    matrices = {'initial': dense, 'tone': cal_distance(synthetic_features(15, 20, n_symbols=4, seed=5))}
+    save_condensed_matrices(matrices, output_dir=str(tmp_path))
+    opened = open_condensed(str(tmp_path))
+    assert sorted(opened) == sorted(matrices)
+    for key, matrix in matrices.items():
+        assert opened[key].values.dtype == np.float32
+        expected = matrix.astype(np.float32)
+        np.testing.assert_array_equal(opened[key].to_dense(dtype=np.float32), expected)
+        np.testing.assert_array_equal(opened[key].row(3), expected[3])
+        indices = [4, 4, 1, 3, 1]
+        np.testing.assert_array_equal(opened[key].submatrix(indices), expected[np.ix_(indices, indices)])
+
+
+def test_save_condensed_rejects_non_square(tmp_path):
+    with pytest.raises(ValueError):
+        save_condensed_matrix(np.zeros((3, 4)), os.path.join(tmp_path, 'bad.npy'))
+
+
+def test_encoded_round_trip(tmp_path):
+    raw = synthetic_raw()
+    save_encoded_raw(raw, output_dir=str(tmp_path))
+    encoded = open_encoded_raw(str(tmp_path))
+    for key in ('initial', 'final', 'tone'):
+        field = encoded[key]
+        assert isinstance(field, EncodedTranscription) and field.codes.dtype == np.uint16
+        assert field.missing_value == 'MISSING'
+        np.testing.assert_array_equal(field.decode(), raw[key])
+        np.testing.assert_array_equal(np.asarray(field), raw[key])
+        np.testing.assert_array_equal(field[[5, 1, 5], 2:6], raw[key][[5, 1, 5], 2:6])
+        np.testing.assert_array_equal(field == 'MISSING', raw[key] == 'MISSING')
+        np.testing.assert_array_equal(field != 's1', raw[key] != 's1')
+        assert not (field == 'not-a-symbol').any()
+
+    with open(os.path.join(tmp_path, ENCODED_META_FILE), 'rb') as f:
+        meta = pickle.load(f)
+    assert sorted(meta) == ['area', 'coords', 'word_name']
+    np.testing.assert_array_equal(meta['coords'], raw['coords'])
+
+
+def test_convert_raw_pickle(tmp_path):
+    raw = synthetic_raw(seed=3)
+    input_path = os.path.join(tmp_path, 'transcription_areas.pkl')
+    with open(input_path, 'wb') as f:
+        pickle.dump(raw, f)
+    output_dir = os.path.join(tmp_path, 'codes')
+    convert_raw_pickle(input_path, output_dir=output_dir)
+    encoded = open_encoded_raw(output_dir)
+    for key in ('initial', 'final', 'tone'):
+        np.testing.assert_array_equal(encoded[key].decode(), raw[key])
@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from utils import draw_2d_embedding, render_figures
+
+
+def test_all_labels_drawn_by_default():
+    X = np.random.default_rng(0).normal(scale=1e-3, size=(40, 2)) # 大量重叠的点
+    ax = Figure().add_subplot()
+    draw_2d_embedding(ax, X, np.array(['甲', '乙'] * 20))
+    assert len(ax.texts) == 40
+    ax = Figure().add_subplot()
+    draw_2d_embedding(ax, X, np.array(['甲', '乙'] * 20), label_spacing=0.5)
+    assert len(ax.texts) < 40
+
+
+def test_render_figures_reports_written_files(tmp_path):
+    rng = np.random.default_rng(0)
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('') # 普通文件，不能在其下创建目录
+    specs = [
+        {'X': rng.normal(size=(30, 2)), 'y_labels': np.array(['a', 'b', 'c'] * 10), 'plot_title': 'mds',
+         'save_path': str(tmp_path / 'plots' / 'mds.png')},
+        {'kind': 'categories', 'data_array': np.array(['a', 'b', 'b']), 'save_path': str(tmp_path / 'counts.png')},
+        {'kind': 'categories', 'data_array': np.array(['a', 'b']), 'save_path': str(blocker / 'failed.png')},
+        {'X': rng.normal(size=(5, 3)), 'y_labels': np.array(['a'] * 5), 'plot_title': 'bad shape',
+         'save_path': str(tmp_path / 'bad.png')},
+    ]
+    saved = render_figures(specs, n_workers=2, dpi=30)
+    assert saved == [specs[0]['save_path'], specs[1]['save_path'], None, None]
+    assert sorted(os.listdir(tmp_path)) == ['blocker', 'counts.png', 'plots']
+    assert os.listdir(tmp_path / 'plots') == ['mds.png']
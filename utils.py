@@ -1,10 +1,17 @@
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm # 导入 font_manager
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.markers import MarkerStyle
+from concurrent.futures import ProcessPoolExecutor
 
 import os
 import typing
 
+_WORKER = {} # 绘图工作进程中已加载的字体，由 initializer 设置一次
+
 def get_cjk_font_prop(font_path):
     """
     尝试加载指定路径的字体文件并返回 FontProperties 对象。
@@ -23,7 +30,22 @@ def get_cjk_font_prop(font_path):
         return None
 
 
-def count_and_plot_categories(data_array, font_path=None, title="类别分布柱状图", xlabel="类别", ylabel="数量"):
+def _draw_category_counts(ax, unique_categories, counts, font_prop=None, title="类别分布柱状图", xlabel="类别", ylabel="数量"):
+    """在给定的 Axes 上绘制类别数量柱状图 (不依赖 pyplot 的当前图形)。"""
+    ax.bar(unique_categories, counts, color='skyblue')
+    text_args = {'fontproperties': font_prop} if font_prop else {} # 字体加载失败时使用默认字体，可能会显示乱码
+    ax.set_title(title, **text_args)
+    ax.set_xlabel(xlabel, **text_args)
+    ax.set_ylabel(ylabel, **text_args)
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right', **text_args) # 旋转x轴标签，避免重叠
+
+    # 在每个柱子上方显示数量
+    for i, count in enumerate(counts):
+        ax.text(i, count + 0.5, str(count), ha='center', va='bottom', **text_args)
+
+
+def count_and_plot_categories(data_array, font_path=None, title="类别分布柱状图", xlabel="类别", ylabel="数量",
+                              font_prop=None, save_path=None, dpi=300):
     """
     统计一维numpy数组中不同类别的数量，并绘制柱状图。
     使用指定的字体路径来显示中文。
@@ -34,16 +56,26 @@ def count_and_plot_categories(data_array, font_path=None, title="类别分布柱
         title (str): 柱状图的标题。
         xlabel (str): x轴的标签。
         ylabel (str): y轴的标签。
+        font_prop (FontProperties, optional): 已加载的字体，提供时不再从 font_path 加载。Defaults to None.
+        save_path (str, optional): 提供时不弹出图形，而是在后台 (不经过 pyplot) 绘制并保存到该路径。Defaults to None.
+        dpi (int): 保存图片的分辨率。
 
     Returns:
         tuple: 包含两个numpy数组，第一个是唯一类别，第二个是对应类别的数量。
     """
+    unique_categories, counts, _ = _count_and_plot(data_array, font_path, title, xlabel, ylabel, font_prop,
+                                                   save_path, dpi)
+    return unique_categories, counts
+
+
+def _count_and_plot(data_array, font_path=None, title="类别分布柱状图", xlabel="类别", ylabel="数量",
+                    font_prop=None, save_path=None, dpi=300):
+    """count_and_plot_categories 的实现，额外返回保存结果 (成功时为 save_path，未保存或失败时为 None)。"""
     if not isinstance(data_array, np.ndarray) or data_array.ndim != 1:
         print("输入必须是一维numpy数组。")
-        return None, None
+        return None, None, None
 
-    font_prop = None
-    if font_path:
+    if font_prop is None and font_path:
         font_prop = get_cjk_font_prop(font_path=font_path)
         if font_prop is None:
              print("\n###########################################################")
@@ -65,35 +97,33 @@ def count_and_plot_categories(data_array, font_path=None, title="类别分布柱
     counts = counts[sorted_indices]
 
     # 绘制柱状图
-    plt.figure(figsize=(10, 6)) # 可以调整图的大小
-    plt.bar(unique_categories, counts, color='skyblue')
-
-    # 应用字体属性到图表元素
-    if font_prop:
-        plt.title(title, fontproperties=font_prop)
-        plt.xlabel(xlabel, fontproperties=font_prop)
-        plt.ylabel(ylabel, fontproperties=font_prop)
-        plt.xticks(rotation=45, ha='right', fontproperties=font_prop) # 旋转x轴标签，避免重叠
-
-        # 在每个柱子上方显示数量，也使用指定字体
-        for i, count in enumerate(counts):
-            plt.text(i, count + 0.5, str(count), ha='center', va='bottom', fontproperties=font_prop)
+    saved = None
+    if save_path:
+        fig = Figure(figsize=(10, 6))
+        _draw_category_counts(fig.add_subplot(), unique_categories, counts, font_prop, title, xlabel, ylabel)
+        fig.tight_layout()
+        saved = _save_figure(fig, save_path, dpi)
     else:
-        # 如果字体加载失败，使用默认字体，可能会显示乱码
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.xticks(rotation=45, ha='right') # 旋转x轴标签，避免重叠
+        fig, ax = plt.subplots(figsize=(10, 6)) # 可以调整图的大小
+        _draw_category_counts(ax, unique_categories, counts, font_prop, title, xlabel, ylabel)
+        fig.tight_layout() # 调整布局，使标签不被裁剪
+        plt.show()
 
-        # 在每个柱子上方显示数量
-        for i, count in enumerate(counts):
-            plt.text(i, count + 0.5, str(count), ha='center', va='bottom')
+    return unique_categories, counts, saved
 
 
-    plt.tight_layout() # 调整布局，使标签不被裁剪
-    plt.show()
-
-    return unique_categories, counts
+def _save_figure(fig, save_path, dpi):
+    """保存 Figure 对象，必要时创建目录。成功时返回 save_path，失败时返回 None。"""
+    save_dir = os.path.dirname(save_path)
+    try:
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+        fig.savefig(save_path, dpi=dpi, bbox_inches='tight', pad_inches=0.1)
+        print(f"Saved plot to {save_path}")
+        return save_path
+    except Exception as e:
+        print(f"Error saving plot {save_path}: {e}")
+        return None
 
 
 import numpy as np
@@ -111,11 +141,15 @@ def plot_2d_embedding_improved(X,                   # 2D 数据 (n_samples, 2)
                                save_path,           # 保存图片的完整路径 (e.g., './plots/pca.png')
                                label_title="区域/标签", # 图例标题
                                font_prop=None,      # 传递获取到的 FontProperties 对象
-                               plot_labels=True     # 是否绘制每个点的文本标签，默认为 True
+                               plot_labels=True,    # 是否绘制每个点的文本标签，默认为 True
+                               label_spacing=0,     # 文本标签的最小间隔 (占坐标范围的比例)，0 表示全部绘制
+                               rasterized=None,     # 是否栅格化散点和标签图层，None 表示点数较多时自动栅格化
+                               dpi=300              # 保存图片的分辨率
                               ):
     """
     生成并保存降维结果的 2D 散点图 (精简版，支持中文)。
-    此版本不包含 adjustText 标签防重叠功能。
+    所有点在一个散点集合中绘制 (逐点的颜色和标记)，重叠的文本标签可按网格稀疏化 (label_spacing)，
+    图形不经过 pyplot 的全局状态，可以在后台进程中批量调用 (见 render_figures)。
 
     Args:
         X (np.ndarray): 2D NumPy 数组，形状为 (n_samples, 2)。
@@ -125,9 +159,12 @@ def plot_2d_embedding_improved(X,                   # 2D 数据 (n_samples, 2)
         label_title (str, optional): 图例的标题。默认为 "区域/标签"。
         font_prop (FontProperties, optional): FontProperties 对象，用于正确显示中文标题、标签和图例。默认为 None。
         plot_labels (bool, optional): 是否在图表中每个点旁边绘制文本标签。如果为 False，则只绘制散点和图例。默认为 True。
+        label_spacing (float, optional): 每个边长为 label_spacing * 坐标范围的网格中最多绘制一个文本标签。默认为 0，即绘制所有标签。
+        rasterized (bool, optional): 栅格化散点和标签图层 (保存为 PDF/SVG 时文件更小、更快)。默认为点数超过 RASTERIZE_ABOVE 时栅格化。
+        dpi (int, optional): 保存图片的分辨率。默认为 300。
 
     Returns:
-        None: 函数不返回任何值，主要副作用是保存图表文件。
+        str or None: 保存成功时返回 save_path，否则返回 None。
     """
     print(f"\n--- Plotting: {plot_title} ---")
     # --- 输入验证 ---
@@ -163,88 +200,11 @@ def plot_2d_embedding_improved(X,                   # 2D 数据 (n_samples, 2)
     # *** 验证结束 ***
 
 
-    # --- 确保保存目录存在 ---
-    save_dir = os.path.dirname(save_path)
-    if save_dir and not os.path.exists(save_dir):
-        try:
-            os.makedirs(save_dir)
-            print(f"Created save directory: {save_dir}")
-        except OSError as e:
-            print(f"Error creating save directory {save_dir}: {e}. Cannot save plot.")
-            return
-
-    # --- 绘图设置 ---
-    plt.figure(figsize=(12, 9))
-    ax = plt.gca() # Get current axes
-
-    unique_labels = np.unique(y_labels)
-    num_unique_labels = len(unique_labels)
-
-    # --- 获取颜色映射 ---
-    try:
-        cmap = plt.get_cmap('tab20', max(20, num_unique_labels))
-    except (ValueError, TypeError) as e:
-        print(f"Warning: Colormap 'tab20' issue ({e}). Falling back to 'viridis'.")
-        try:
-             cmap = plt.get_cmap('viridis', max(20, num_unique_labels))
-        except TypeError:
-             cmap = plt.get_cmap('viridis')
-             print("Warning: Fallback 'viridis' also doesn't support num_unique_labels argument. Using default colors from map.")
-
-    # --- 获取标记类型 ---
-    markers = ['o', 's', '^', 'P', '*', 'X', 'D', 'v', '<', '>', '1', '2', '3', '4', '8', 'p', 'h', 'H', '+', 'x', '|', '_'] * (num_unique_labels // 20 + 1)
-
-    handles = [] # 用于图例
-    # texts 列表和 adjust_text 相关代码已移除
-
-    # --- 绘制散点和（可选的）文本标签 ---
-    for i, name in enumerate(unique_labels):
-        indices = np.where(y_labels == name)[0]
-
-        if len(indices) == 0:
-             print(f"Warning: Label '{name}' has no corresponding data points in X. Skipping.")
-             continue
-
-        # --- 获取颜色 ---
-        try:
-            color = cmap(i / max(1, num_unique_labels - 1))
-        except (TypeError, ValueError):
-             if hasattr(cmap, 'colors') and len(cmap.colors) > 0:
-                  color = cmap.colors[i % len(cmap.colors)]
-             else:
-                  print(f"Error: Could not get color for label '{name}' from colormap. Using default scatter color.")
-                  color = None
-
-
-        marker = markers[i % len(markers)]
-
-        # 绘制散点 (always plot points)
-        scatter = ax.scatter(X[indices, 0], X[indices, 1],
-                           color=color, marker=marker, label=str(name),
-                           s=60, alpha=0.8, edgecolors='w', linewidth=0.5)
-        handles.append(scatter) # 添加到图例句柄
-
-        # *** 根据 plot_labels 参数决定是否添加文本标签 ***
-        if plot_labels:
-            for idx in indices:
-                label_text = str(y_labels[idx]) # 确保标签是字符串
-                text_args = {'fontsize': 9, 'alpha': 0.8}
-                if font_prop:
-                     text_args['fontproperties'] = font_prop
-
-                # 直接绘制文本标签 (不添加到 texts 列表，因为不使用 adjustText)
-                if idx < X.shape[0]: # 避免索引超出范围
-                     ax.text(X[idx, 0], X[idx, 1], label_text, **text_args)
-                else:
-                     print(f"Warning: Index {idx} out of bounds for X ({X.shape[0]} rows) during text label generation. Skipping text label.")
-
-    # --- 提示文本标签是否已绘制 ---
-    if plot_labels:
-        print("Plotting text labels beside points.")
-        print("Note: adjustText is not used, labels may overlap.")
-    else:
-        print("Plotting text labels is disabled (plot_labels=False).")
-
+    # --- 绘图设置 (Figure 对象，不使用 pyplot 的当前图形) ---
+    fig = Figure(figsize=(12, 9))
+    ax = fig.add_subplot()
+    ncol = draw_2d_embedding(ax, X, y_labels, label_title=label_title, font_prop=font_prop, plot_labels=plot_labels,
+                             label_spacing=label_spacing, rasterized=rasterized)
 
     # --- 设置标题、轴标签和网格 (使用 font_prop) ---
     title_props = {'fontsize': 16, 'fontweight': 'bold'}
@@ -258,43 +218,153 @@ def plot_2d_embedding_improved(X,                   # 2D 数据 (n_samples, 2)
     ax.set_ylabel('Component 2', **label_props)
     ax.grid(True, linestyle='--', alpha=0.5)
 
+    # --- 调整布局以适应图例 ---
+    fig.subplots_adjust(right=0.8 if ncol == 1 else 0.7)
+
+    # --- 保存图像 ---
+    return _save_figure(fig, save_path, dpi)
+
+
+RASTERIZE_ABOVE = 5000 # 点数超过该值时默认栅格化散点和标签图层
+MARKERS = ['o', 's', '^', 'P', '*', 'X', 'D', 'v', '<', '>', '1', '2', '3', '4', '8', 'p', 'h', 'H', '+', 'x', '|', '_']
+
+
+def _label_colors(num_unique_labels):
+    """每个标签的 RGBA 颜色，[num_unique_labels, 4]。"""
+    try:
+        cmap = plt.get_cmap('tab20', max(20, num_unique_labels))
+    except (ValueError, TypeError) as e:
+        print(f"Warning: Colormap 'tab20' issue ({e}). Falling back to 'viridis'.")
+        cmap = plt.get_cmap('viridis')
+    return cmap(np.arange(num_unique_labels) / max(1, num_unique_labels - 1))
+
+
+def thin_labels(X, spacing=0.03):
+    """
+    选出需要绘制文本标签的点：每个边长为 spacing * 坐标范围的网格中只保留第一个点。
+
+    Args:
+        X (np.ndarray): 形状为 (n_samples, 2) 的坐标，含 NaN 的点不绘制标签。
+        spacing (float): 网格边长占坐标范围的比例，0 或 None 时保留所有点。
+
+    Returns:
+        np.ndarray: 保留的点的索引 (升序)。
+    """
+    finite = np.flatnonzero(np.isfinite(X).all(axis=1))
+    if not spacing or len(finite) == 0:
+        return finite
+    points = X[finite]
+    span = np.ptp(points, axis=0)
+    span[span == 0] = 1
+    cells = np.floor((points - points.min(axis=0)) / (span * spacing)).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    return finite[np.sort(first)]
+
+
+def draw_2d_embedding(ax, X, y_labels, label_title="区域/标签", font_prop=None, plot_labels=True, label_spacing=0,
+                      rasterized=None):
+    """
+    在给定的 Axes 上绘制散点、文本标签和图例。
+
+    所有点放在同一个散点集合中：颜色、边框颜色通过逐点数组设置，标记形状通过 set_paths 逐点设置，
+    所以绘制开销与标签种类数无关。
+
+    Returns:
+        int: 图例的列数 (用于调整布局)。
+    """
+    y_labels = np.asarray(y_labels)
+    unique_labels, inverse = np.unique(y_labels, return_inverse=True)
+    inverse = inverse.ravel()
+    num_unique_labels = len(unique_labels)
+    if rasterized is None:
+        rasterized = len(X) > RASTERIZE_ABOVE
+
+    colors = _label_colors(num_unique_labels)
+    marker_styles = [MarkerStyle(MARKERS[i % len(MARKERS)]) for i in range(num_unique_labels)]
+    paths = [style.get_path().transformed(style.get_transform()) for style in marker_styles]
+    # 非填充标记 ('1', '+', 'x', ...) 用自身颜色描边，填充标记用白色描边
+    filled = np.array([style.is_filled() for style in marker_styles])
+    edge_colors = np.where(filled[:, None], np.array([1.0, 1.0, 1.0, 1.0]), colors)
+
+    # --- 绘制散点 (一个集合) ---
+    scatter = ax.scatter(X[:, 0], X[:, 1], c=colors[inverse], edgecolors=edge_colors[inverse],
+                         s=60, alpha=0.8, linewidths=0.5, rasterized=rasterized)
+    scatter.set_paths([paths[i] for i in inverse])
+
+    # --- 文本标签 (稀疏化后绘制) ---
+    if plot_labels:
+        text_args = {'fontsize': 9, 'alpha': 0.8, 'rasterized': rasterized}
+        if font_prop:
+            text_args['fontproperties'] = font_prop
+        shown = thin_labels(X, label_spacing)
+        for idx in shown:
+            ax.text(X[idx, 0], X[idx, 1], str(y_labels[idx]), **text_args)
+        print(f"绘制 {len(shown)}/{len(X)} 个文本标签 (label_spacing={label_spacing})。")
+    else:
+        print("Plotting text labels is disabled (plot_labels=False).")
 
     # --- 创建图例 (使用 font_prop) ---
-    legend_labels = [str(name) for name in unique_labels] # 确保图例标签是字符串
+    if num_unique_labels == 0:
+        print("Warning: No data points plotted, skipping legend creation.")
+        return 1
+    handles = [Line2D([], [], linestyle='none', marker=MARKERS[i % len(MARKERS)], markersize=np.sqrt(60),
+                      markerfacecolor=colors[i], markeredgecolor=edge_colors[i], markeredgewidth=0.5, alpha=0.8)
+               for i in range(num_unique_labels)]
     ncol = 1 if num_unique_labels <= 20 else 2
     legend_kwargs = {'loc': 'upper left', 'bbox_to_anchor': (1.03, 1.0),
                      'title': label_title, 'ncol': ncol,
                      'fontsize': 10, 'markerscale': 1.0}
     if font_prop:
         legend_kwargs['prop'] = font_prop
-        # 设置图例标题字体（兼容不同 matplotlib 版本）
-        # legend_title_font = font_prop.copy()
-        # legend_title_font.set_size(12)
-        # legend_kwargs['title_fontproperties'] = legend_title_font # 需要 matplotlib 3.3+
-
-    # 仅当有句柄时才创建图例
-    if handles:
-        legend = ax.legend(handles=handles, labels=legend_labels, **legend_kwargs)
-        # 兼容旧版本 matplotlib 设置图例标题字体的方式
-        if font_prop and 'title_fontproperties' not in legend_kwargs:
-             try:
-                 plt.setp(legend.get_title(), fontproperties=font_prop)
-             except Exception as e:
-                 #print(f"Warning: Could not set legend title font using fallback method: {e}")
-                 pass # 避免不必要的警告
-
-        # --- 调整布局以适应图例 ---
-        plt.subplots_adjust(right=0.8 if ncol == 1 else 0.7)
+    legend = ax.legend(handles=handles, labels=[str(name) for name in unique_labels], **legend_kwargs)
+    if font_prop:
+        plt.setp(legend.get_title(), fontproperties=font_prop)
+    return ncol
 
-    else:
-        print("Warning: No data points plotted, skipping legend creation.")
 
+def _init_render_worker(font_path):
+    matplotlib.use('Agg')
+    _WORKER['font_prop'] = get_cjk_font_prop(font_path) if font_path else None
 
-    # --- 保存图像 ---
+
+def _render_task(spec):
+    spec = dict(spec)
+    kind = spec.pop('kind', 'embedding')
+    spec.setdefault('font_prop', _WORKER.get('font_prop'))
     try:
-         plt.savefig(save_path, dpi=300, bbox_inches='tight', pad_inches=0.1)
-         print(f"Saved plot to {save_path}")
+        if kind == 'embedding':
+            return plot_2d_embedding_improved(**spec)
+        if kind == 'categories':
+            return _count_and_plot(**spec)[2]
+        raise ValueError(f"Unknown figure kind '{kind}', use 'embedding' or 'categories'.")
     except Exception as e:
-         print(f"Error saving plot {save_path}: {e}")
-    finally:
-        plt.close() # 确保图形关闭，释放内存
\ No newline at end of file
+        print(f"Error rendering {spec.get('save_path')}: {e}")
+        return None
+
+
+def render_figures(specs, font_path=None, n_workers=None, dpi=150, label_spacing=0.03):
+    """
+    在后台进程池 (Agg 后端) 中批量绘制并保存图片，每个进程只加载一次中文字体。
+
+    Args:
+        specs (list of dict): 每张图的参数。'kind' 为 'embedding' (默认，其余键为 plot_2d_embedding_improved 的参数)
+                              或 'categories' (其余键为 count_and_plot_categories 的参数，须包含 save_path)。
+                              例如 {'X': xy, 'y_labels': areas, 'plot_title': 't-SNE', 'save_path': 'plots/tsne.png'}。
+        font_path (str, optional): 中文字体文件的路径。
+        n_workers (int, optional): 进程数，默认为 CPU 核数。
+        dpi (int): 未在 spec 中指定 dpi 时使用的分辨率。
+        label_spacing (float): 未在 spec 中指定时 'embedding' 图的文本标签间隔 (见 plot_2d_embedding_improved)，
+                               批量绘图默认稀疏化重叠的标签，0 表示全部绘制。
+
+    Returns:
+        list: 与 specs 顺序一致的保存路径，失败的图为 None。
+    """
+    specs = [dict(spec, dpi=spec.get('dpi', dpi)) for spec in specs]
+    for spec in specs:
+        if spec.get('kind', 'embedding') == 'embedding':
+            spec.setdefault('label_spacing', label_spacing)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_render_worker,
+                             initargs=(font_path,)) as executor:
+        saved = list(executor.map(_render_task, specs))
+    print(f"共绘制 {sum(path is not None for path in saved)}/{len(specs)} 张图。")
+    return saved